@@ -1,21 +1,14 @@
 #Link to OpenRouter's code: https://openrouter.ai/anthropic/claude-opus-4.5/api
-import os, time
 import config
-from openai import OpenAI
-from dotenv import load_dotenv # to read .env files (API key)
-from excel_engine import save_to_excel
-from freecad_engine import freecad_workflow
-from cadquery_engine import cadquery_workflow
-from config import OUTPUT_DIR, Colors as C
-
-# to load the key from the .env file
-load_dotenv()
-
-# call to OpenAI's API (it's also possible to use only python)
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1", # it specify to call OpenRouter instead of ChatGPT
-    api_key=os.getenv("OPENROUTER_API_KEY"), # chiama la chiave senza scriverla in chiaro
-)
+from cache_engine import ResponseCache, get_response_cache
+from scheduler_engine import get_scheduler, StreamBudgetExceeded, RequestCancelled
+from trace_engine import span
+from repair_engine import build_repair_prompt, apply_patch, count_tokens
+from retrieval_engine import retrieval_prompt
+from config import Colors as C
+
+# the calls go through the request scheduler (scheduler_engine.py): one shared async client,
+# rate limits and transport retries; openai and dotenv are imported only at the first API call
 
 # here we define the main prompt that will be integrated with the user's prompt
 # it's importat to specify every single constrain to optimize the result
@@ -49,63 +42,124 @@ IMPORTANT:
 - Do NOT include markdown comments or Python blocks; return only the raw code.
 """
 
+# repair prompt within the token budget (repair_engine.py)
+# Returns: (str: prompt, bool: True if the answer can be a "@@ start-end" patch of previous_code)
 def error_prompt_composer(user_prompt, error_log, previous_code):
-    error_prompt = f"""
-    ORIGINAL TASK: {user_prompt}
-
-    PREVIOUSLY GENERATED CODE:
-    ```python 
-    {previous_code}
-    ```
-    ERROR RETURNED: {error_log} 
-
-    GOAL:
-    Rewrite the entire code to fix the error.
-    Don't provide explanations, just the correct Python code.
-    """
+    error_prompt, patch_mode = build_repair_prompt(user_prompt, error_log, previous_code)
     print(f"{C.YELLOW}WARNING: asking AI to correct some errors.{C.END}")
-    return error_prompt
+    return error_prompt, patch_mode
+
+# per call statistics, plus the average of the run in the TTFT_s and Tokens_per_s columns
+def record_call_stats(run_data, stats):
+    run_data["API_Calls"].append(stats)
+    update_call_averages(run_data)
+
+def update_call_averages(run_data):
+    ttfts = [call["ttft_s"] for call in run_data["API_Calls"] if call["ttft_s"] is not None]
+    speeds = [call["tokens_per_s"] for call in run_data["API_Calls"] if call["tokens_per_s"] is not None]
+    run_data["TTFT_s"] = round(sum(ttfts) / len(ttfts), 3) if ttfts else 0
+    run_data["Tokens_per_s"] = round(sum(speeds) / len(speeds), 1) if speeds else 0
+
+# prompt and completion tokens of the attempt (from the API usage, estimated when it's missing)
+def record_token_counts(run_data, stats, final_prompt, answer, prompt_type):
+    prompt_tokens = (stats or {}).get("prompt_tokens") or count_tokens(MAIN_PROMPT + final_prompt)
+    completion_tokens = (stats or {}).get("completion_tokens") or count_tokens(answer or "")
+    run_data["Attempt_Tokens"].append({
+        "attempt": run_data["Attempts"],
+        "type": prompt_type,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens
+    })
+    run_data["Prompt_Tokens"] += prompt_tokens
+    run_data["Completion_Tokens"] += completion_tokens
+
+# the answer to a patch prompt is applied to the previous code (a complete script is used as it is)
+def _finish_answer(code, previous_code, patch_mode):
+    if patch_mode:
+        patched = apply_patch(previous_code, code)
+        if patched is not None:
+            print("Patch applied to the previous code.")
+            return patched
+    return code
 
 # process the user's request and handles AI code errors
-def generate_cad_code(user_prompt, model_orcode, run_data, error_log = None, previous_code = None):
+# candidate: index of the sample in speculative mode (own cache entry), cancel_event stops the call
+def generate_cad_code(user_prompt, model_orcode, run_data, error_log = None, previous_code = None, candidate = 0, cancel_event = None):
     
+    patch_mode = False
     if error_log and previous_code:
-        final_prompt = error_prompt_composer(user_prompt, error_log, previous_code)
+        final_prompt, patch_mode = error_prompt_composer(user_prompt, error_log, previous_code)
     else:
         final_prompt = user_prompt
+    prompt_type = "patch" if patch_mode else ("repair" if error_log and previous_code else "initial")
+
+    # identical requests are served from the on-disk cache ("readwrite" and "replay" modes)
+    # the first prompt is keyed before the few-shot examples: the index grows with every success, the same
+    # request must still find its recorded answer (replay, batch resume); the examples are in the entry
+    cache = get_response_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = ResponseCache.make_key(model_orcode, MAIN_PROMPT, final_prompt, candidate)
+        entry = cache.get_entry(cache_key) if config.LLM_CACHE_MODE != "write" else None
+        if entry is not None:
+            run_data["Cache_Hits"] += 1
+            retrieval = entry.get("meta", {}).get("retrieval")
+            if retrieval:
+                run_data["Retrieval_Used"] = retrieval["used"]
+                run_data["Retrieval_Score"] = retrieval["score"]
+            print("Answer served from the LLM cache.")
+            return _finish_answer(entry["content"], previous_code, patch_mode)
+
+        if config.LLM_CACHE_MODE == "replay":
+            run_data["Status"] = "CACHE_MISS"
+            run_data["Error_Log"] = "Replay mode: request not found in the LLM cache."
+            print(f"\n{C.YELLOW}ERROR: replay mode, the request is not in the cache.{C.END}\n")
+            return None
+
+    meta = None
+    if prompt_type == "initial":
+        # closest working examples of the past runs in front of the task (retrieval_engine.py)
+        final_prompt = retrieval_prompt(user_prompt, run_data)
+        if final_prompt != user_prompt:
+            meta = {"retrieval": {"used": run_data["Retrieval_Used"], "score": run_data["Retrieval_Score"], "prompt": final_prompt}}
+
+    messages = [
+        {"role": "system", "content": MAIN_PROMPT},
+        {"role": "user", "content": final_prompt},
+    ]
 
     try:
-        # call to OpenRouter
-        completion = client.chat.completions.create(
-            model = model_orcode, # chosen model
-            messages=[
-                {"role": "system", "content": MAIN_PROMPT},
-                {"role": "user", "content": final_prompt},
-            ],
-        )
-        
-        # extracting only the code we're interested in from the json file
-        code = completion.choices[0].message.content
+        with span("generate", run_data, model = model_orcode, repair = bool(error_log and previous_code)):
+            # call to OpenRouter (streamed or not), transport errors are retried by the scheduler
+            code, stats = get_scheduler().complete(model_orcode, messages, config.STREAM_COMPLETIONS, run_data, cancel_event)
+            if config.STREAM_COMPLETIONS:
+                record_call_stats(run_data, stats)
+        record_token_counts(run_data, stats, final_prompt, code, prompt_type)
 
         # basic code cleanup to remove any problematic markdowns
         code = code.replace("```python", "").replace("```", "").strip()
-        return code
+
+        # the raw answer is cached: a replayed patch is applied again to the same previous code
+        if cache is not None and code:
+            cache.put(cache_key, model_orcode, code, meta)
+        return _finish_answer(code, previous_code, patch_mode)
+
+    # the truncated code is useless: this attempt is lost, but the loop goes on
+    except StreamBudgetExceeded as e:
+        record_call_stats(run_data, e.stats)
+        record_token_counts(run_data, e.stats, final_prompt, None, prompt_type)
+        run_data["Status"] = "STREAM_CANCELLED"
+        run_data["Error_Log"] = str(e)
+        print(f"\n{C.YELLOW}WARNING: {e}{C.END}\n")
+        return None
+
+    # another candidate already passed the test (speculative mode)
+    except RequestCancelled:
+        run_data["Status"] = "CANCELLED"
+        return None
 
     except Exception as e:
         run_data["Status"] = "API_ERROR"    # error notification
         run_data["Error_Log"] = str(e)      # error annotation
-        save_to_excel(run_data)
         print(f"\n{C.YELLOW}ERROR: API error occurred.{C.END}\n")
         return None
-
-def workflow_test_manager(run_data, code):
-
-    success = False
-    exec_error = None
-
-    if "import FreeCAD" in code or "import Part" in code:
-        freecad_workflow()
-    else:
-        cadquery_workflow()
-
-    return success, exec_error
\ No newline at end of file
@@ -0,0 +1,273 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+import config
+from config import Colors as C
+
+# Artifact store: SQLite index (ARTIFACT_DB) of the projects and of their files.
+#   - versions: the next _vN of a project name is allocated with one write transaction, so two runs
+#     started at the same time never get the same folder and nothing probes v1, v2, ... on disk
+#     (only the first allocation of a name reads the folders written before the store existed)
+#   - blobs: every script, STEP and mesh is stored once by sha256 in ARTIFACT_BLOB_DIR; the file in
+#     output/<model>/<project>/ stays where it was, as a hard link to its blob (identical files share
+#     the disk space; a plain copy when the file system has no hard links)
+#   - manifest: model, prompt, status, paths, sizes and hashes of every project, queried by index
+#     (latest version, artifacts of a project, projects by model/status, files with the same content)
+# The engines always replace a file (os.replace), never edit it in place; the blobs, and so the project
+# files linked to them, are also read-only (READ_ONLY), so an edit of a saved file can't change every
+# project that shares its content.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    model TEXT NOT NULL,
+    name_base TEXT NOT NULL,
+    last_version INTEGER NOT NULL,
+    PRIMARY KEY (model, name_base)
+);
+CREATE TABLE IF NOT EXISTS projects (
+    model TEXT NOT NULL,
+    project TEXT NOT NULL,
+    name_base TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    prompt TEXT,
+    status TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (model, project)
+);
+CREATE INDEX IF NOT EXISTS projects_status ON projects (model, status);
+CREATE TABLE IF NOT EXISTS artifacts (
+    model TEXT NOT NULL,
+    project TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (model, project, kind)
+);
+CREATE INDEX IF NOT EXISTS artifacts_sha256 ON artifacts (sha256);
+"""
+
+READ_ONLY = 0o444
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ArtifactStore:
+
+    def __init__(self, db_path, blob_dir):
+        self.db_path = db_path
+        self.blob_dir = blob_dir
+        self._local = threading.local()     # one connection per thread
+        self.deduplicated = 0
+        self.saved_bytes = 0
+        self._stats_lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok = True)
+        os.makedirs(blob_dir, exist_ok = True)
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # autocommit: every write transaction is explicit (BEGIN IMMEDIATE)
+            connection = sqlite3.connect(self.db_path, timeout = 30, isolation_level = None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    # highest _vN already on disk, read once for the names created before the store
+    @staticmethod
+    def _legacy_version(output_dir, model_name, name_base):
+        pattern = re.compile(re.escape(name_base) + r"_v(\d+)$")
+        try:
+            names = os.listdir(f"{output_dir}/{model_name}")
+        except FileNotFoundError:
+            return 0
+        return max((int(match.group(1)) for match in map(pattern.match, names) if match), default = 0)
+
+    # next version of model/name_base, atomic across threads and processes
+    def allocate_version(self, output_dir, model_name, name_base):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT last_version FROM versions WHERE model = ? AND name_base = ?", (model_name, name_base)).fetchone()
+            if row is None:
+                version = self._legacy_version(output_dir, model_name, name_base) + 1
+                connection.execute("INSERT INTO versions (model, name_base, last_version) VALUES (?, ?, ?)", (model_name, name_base, version))
+            else:
+                version = row["last_version"] + 1
+                connection.execute("UPDATE versions SET last_version = ? WHERE model = ? AND name_base = ?", (version, model_name, name_base))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return version
+
+    def register_project(self, model_name, project_name, name_base, version, prompt = "", status = "PENDING"):
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO projects (model, project, name_base, version, prompt, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (model_name, project_name, name_base, version, prompt, status, now, now))
+
+    def update_project(self, model_name, project_name, prompt, status):
+        self._connection().execute(
+            "UPDATE projects SET prompt = ?, status = ?, updated = ? WHERE model = ? AND project = ?",
+            (prompt, status, time.time(), model_name, project_name))
+
+    def _blob_path(self, sha256, extension):
+        return os.path.join(self.blob_dir, sha256[:2], sha256 + extension)
+
+    # Stores a file just written in the project folder: the content goes in its blob (once),
+    # the project file becomes a hard link to it. Returns: sha256
+    def add_file(self, model_name, project_name, kind, path):
+        sha256 = file_sha256(path)
+        size = os.path.getsize(path)
+        blob = self._blob_path(sha256, os.path.splitext(path)[1])
+        os.makedirs(os.path.dirname(blob), exist_ok = True)
+        try:
+            if os.path.exists(blob):
+                os.chmod(blob, READ_ONLY)   # blobs stored before they were read-only
+                if not os.path.samefile(blob, path):
+                    # same content already stored: the project file becomes a link to that blob
+                    base, extension = os.path.splitext(path)
+                    tmp_path = f"{base}.link{extension}"
+                    os.link(blob, tmp_path)
+                    os.replace(tmp_path, path)
+                    with self._stats_lock:
+                        self.deduplicated += 1
+                        self.saved_bytes += size
+            else:
+                try:
+                    os.link(path, blob)
+                    os.chmod(blob, READ_ONLY)
+                except FileExistsError:
+                    pass    # another run stored the same content in the meantime
+        except OSError:
+            pass    # no hard links on this file system: the file stays a plain copy
+
+        self._connection().execute(
+            "INSERT OR REPLACE INTO artifacts (model, project, kind, path, sha256, size, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (model_name, project_name, kind, path, sha256, size, time.time()))
+        return sha256
+
+    # ------ MANIFEST QUERIES ------ #
+
+    def latest_version(self, model_name, name_base):
+        row = self._connection().execute("SELECT last_version FROM versions WHERE model = ? AND name_base = ?", (model_name, name_base)).fetchone()
+        return row["last_version"] if row else 0
+
+    def artifacts(self, model_name, project_name):
+        rows = self._connection().execute("SELECT kind, path, sha256, size FROM artifacts WHERE model = ? AND project = ?", (model_name, project_name))
+        return [dict(row) for row in rows]
+
+    # projects with their artifacts, newest first
+    def manifest(self, model_name = None, status = None, limit = 50):
+        query = "SELECT * FROM projects"
+        conditions, args = [], []
+        if model_name:
+            conditions.append("model = ?")
+            args.append(model_name)
+        if status:
+            conditions.append("status = ?")
+            args.append(status)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created DESC LIMIT ?"
+        projects = [dict(row) for row in self._connection().execute(query, args + [limit])]
+        for project in projects:
+            project["artifacts"] = self.artifacts(project["model"], project["project"])
+        return projects
+
+    # every stored file with this content (same script or same STEP from different runs)
+    def same_content(self, sha256):
+        rows = self._connection().execute("SELECT model, project, kind, path FROM artifacts WHERE sha256 = ?", (sha256,))
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        row = self._connection().execute("SELECT COUNT(*) AS files, COUNT(DISTINCT sha256) AS blobs, COALESCE(SUM(size), 0) AS size FROM artifacts").fetchone()
+        return dict(row)
+
+_store = None
+_store_lock = threading.Lock()
+
+# store created the first time it's needed (None when disabled)
+def get_artifact_store():
+    global _store
+    if not config.ARTIFACT_STORE:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore(config.ARTIFACT_DB, config.ARTIFACT_BLOB_DIR)
+    return _store
+
+# creating project output folder with the next version of name_base
+# the version comes from the store index (atomic); without the store makedirs fails on a taken
+# folder, so two parallel runs never get the same version either
+def create_project_folder(output_dir, model_name, name_base, prompt = ""):
+    os.makedirs(f"{output_dir}/{model_name}", exist_ok = True)
+    store = get_artifact_store()
+
+    version = store.allocate_version(output_dir, model_name, name_base) if store else 1
+    while True:
+        project_name = f"{name_base}_v{version}"
+        try:
+            os.makedirs(f"{output_dir}/{model_name}/{project_name}")
+            break
+        except FileExistsError:
+            # folder created outside the store: next version
+            version = store.allocate_version(output_dir, model_name, name_base) if store else version + 1
+    if store:
+        store.register_project(model_name, project_name, name_base, version, prompt)
+    return project_name
+
+# files of a finished run in the store; kind -> path (script, step, stl, glb)
+def store_artifacts(run_data, files):
+    store = get_artifact_store()
+    if store is None:
+        return
+    for kind, path in files.items():
+        if path and os.path.exists(path):
+            try:
+                store.add_file(run_data["Model"], run_data["Project_Name"], kind, path)
+            except (OSError, sqlite3.Error) as e:
+                print(f"{C.YELLOW}WARNING: {kind} of {run_data['Project_Name']} not added to the artifact store: {e}{C.END}")
+
+# final status of the run in the manifest (called when the run record is saved)
+def update_manifest(run_data):
+    store = get_artifact_store()
+    if store is None:
+        return
+    try:
+        store.update_project(run_data["Model"], run_data["Project_Name"], run_data["Prompt"], run_data["Status"])
+    except sqlite3.Error as e:
+        print(f"{C.YELLOW}WARNING: manifest of {run_data['Project_Name']} not updated: {e}{C.END}")
+
+def print_manifest(model_name = None, status = None, limit = 50):
+    store = get_artifact_store()
+    if store is None:
+        print(f"{C.YELLOW}WARNING: the artifact store is disabled (config.ARTIFACT_STORE).{C.END}")
+        return
+    for project in store.manifest(model_name, status, limit):
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(project["created"]))
+        print(f"{C.BOLD}{project['model']}/{project['project']}{C.END}  {project['status']}  {created}  {(project['prompt'] or '')[:60]!r}")
+        for artifact in project["artifacts"]:
+            print(f"    {artifact['kind']:<7} {artifact['size']:>10} B  {artifact['sha256'][:12]}  {artifact['path']}")
+    stats = store.stats()
+    print(f"\n{stats['files']} files, {stats['blobs']} distinct contents, {stats['size'] / 1024 / 1024:.1f} MB indexed.")
+
+def print_artifact_stats():
+    store = _store
+    if store is None or not store.deduplicated:
+        return
+    print(f"Artifact store: {store.deduplicated} identical files linked, {store.saved_bytes / 1024 / 1024:.1f} MB saved.")
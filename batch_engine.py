@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+from config import OUTPUT_DIR, BATCH_DIR, Colors as C
+from workflow_manager import request_manager, create_output_folder
+from excel_engine import init_run_data, start_excel_writer, stop_excel_writer, build_excel_report
+from export_engine import save_when_exported, wait_for_exports
+from cache_engine import print_cache_stats
+from code_validator import print_validator_stats
+from speculative_engine import print_speculation_report
+from trace_engine import write_trace
+from fingerprint_engine import print_convergence_report
+from report_engine import update_report
+from memory_engine import print_memory_stats
+from artifact_store import print_artifact_stats
+
+# Non interactive benchmark: every prompt of a suite is tested with every model (prompt x model matrix).
+# Each finished cell is written in a checkpoint file, so an interrupted batch can be resumed
+# without paying again for the cells already done.
+# The cell that was running when the batch stopped starts from scratch; with QTC_LLM_CACHE=readwrite
+# its API calls are served by the LLM cache (cache_engine.py).
+
+# suite formats:
+#   .jsonl -> one {"name": ..., "prompt": ...} per line
+#   .yaml  -> list of {"name": ..., "prompt": ...} or {name: prompt} mapping (needs PyYAML)
+# an entry can have "reference": STEP file of the expected part (relative to the suite file),
+# the valid results are scored against it (scoring_engine.py)
+def load_suite(suite_path):
+    entries = []
+
+    if suite_path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("PyYAML is needed to read .yaml suites (pip install pyyaml), or use .jsonl")
+        with open(suite_path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or []
+        if isinstance(data, dict):
+            data = [{"name": name, "prompt": prompt} for name, prompt in data.items()]
+        entries = list(data)
+    else:
+        with open(suite_path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError as e:
+                    raise RuntimeError(f"{suite_path}, line {line_number}: invalid json ({e})")
+
+    # names are used as project folder names and checkpoint keys: they must be unique
+    names = set()
+    for entry in entries:
+        if "name" not in entry or "prompt" not in entry:
+            raise RuntimeError(f"every suite entry needs 'name' and 'prompt': {entry}")
+        if entry["name"] in names:
+            raise RuntimeError(f"duplicated prompt name in the suite: {entry['name']}")
+        names.add(entry["name"])
+        if entry.get("reference"):
+            entry["reference"] = os.path.join(os.path.dirname(os.path.abspath(suite_path)), entry["reference"])
+            if not os.path.exists(entry["reference"]):
+                print(f"{C.YELLOW}WARNING: reference of {entry['name']} not found, its results won't be scored: {entry['reference']}{C.END}")
+                entry["reference"] = ""
+    return entries
+
+class Checkpoint:
+
+    def __init__(self, checkpoint_path):
+        self.path = checkpoint_path
+        self.done = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        cell = json.loads(line)
+                    except ValueError:
+                        continue    # half written line (crash while saving)
+                    self.done.add((cell["prompt_name"], cell["model"]))
+
+    def is_done(self, prompt_name, model_name):
+        return (prompt_name, model_name) in self.done
+
+    def mark_done(self, prompt_name, model_name, run_data):
+        cell = {
+            "prompt_name": prompt_name,
+            "model": model_name,
+            "project": run_data["Project_Name"],
+            "status": run_data["Status"]
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(cell) + "\n")
+                f.flush()
+                os.fsync(f.fileno())    # the checkpoint must survive a crash
+            self.done.add((prompt_name, model_name))
+
+# one cell of the matrix: one prompt, one model
+def run_cell(suite_name, entry, model, checkpoint):
+    model_name = model["name"]
+    print(f"\n{C.BOLD}{C.CYAN}BATCH CELL: {entry['name']} x {model_name}{C.END}")
+    project_name = create_output_folder(OUTPUT_DIR, model_name, entry["name"])
+
+    run_data = init_run_data(model_name, project_name, entry["prompt"])
+    run_data["Batch"] = suite_name
+    run_data["Prompt_Name"] = entry["name"]
+    run_data["Reference"] = entry.get("reference") or ""
+
+    request_manager(run_data, entry["prompt"], model["orcode"])
+
+    # the run is saved (after its background exports) before the checkpoint:
+    # a cell marked as done is never missing from the store
+    save_when_exported(run_data, lambda: checkpoint.mark_done(entry["name"], model_name, run_data))
+    return run_data
+
+def run_batch(suite_path, workers = config.BATCH_WORKERS, model_names = None, fresh = False):
+    suite_name = os.path.splitext(os.path.basename(suite_path))[0]
+    entries = load_suite(suite_path)
+
+    models = config.LLM_MODELS
+    if model_names:
+        models = [model for model in config.LLM_MODELS if model["name"] in model_names]
+        unknown = set(model_names) - {model["name"] for model in models}
+        if unknown:
+            print(f"{C.YELLOW}WARNING: unknown models ignored: {', '.join(sorted(unknown))}{C.END}")
+
+    checkpoint_path = f"{BATCH_DIR}/{suite_name}/checkpoint.jsonl"
+    if fresh and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+
+    cells = [(entry, model) for entry in entries for model in models]
+    todo = [(entry, model) for entry, model in cells if not checkpoint.is_done(entry["name"], model["name"])]
+
+    print(f"\n{C.HEADER}{C.BOLD}# --- QueryToCAD BATCH: {suite_name} --- #{C.END}\n")
+    print(f"{len(entries)} prompts x {len(models)} models = {len(cells)} cells, "
+          f"{len(cells) - len(todo)} already done, {len(todo)} to run with {workers} workers.")
+
+    start_batch = time.time()
+    completed = 0
+    start_excel_writer()
+    pool = ThreadPoolExecutor(max_workers = workers)
+    try:
+        futures = {pool.submit(run_cell, suite_name, entry, model, checkpoint): (entry["name"], model["name"]) for entry, model in todo}
+        for future in as_completed(futures):
+            prompt_name, model_name = futures[future]
+            try:
+                run_data = future.result()
+                completed += 1
+                print(f"{C.BOLD}[{completed}/{len(todo)}] {prompt_name} x {model_name}: {run_data['Status']}{C.END}")
+            except Exception as e:
+                print(f"{C.RED}ERROR: cell {prompt_name} x {model_name} crashed, it will run again on resume.\n{e}{C.END}")
+        pool.shutdown()
+
+    except KeyboardInterrupt:
+        # the cells not started yet are dropped, the finished ones are already in the checkpoint
+        pool.shutdown(wait = False, cancel_futures = True)
+        print(f"\n{C.YELLOW}WARNING: batch interrupted. Run the same command again to resume it.{C.END}")
+        raise
+
+    finally:
+        wait_for_exports()
+        stop_excel_writer()
+
+    update_report()
+    if config.EXCEL_REPORT:
+        build_excel_report()
+    print(f"\nTotal batch time: {round(time.time() - start_batch, 2)}s")
+    print_cache_stats()
+    print_validator_stats()
+    print_speculation_report()
+    print_memory_stats()
+    print_artifact_stats()
+    print_convergence_report()
+    write_trace()
+    print(f"\n{C.HEADER}{C.BOLD}# --- BATCH COMPLETED --- #{C.END}\n")
@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline end-to-end benchmark: request_manager runs from the prompt to the STEP file against
+# mock_openrouter.py (no network, no API key, no cost), with canned good and bad scripts:
+#   box     -> valid CadQuery script at the first attempt
+#   repair  -> script that fails at runtime, fixed after the repair prompt
+#   reject  -> script without 'result' (rejected by the validator), fixed after the repair prompt
+# Every stage is a span (trace_engine.py): generate, validate, test_exec, analyze, export, log...
+# The report has throughput and p50/p95 per stage; every run is appended to HISTORY_FILE with the
+# git commit, and it's compared with the last run of another commit with the same settings.
+# Usage (from the repository root):
+#   python -m benchmarks.e2e --requests 20 --workers 4 --latency 0.2
+#   python -m benchmarks.e2e --fail-on-regression   (exit code 1 on a regression)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_FILE = os.path.join(REPO_DIR, "benchmarks", "results", "e2e_history.jsonl")
+sys.path.insert(0, REPO_DIR)
+
+REPORT_STAGES = ["request", "generate", "validate", "test_exec", "cadquery_exec", "analyze", "export", "finalize", "log"]
+
+# canned answers: (first answer, answer to the repair prompt), {n} makes every request a different part
+SCRIPTS = {
+    "box": (
+        "import cadquery as cq\n\nlength = 40 + {n}\nwidth = 20\nheight = 10\n\n"
+        "result = cq.Workplane(\"XY\").box(length, width, height)\n",
+        None
+    ),
+    "repair": (
+        "import cadquery as cq\n\nlength = 40 + {n}\nradius = 50\n\n"
+        "result = cq.Workplane(\"XY\").box(length, 20, 10).edges(\"|Z\").fillet(radius)\n",
+        "import cadquery as cq\n\nlength = 40 + {n}\nradius = 2\n\n"
+        "result = cq.Workplane(\"XY\").box(length, 20, 10).edges(\"|Z\").fillet(radius)\n"
+    ),
+    "reject": (
+        "import cadquery as cq\n\ndiameter = 30 + {n}\n\n"
+        "cylinder = cq.Workplane(\"XY\").circle(diameter / 2).extrude(50)\n",
+        "import cadquery as cq\n\ndiameter = 30 + {n}\n\n"
+        "result = cq.Workplane(\"XY\").circle(diameter / 2).extrude(50)\n"
+    ),
+}
+
+_TAG_RE = re.compile(r"\[(\w+) #(\d+)\]")
+
+# mock answer for a request: the scenario and the request number are in the prompt ("[repair #3] ...")
+# the task is the last tag, the few-shot examples (retrieval_engine.py) come before it
+def canned_answer(body):
+    prompt = body["messages"][-1]["content"]
+    scenario, number = _TAG_RE.findall(prompt)[-1]
+    first, repaired = SCRIPTS[scenario]
+    is_repair = "ERROR RETURNED" in prompt
+    return (repaired if is_repair and repaired else first).format(n = int(number))
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "") if commit else "unknown"
+    except OSError:
+        return "unknown"
+
+def run_request(scenario, number, model):
+    from config import OUTPUT_DIR
+    from workflow_manager import request_manager, create_output_folder
+    from excel_engine import init_run_data
+    from export_engine import save_when_exported
+
+    prompt = f"[{scenario} #{number}] benchmark part"
+    project_name = create_output_folder(OUTPUT_DIR, model["name"], f"{scenario}_{number}")
+    run_data = init_run_data(model["name"], project_name, prompt)
+    request_manager(run_data, prompt, model["orcode"])
+    save_when_exported(run_data)
+    return run_data
+
+def run_benchmark(args):
+    import config
+    import trace_engine
+    from mock_openrouter import MockOpenRouter, start_mock_server
+    from excel_engine import start_excel_writer, stop_excel_writer
+    from export_engine import wait_for_exports
+
+    server, base_url = start_mock_server(MockOpenRouter([canned_answer], latency = args.latency, token_delay = args.token_delay))
+    config.OPENROUTER_BASE_URL = base_url
+    config.LLM_CACHE_MODE = "off"
+    config.STREAM_COMPLETIONS = not args.no_stream
+    config.CADQUERY_SANDBOX = not args.no_sandbox
+    config.TRACE_ENABLED = True
+    # the mock has no rate limit: the provider token bucket would only measure itself
+    config.API_RATE_LIMITS = {"default": (1000.0, 1000)}
+    os.environ.setdefault("OPENROUTER_API_KEY", "mock")
+    model = {"name": "mock-model", "orcode": "mock/model"}
+
+    scenarios = args.scenarios.split(",")
+    jobs = [(scenarios[i % len(scenarios)], i) for i in range(args.warmup + args.requests)]
+
+    start_excel_writer()
+    try:
+        # warm-up requests (worker start, first imports) are not measured
+        for scenario, number in jobs[:args.warmup]:
+            run_request(scenario, number, model)
+        wait_for_exports()
+        stop_excel_writer()
+        with trace_engine._events_lock:
+            trace_engine._events.clear()
+
+        start_excel_writer()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = args.workers) as pool:
+            runs = list(pool.map(lambda job: run_request(job[0], job[1], model), jobs[args.warmup:]))
+        wait_for_exports()
+        stop_excel_writer()
+        elapsed = time.perf_counter() - start
+    finally:
+        wait_for_exports()
+        stop_excel_writer()
+        server.shutdown()
+
+    with trace_engine._events_lock:
+        events = list(trace_engine._events)
+    if args.trace:
+        trace_engine.write_trace(os.path.abspath(args.trace))
+
+    durations = {}
+    for event in events:
+        durations.setdefault(event["name"], []).append(event["dur"] / 1000)   # ms
+
+    stages = {}
+    for name in REPORT_STAGES + sorted(set(durations) - set(REPORT_STAGES)):
+        if name in durations:
+            values = durations[name]
+            stages[name] = {"count": len(values), "p50_ms": round(percentile(values, 50), 2), "p95_ms": round(percentile(values, 95), 2)}
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": git_commit(),
+        "settings": {
+            "requests": args.requests,
+            "workers": args.workers,
+            "latency": args.latency,
+            "token_delay": args.token_delay,
+            "scenarios": args.scenarios,
+            "stream": not args.no_stream,
+            "sandbox": not args.no_sandbox
+        },
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(runs) / elapsed, 3),
+        "success_rate": round(sum(run["Status"] == "SUCCESS" for run in runs) / len(runs), 3),
+        "attempts": sum(run["Attempts"] for run in runs),
+        "validator_rejects": sum(run["Validator_Rejects"] for run in runs),
+        "stages": stages
+    }
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# last result of another commit with the same settings
+def find_baseline(history, result):
+    for entry in reversed(history):
+        if entry["settings"] == result["settings"] and entry["commit"] != result["commit"]:
+            return entry
+    return None
+
+# stages slower than the baseline by more than threshold (and by more than min_ms, to ignore the noise)
+def find_regressions(baseline, result, threshold, min_ms):
+    regressions = []
+    for name, stage in result["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if stage[key] - old[key] > min_ms and stage[key] > old[key] * (1 + threshold):
+                regressions.append(f"{name} {key}: {old[key]} -> {stage[key]} ms")
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - threshold):
+        regressions.append(f"throughput: {baseline['throughput_rps']} -> {result['throughput_rps']} req/s")
+    if result["success_rate"] < baseline["success_rate"]:
+        regressions.append(f"success rate: {baseline['success_rate']} -> {result['success_rate']}")
+    return regressions
+
+def print_report(result, baseline):
+    print(f"\ncommit {result['commit']}: {result['settings']['requests']} requests, {result['settings']['workers']} workers, "
+          f"mock latency {result['settings']['latency']}s")
+    print(f"throughput {result['throughput_rps']} req/s, success rate {result['success_rate']}, "
+          f"{result['attempts']} attempts, {result['validator_rejects']} validator rejects")
+    print(f"\n{'stage':<16} {'count':>6} {'p50 ms':>10} {'p95 ms':>10}  {'baseline p50/p95':>18}")
+    for name, stage in result["stages"].items():
+        old = baseline["stages"].get(name) if baseline else None
+        reference = f"{old['p50_ms']}/{old['p95_ms']}" if old else ""
+        print(f"{name:<16} {stage['count']:>6} {stage['p50_ms']:>10} {stage['p95_ms']:>10}  {reference:>18}")
+
+def main():
+    parser = argparse.ArgumentParser(description="QueryToCAD offline end-to-end benchmark")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4, help="requests running at the same time")
+    parser.add_argument("--warmup", type=int, default=2, help="requests run before measuring")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="mock seconds between streamed chunks")
+    parser.add_argument("--scenarios", default="box,repair,reject", help="comma separated: " + ", ".join(SCRIPTS))
+    parser.add_argument("--no-stream", action="store_true", help="non streamed completions")
+    parser.add_argument("--no-sandbox", action="store_true", help="CadQuery code in the main process")
+    parser.add_argument("--history", default=HISTORY_FILE, help="jsonl file of the previous results")
+    parser.add_argument("--no-save", action="store_true", help="don't append this result to the history")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported as regression")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="smaller slowdowns are ignored (noise)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--trace", default=None, help="also write the Chrome trace of the measured requests")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios.split(",")) - set(SCRIPTS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # everything the runs write (output folders, run store, fingerprints) goes in a throwaway folder
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="qtc_e2e_") as work_dir:
+        os.chdir(work_dir)
+        try:
+            result = run_benchmark(args)
+        finally:
+            os.chdir(cwd)
+
+    history = load_history(args.history)
+    baseline = find_baseline(history, result)
+    print_report(result, baseline)
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.history), exist_ok = True)
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"\nResult saved in {args.history}")
+
+    if baseline is None:
+        print("No previous result of another commit with the same settings.")
+        return
+    regressions = find_regressions(baseline, result, args.threshold, args.min_ms)
+    if not regressions:
+        print(f"OK: no regression against {baseline['commit']}.")
+        return
+    print(f"\nREGRESSIONS against {baseline['commit']}:")
+    for regression in regressions:
+        print(f"  {regression}")
+    if args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# Memory profile of a long run: many requests in the same process against mock_openrouter.py
+# (same canned scenarios of benchmarks/e2e.py), RSS printed every --every requests.
+# The profile is flat when the growth of the second half is close to zero (the first requests
+# also pay imports, caches and worker start).
+# Usage (from the repository root):
+#   python -m benchmarks.memory_profile --requests 1000
+#   python -m benchmarks.memory_profile --requests 1000 --no-sandbox   (generated code in this process)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.e2e import SCRIPTS, canned_answer, run_request
+
+def run_profile(args):
+    import config
+    from mock_openrouter import MockOpenRouter, start_mock_server
+    from excel_engine import start_excel_writer, stop_excel_writer
+    from export_engine import wait_for_exports
+    from memory_engine import rss_mb, print_memory_stats
+
+    server, base_url = start_mock_server(MockOpenRouter([canned_answer]))
+    config.OPENROUTER_BASE_URL = base_url
+    config.LLM_CACHE_MODE = "off"
+    config.CADQUERY_SANDBOX = not args.no_sandbox
+    config.TRACE_ENABLED = False
+    config.API_RATE_LIMITS = {"default": (1000.0, 1000)}
+    if args.ceiling is not None:
+        config.MEMORY_CEILING_MB = args.ceiling
+    os.environ.setdefault("OPENROUTER_API_KEY", "mock")
+    model = {"name": "mock-model", "orcode": "mock/model"}
+    scenarios = args.scenarios.split(",")
+
+    samples = [(0, rss_mb())]
+    start = time.perf_counter()
+    print(f"{'requests':>9} {'RSS MB':>8} {'seconds':>8}")
+    start_excel_writer()
+    try:
+        for number in range(1, args.requests + 1):
+            run_request(scenarios[number % len(scenarios)], number, model)
+            if number % args.every == 0:
+                wait_for_exports()
+                samples.append((number, rss_mb()))
+                print(f"{number:>9} {samples[-1][1]:>8.1f} {time.perf_counter() - start:>8.1f}")
+    finally:
+        wait_for_exports()
+        stop_excel_writer()
+        server.shutdown()
+
+    # the first sample after the start is the reference: imports and workers are loaded by then
+    first = [rss for number, rss in samples if 0 < number <= args.requests // 2]
+    second = [rss for number, rss in samples if number >= args.requests // 2]
+    print(f"\nstart {samples[0][1]:.1f} MB, after {samples[1][0]} requests {samples[1][1]:.1f} MB")
+    print(f"growth: first half {first[-1] - first[0]:+.1f} MB, second half {second[-1] - second[0]:+.1f} MB")
+    print_memory_stats()
+
+def main():
+    parser = argparse.ArgumentParser(description="QueryToCAD memory profile of a long run")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--every", type=int, default=50, help="requests between two RSS samples")
+    parser.add_argument("--scenarios", default="box,repair,reject", help="comma separated: " + ", ".join(SCRIPTS))
+    parser.add_argument("--no-sandbox", action="store_true", help="CadQuery code in the main process")
+    parser.add_argument("--ceiling", type=int, default=None, help="MEMORY_CEILING_MB for this run")
+    args = parser.parse_args()
+
+    # output folders, run store and fingerprints go in a throwaway folder
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="qtc_memory_") as work_dir:
+        os.chdir(work_dir)
+        try:
+            run_profile(args)
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import argparse
+
+# Repair prompt benchmark: size of the self-correction prompts on a fixed set of broken scripts
+# (benchmarks/broken_scripts.jsonl), old full-dump prompt vs token-budgeted prompt (repair_engine.py).
+# With --model the two prompts are also sent to a model, and the answers are tested like in the
+# attempts loop: fix rate, completion tokens and generation time for both.
+# Usage (from the repository root):
+#   python -m benchmarks.repair_prompts
+#   python -m benchmarks.repair_prompts --model openai/gpt-4o
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_FILE = os.path.join(REPO_DIR, "benchmarks", "broken_scripts.jsonl")
+sys.path.insert(0, REPO_DIR)
+
+# repair prompt of the loop before repair_engine.py, kept as the reference
+def legacy_repair_prompt(user_prompt, error_log, previous_code):
+    return f"""
+    ORIGINAL TASK: {user_prompt}
+
+    PREVIOUSLY GENERATED CODE:
+    ```python
+    {previous_code}
+    ```
+    ERROR RETURNED: {error_log}
+
+    GOAL:
+    Rewrite the entire code to fix the error.
+    Don't provide explanations, just the correct Python code.
+    """
+
+def load_scripts(scripts_file):
+    with open(scripts_file, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# error returned by the test of the attempts loop (stored in the file for FreeCAD console dumps)
+def error_of(script):
+    if script.get("error"):
+        return script["error"]
+    import config
+    from excel_engine import init_run_data
+    from cadquery_engine import cadquery_workflow
+
+    config.CADQUERY_SANDBOX = False
+    run_data = init_run_data("repair_benchmark", script["name"], script["prompt"])
+    success, error_log, part = cadquery_workflow(run_data, script["code"], testing = True)
+    if success:
+        raise RuntimeError(f"{script['name']} is not broken anymore")
+    return error_log
+
+# one answer of the model, tested like in the attempts loop
+# Returns: (bool: fixed, dict: call statistics)
+def try_repair(model_orcode, script, prompt, patch_mode):
+    from api_engine import MAIN_PROMPT, _finish_answer
+    from excel_engine import init_run_data
+    from code_validator import detect_engine
+    from cadquery_engine import cadquery_workflow
+    from scheduler_engine import get_scheduler
+
+    messages = [{"role": "system", "content": MAIN_PROMPT}, {"role": "user", "content": prompt}]
+    answer, stats = get_scheduler().complete(model_orcode, messages, True)
+    code = _finish_answer(answer.replace("```python", "").replace("```", "").strip(), script["code"], patch_mode)
+    if detect_engine(code) != "CadQuery":
+        return None, stats     # FreeCAD answers are only measured, not tested
+    run_data = init_run_data("repair_benchmark", script["name"], script["prompt"])
+    success, error_log, part = cadquery_workflow(run_data, code, testing = True)
+    return success, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="QueryToCAD repair prompt benchmark")
+    parser.add_argument("--scripts", default=SCRIPTS_FILE, help="jsonl file of broken scripts")
+    parser.add_argument("--budget", type=int, default=None, help="repair prompt budget in tokens (default: config)")
+    parser.add_argument("--model", default=None, help="OpenRouter model to measure the fix rate (costs API calls)")
+    args = parser.parse_args()
+
+    from repair_engine import build_repair_prompt, count_tokens, error_lines
+
+    rows = []
+    for script in load_scripts(args.scripts):
+        error_log = error_of(script)
+        legacy = legacy_repair_prompt(script["prompt"], error_log, script["code"])
+        prompt, patch_mode = build_repair_prompt(script["prompt"], error_log, script["code"], args.budget)
+        rows.append((script, error_log, legacy, prompt, patch_mode))
+
+    # the answer is estimated offline: the whole script for a rewrite, the error lines for a patch
+    print(f"\n{'script':<24} {'legacy':>8} {'budgeted':>9} {'saved':>7}  {'mode':<8} {'answer (est.)':>14}")
+    total_legacy = total_new = total_answer_legacy = total_answer_new = 0
+    for script, error_log, legacy, prompt, patch_mode in rows:
+        legacy_tokens, new_tokens = count_tokens(legacy), count_tokens(prompt)
+        answer_legacy = count_tokens(script["code"])
+        answer_new = answer_legacy
+        if patch_mode:
+            code_lines = script["code"].splitlines()
+            answer_new = sum(count_tokens(f"@@ {n}-{n}\n" + code_lines[n - 1]) for n in error_lines(error_log))
+        total_legacy += legacy_tokens
+        total_new += new_tokens
+        total_answer_legacy += answer_legacy
+        total_answer_new += answer_new
+        saved = 100 * (1 - new_tokens / legacy_tokens)
+        mode = "patch" if patch_mode else "rewrite"
+        print(f"{script['name']:<24} {legacy_tokens:>8} {new_tokens:>9} {saved:>6.1f}%  {mode:<8} {answer_legacy:>6} -> {answer_new:<5}")
+    print(f"{'TOTAL':<24} {total_legacy:>8} {total_new:>9} {100 * (1 - total_new / total_legacy):>6.1f}%  "
+          f"{'':<8} {total_answer_legacy:>6} -> {total_answer_new:<5}")
+
+    if not args.model:
+        return
+
+    print(f"\nfix rate with {args.model}:")
+    results = {"legacy": [], "budgeted": []}
+    for script, error_log, legacy, prompt, patch_mode in rows:
+        for name, text, patch in (("legacy", legacy, False), ("budgeted", prompt, patch_mode)):
+            fixed, stats = try_repair(args.model, script, text, patch)
+            results[name].append((fixed, stats))
+            print(f"  {script['name']:<24} {name:<9} fixed={fixed} completion_tokens={stats['completion_tokens']} total_s={stats['total_s']}")
+
+    for name, outcomes in results.items():
+        tested = [fixed for fixed, stats in outcomes if fixed is not None]
+        completion = sum(stats["completion_tokens"] or 0 for fixed, stats in outcomes)
+        seconds = sum(stats["total_s"] for fixed, stats in outcomes)
+        print(f"{name:<9} fixed {sum(tested)}/{len(tested)}, completion tokens {completion}, generation {seconds:.1f}s")
+
+if __name__ == "__main__":
+    main()
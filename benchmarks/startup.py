@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Startup benchmark: how long does it take before QueryToCAD can show the first prompt?
+# It parses the output of "python -X importtime -c 'import main'" and fails (exit code 1)
+# when the cumulative import time of main is over the budget.
+# Usage (from the repository root):
+#   python -m benchmarks.startup --budget-ms 300
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must never be imported at startup (they're loaded by the engine that needs them)
+HEAVY_MODULES = ["cadquery", "OCP", "openai", "dotenv", "pandas", "openpyxl", "numpy"]
+
+# "import time: self [us] | cumulative | imported package"
+def parse_importtime(stderr):
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2   # nesting level of the import
+        modules.append({
+            "name": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            "depth": depth
+        })
+    return modules
+
+def measure_imports(module = "main"):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+# wall-clock time of a full command (interpreter startup included), best of N runs
+def measure_command(args, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=REPO_DIR, capture_output=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="QueryToCAD startup benchmark")
+    parser.add_argument("--budget-ms", type=float, default=300, help="max cumulative import time of main")
+    parser.add_argument("--repeats", type=int, default=5, help="runs of 'main.py --help' (best one is kept)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to show")
+    args = parser.parse_args()
+
+    modules = measure_imports("main")
+    main_module = next((m for m in modules if m["name"] == "main"), None)
+    if main_module is None:
+        print("ERROR: 'main' not found in the importtime output.")
+        sys.exit(1)
+
+    print(f"import main: {main_module['cumulative_ms']:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"python main.py --help: {measure_command(['main.py', '--help'], args.repeats):.1f} ms (best of {args.repeats})")
+
+    print(f"\nslowest imports (self time):")
+    for module in sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:args.top]:
+        print(f"  {module['self_ms']:8.1f} ms  {module['name']}")
+
+    failed = False
+    heavy = sorted({m["name"].split(".")[0] for m in modules} & set(HEAVY_MODULES))
+    if heavy:
+        print(f"\nFAIL: heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if main_module["cumulative_ms"] > args.budget_ms:
+        print(f"\nFAIL: startup over budget ({main_module['cumulative_ms']:.1f} > {args.budget_ms:.0f} ms)")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+    print("\nOK: startup within budget.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import config
+
+# On-disk cache for the LLM answers.
+# Every answer is saved in its own json file named after the hash of the inputs
+# (model + system prompt + final prompt), so an identical request never reaches OpenRouter twice.
+# The first prompt of a request is keyed without its few-shot examples (they change with the history),
+# the examples used are kept in the entry ("meta").
+#
+# Modes (config.LLM_CACHE_MODE):
+#   "off"       -> cache disabled, every call goes to the API
+#   "write"     -> every call goes to the API, the answers are recorded (for a later readwrite/replay run)
+#   "readwrite" -> served from cache when possible, new answers are recorded
+#   "replay"    -> served ONLY from cache, a miss is an error (offline runs)
+
+class ResponseCache:
+
+    def __init__(self, cache_dir, max_mb, max_age_days):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_age_s = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()   # models can run in parallel threads
+        os.makedirs(self.cache_dir, exist_ok = True)
+        with self._lock:
+            self._total_size = self._evict() # cleanup of the previous sessions
+
+    # content address of a request: any byte changed in the inputs gives a new key
+    # candidate > 0: other samples of the same request (speculative mode), each with its own entry
+    @staticmethod
+    def make_key(model_orcode, system_prompt, final_prompt, candidate = 0):
+        digest = hashlib.sha256()
+        for part in (model_orcode, system_prompt, final_prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")  # separator, so "ab"+"c" != "a"+"bc"
+        if candidate:
+            digest.update(f"candidate:{candidate}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    # returns the cached answer or None
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry["content"] if entry is not None else None
+
+    # returns the whole cached entry (answer and metadata of the request) or None
+    def get_entry(self, key):
+        path = self._path(key)
+        with self._lock:
+            try:
+                if time.time() - os.path.getmtime(path) > self.max_age_s:
+                    os.remove(path)     # expired entry
+                    self.evictions += 1
+                    self.misses += 1
+                    return None
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    # meta: what else the request was made of (e.g. the few-shot examples of the prompt)
+    def put(self, key, model_orcode, content, meta = None):
+        entry = {
+            "model": model_orcode,
+            "created": time.time(),
+            "content": content
+        }
+        if meta:
+            entry["meta"] = meta
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            # writing on a temporary file and renaming it, so a crash never leaves half a json
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            self._total_size += os.path.getsize(path) - old_size
+
+            # the directory is scanned only when the size limit is exceeded
+            if self._total_size > self.max_bytes:
+                self._total_size = self._evict()
+
+    # removes expired entries, then the oldest ones until the cache fits in max_bytes
+    # returns the size of the cache after the cleanup
+    def _evict(self):
+        now = time.time()
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age_s:
+                os.remove(entry.path)
+                self.evictions += 1
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        entries.sort()  # oldest first
+        for mtime, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            os.remove(path)
+            total_size -= size
+            self.evictions += 1
+        return total_size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# the cache is created the first time it's needed (None when disabled)
+def get_response_cache():
+    global _cache
+    if config.LLM_CACHE_MODE == "off":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(config.LLM_CACHE_DIR, config.LLM_CACHE_MAX_MB, config.LLM_CACHE_MAX_AGE_DAYS)
+    return _cache
+
+def print_cache_stats():
+    if _cache is None:
+        return
+    stats = _cache.stats()
+    print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions.")
@@ -1,16 +1,27 @@
 import time
-import cadquery as cq
+import traceback
 
+import config
 from config import OUTPUT_DIR, Colors as C
-from geometrical_analysis import analyze_geometry
+from cadquery_sandbox import get_cadquery_sandbox
+from trace_engine import span
+from repair_engine import GENERATED_FILENAME
+from geometrical_analysis import analyze_geometry, record_geometry
+from fingerprint_engine import check_duplicate, get_fingerprint_index
+from export_engine import submit_export
 
 # Runs the CadQuery code. If test_mode=True, 
 # it does NOT save the file, just checks if it works.
-# Returns: (bool: success, str: error_message)
-def cadquery_workflow(run_data, generated_code, testing = False):
+# The part validated in testing mode can be passed back with part=...
+# so the code is executed only once per successful attempt.
+# Returns: (bool: success, str: error_message, validated part or None)
+# With config.CADQUERY_SANDBOX the code runs in a worker process and the "part" is the worker result,
+# and a cancel_event (speculative candidates) kills the worker as soon as it's set.
+def cadquery_workflow(run_data, generated_code, testing = False, part = None, cancel_event = None):
 
-    # dictionary for AI variable to separate them from main.py variables
-    local_vars = {}
+    # fresh namespace for the AI variables: nothing of this module (or of the previous runs) leaks in,
+    # and it's cleared at the end so its shapes don't outlive the run
+    namespace = {"__name__": "__main__"}
     run_data["Library"] = "CadQuery"
     model_name = run_data["Model"]
     project_name = run_data["Project_Name"]
@@ -18,50 +29,110 @@ def cadquery_workflow(run_data, generated_code, testing = False):
     if not testing:
         print(f"Library detected: {run_data["Library"]}")
 
+    # untrusted code runs in the sandbox processes when available
+    sandbox = get_cadquery_sandbox()
+    if sandbox is not None and (part is None or isinstance(part, dict)):
+        return sandboxed_workflow(sandbox, run_data, generated_code, testing, part, cancel_event)
+
     try:
-        # dynamic code execution (aviable only for CadQuery)
-        exec(generated_code, globals(), local_vars)
-        
-        # searching for "result" variable created by AI
-        if "result" in local_vars:
-            part = local_vars["result"]
-
-            # ------ GEOMETRICAL ANALYSIS ------ #
-
-            # quick check if we are only testing
-            if testing:
-                if hasattr(part, "val") and part.val().Volume() > 0:
-                    return True, ""
-                else:
-                    return False, "Empty geometry (volume is 0)."
-
-            # serious check out of testing mode
-            geom_stats = analyze_geometry(part)
-            run_data["Volume_mm3"] = round(geom_stats["volume"], 2) # round to 2 decimal places instead of 15
-            run_data["Faces_Count"] = geom_stats["faces"]
+        if part is None:
+            # dynamic code execution (aviable only for CadQuery)
+            with span("cadquery_exec", run_data):
+                # compiled with a fixed file name: the traceback points to the lines of the generated code
+                exec(compile(generated_code, GENERATED_FILENAME, "exec"), namespace)
+
+            # searching for "result" variable created by AI
+            if "result" not in namespace:
+                run_data["Status"] = "NO_RESULT_VAR"
+                run_data["Error_Log"] = "Missing variable 'result'"
+                if not testing:
+                    print(f"{C.RED}ERROR: 'result' variable missing.{C.END}")
+                return False, "Missing variable 'result'.", None
 
-            # volume validity check and {OUTPUT_DIR} export
-            if run_data["Volume_mm3"] > 0:
-                run_data["Status"] = "SUCCESS"
-                step_file = f"{OUTPUT_DIR}/{model_name}/{project_name}/{project_name}.step" 
-                cq.exporters.export(part, step_file) 
+            part = namespace["result"]
 
-                print(f"{C.GREEN}SUCCESS: .step project correctly saved in {step_file}{C.END}")
-                return True, ""
+        # ------ GEOMETRICAL ANALYSIS ------ #
+
+        # quick check if we are only testing
+        if testing:
+            if hasattr(part, "val") and part.val().Volume() > 0:
+                return True, "", part
             else:
-                run_data["Status"] = "EMPTY_GEOMETRY"
-                return False, "Geometry volume is 0."
-                
+                return False, "Empty geometry (volume is 0).", None
+
+        # serious check out of testing mode
+        with span("analyze", run_data):
+            geom_stats = analyze_geometry(part)
+        record_geometry(run_data, geom_stats)
+
+        # volume validity check and {OUTPUT_DIR} export
+        if run_data["Volume_mm3"] > 0:
+            run_data["Status"] = "SUCCESS"
+            step_file = f"{OUTPUT_DIR}/{model_name}/{project_name}/{project_name}.step" 
+            duplicate_step = check_duplicate(run_data, geom_stats)
+            # STEP and meshes are written in background (export_engine.py)
+            submit_export(run_data, step_file, part = part, duplicate_step = duplicate_step)
+
+            print(f"{C.GREEN}SUCCESS: .step project export started for {step_file}{C.END}")
+            return True, "", part
         else:
-            run_data["Status"] = "NO_RESULT_VAR"
-            run_data["Error_Log"] = "Missing variable 'result'"
-            if not testing:
-                print(f"{C.RED}ERROR: 'result' variable missing.{C.END}")
-            return False, "Missing variable 'result'."
+            run_data["Status"] = "EMPTY_GEOMETRY"
+            return False, "Geometry volume is 0.", None
             
     except Exception as e:
         run_data["Status"] = "EXEC_ERROR"
         run_data["Error_Log"] = str(e)
         if not testing:
             print(f"{C.RED}ERROR: something went wrong while running CadQuery code.\n{e}{C.END}")
-        return False, str(e)
+        # the full traceback goes to the repair prompt, it's trimmed by repair_engine.py
+        return False, traceback.format_exc(), None
+
+    finally:
+        namespace.clear()
+
+# Same workflow of cadquery_workflow(), but the code is executed by a sandbox worker.
+# The worker result (volume, faces, STEP bytes) plays the role of the validated part.
+def sandboxed_workflow(sandbox, run_data, generated_code, testing, outcome = None, cancel_event = None):
+    model_name = run_data["Model"]
+    project_name = run_data["Project_Name"]
+
+    if outcome is None:
+        with span("cadquery_exec", run_data, sandbox = True):
+            outcome = sandbox.run(generated_code, get_fingerprint_index().known_fingerprints(), cancel_event,
+                                  config.EXPORT_MESH_FORMATS)
+        run_data["Worker_RSS_MB"] = max(run_data["Worker_RSS_MB"], outcome.get("worker_rss_mb", 0))
+
+    if not outcome["ok"]:
+        run_data["Status"] = outcome["status"]
+        run_data["Error_Log"] = outcome["error"].strip().splitlines()[-1] # exception line of the traceback
+        if not testing:
+            print(f"{C.RED}ERROR: something went wrong while running CadQuery code.\n{outcome['error']}{C.END}")
+        return False, outcome["error"], None
+
+    # quick check if we are only testing (the volume was already checked by the worker)
+    if testing:
+        return True, "", outcome
+
+    record_geometry(run_data, outcome["geometry"])
+
+    # volume validity check and {OUTPUT_DIR} export
+    if run_data["Volume_mm3"] > 0:
+        run_data["Status"] = "SUCCESS"
+        step_file = f"{OUTPUT_DIR}/{model_name}/{project_name}/{project_name}.step"
+        duplicate_step = check_duplicate(run_data, outcome["geometry"])
+        if not duplicate_step and outcome["step_bytes"] is None:
+            # the worker skipped the export, but the earlier file is gone in the meantime: run it again with the export
+            with span("cadquery_exec", run_data, sandbox = True, reexport = True):
+                outcome = sandbox.run(generated_code, mesh_formats = config.EXPORT_MESH_FORMATS)
+            if not outcome["ok"] or outcome["step_bytes"] is None:
+                run_data["Status"] = "EXPORT_ERROR"
+                run_data["Error_Log"] = "Known geometry, but its STEP file no longer exists and the export failed."
+                return False, run_data["Error_Log"], None
+        submit_export(run_data, step_file, step_bytes = outcome["step_bytes"], duplicate_step = duplicate_step,
+                      meshes = outcome.get("meshes"))
+
+        print(f"{C.GREEN}SUCCESS: .step project export started for {step_file}{C.END}")
+        return True, "", outcome
+    else:
+        run_data["Status"] = "EMPTY_GEOMETRY"
+        return False, "Geometry volume is 0.", None
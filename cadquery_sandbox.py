@@ -0,0 +1,324 @@
+import os
+import gc
+import time
+import queue
+import signal
+import atexit
+import tempfile
+import threading
+import traceback
+import multiprocessing
+
+import config
+from config import Colors as C
+from repair_engine import GENERATED_FILENAME
+from memory_engine import rss_mb
+
+# Execution backend for the AI generated CadQuery code.
+# The code runs in a pool of worker processes that have already imported cadquery and OCP,
+# so an infinite loop, a pathological boolean or a leaked OCC object never touches the driver.
+# Limits for every job:
+#   - wall-clock: the driver kills the worker if it doesn't answer in time
+#   - CPU and memory: RLIMIT_CPU / RLIMIT_AS inside the worker (POSIX only, the resource module doesn't exist on Windows)
+# A worker is replaced after CADQUERY_WORKER_MAX_JOBS jobs, as soon as it dies, when its RSS goes over
+# CADQUERY_WORKER_MAX_RSS_MB or when the driver recycles the whole pool (memory_engine.py).
+# A job with a cancel_event (speculative candidates) is abandoned when the event is set: its worker is killed
+# and replaced, the job returns the CANCELLED status.
+# Every job returns volume, faces (and the other metrics of analyze_geometry), the STEP file as bytes and,
+# when asked (mesh_formats), the meshes as bytes: the driver writes the files without rebuilding the shape.
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ------ WORKER PROCESS ------ #
+
+def _set_memory_limit(memory_limit_mb):
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+# RLIMIT_CPU counts the whole life of the process, so the limit is moved forward at every job
+# when it's exceeded the kernel sends SIGXCPU and the worker dies
+def _set_cpu_limit(cpu_limit_s):
+    if resource is None or not cpu_limit_s:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = used + int(cpu_limit_s) + 1
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+# meshes of the part as bytes: format -> {"bytes", "s"}, or {"error"} if that format failed
+def _export_meshes(part, mesh_formats, tmp_dir):
+    from export_engine import write_mesh
+    meshes = {}
+    for mesh_format in mesh_formats:
+        path = os.path.join(tmp_dir, f"result.{mesh_format}")
+        start = time.perf_counter()
+        try:
+            write_mesh(part, path, mesh_format)
+            with open(path, "rb") as f:
+                meshes[mesh_format] = {"bytes": f.read(), "s": round(time.perf_counter() - start, 3)}
+        except MemoryError:
+            raise
+        except Exception as e:
+            meshes[mesh_format] = {"error": str(e)}
+    return meshes
+
+# same checks of cadquery_workflow, done inside the worker
+# the exports are skipped when the fingerprint is in known_fingerprints (the driver already has those files)
+def _run_job(generated_code, cq, known_fingerprints, mesh_formats):
+    from geometrical_analysis import analyze_geometry
+    from fingerprint_engine import compute_fingerprint
+
+    namespace = {"__name__": "__main__"}
+    try:
+        exec(compile(generated_code, GENERATED_FILENAME, "exec"), namespace)
+    except MemoryError:
+        return {"ok": False, "status": "MEMORY_LIMIT", "error": "Memory limit exceeded while running the code."}
+    except Exception:
+        return {"ok": False, "status": "EXEC_ERROR", "error": traceback.format_exc()}
+
+    # searching for "result" variable created by AI
+    if "result" not in namespace:
+        return {"ok": False, "status": "NO_RESULT_VAR", "error": "Missing variable 'result'."}
+    part = namespace["result"]
+
+    try:
+        geom_stats = analyze_geometry(part)
+        if not geom_stats["volume"] > 0:
+            return {"ok": False, "status": "EMPTY_GEOMETRY", "error": "Empty geometry (volume is 0)."}
+
+        fingerprint = compute_fingerprint(geom_stats)
+        step_bytes = None
+        meshes = {}
+        if fingerprint not in known_fingerprints:
+            # the shape can't leave the process: it's sent back as a STEP file (and as meshes)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                step_path = os.path.join(tmp_dir, "result.step")
+                cq.exporters.export(part, step_path)
+                with open(step_path, "rb") as f:
+                    step_bytes = f.read()
+                if mesh_formats:
+                    meshes = _export_meshes(part, mesh_formats, tmp_dir)
+
+    except MemoryError:
+        return {"ok": False, "status": "MEMORY_LIMIT", "error": "Memory limit exceeded during the analysis."}
+    except Exception:
+        return {"ok": False, "status": "EXEC_ERROR", "error": traceback.format_exc()}
+
+    return {
+        "ok": True,
+        "status": "SUCCESS",
+        "error": "",
+        "volume": geom_stats["volume"],
+        "faces": geom_stats["faces"],
+        "geometry": geom_stats,
+        "fingerprint": fingerprint,
+        "step_bytes": step_bytes,   # None for a known geometry
+        "meshes": meshes
+    }
+
+def _worker_main(conn, memory_limit_mb):
+    # pre-warming: the heavy imports are paid once per worker, not once per job
+    import cadquery as cq
+    import OCP  # noqa: F401
+
+    _set_memory_limit(memory_limit_mb)
+    conn.send({"ready": True})
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:     # stop signal
+            break
+        _set_cpu_limit(job["cpu_limit_s"])
+        answer = _run_job(job["code"], cq, job["known_fingerprints"], job["mesh_formats"])
+        # the namespace of the job (shapes included) is often a reference cycle
+        gc.collect()
+        answer["worker_rss_mb"] = round(rss_mb(), 1)
+        conn.send(answer)
+
+# ------ DRIVER SIDE ------ #
+
+class SandboxWorker:
+
+    def __init__(self, context, memory_limit_mb, generation = 0):
+        self.jobs_done = 0
+        self.generation = generation
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    # Returns: result dictionary of _run_job(), or an error dictionary if the worker dies, hangs or is cancelled
+    def run(self, code, timeout_s, cpu_limit_s, known_fingerprints, mesh_formats = (), cancel_event = None):
+        deadline = time.monotonic() + timeout_s
+        try:
+            # the first job also waits for the imports of the worker
+            while not self.ready:
+                if not self._wait(deadline, cancel_event):
+                    return self._cancelled() if cancel_event is not None and cancel_event.is_set() else self._timeout(timeout_s)
+                self.ready = self.conn.recv().get("ready", False)
+
+            self.conn.send({"code": code, "cpu_limit_s": cpu_limit_s, "known_fingerprints": known_fingerprints,
+                            "mesh_formats": list(mesh_formats)})
+            if not self._wait(deadline, cancel_event):
+                return self._cancelled() if cancel_event is not None and cancel_event.is_set() else self._timeout(timeout_s)
+            answer = self.conn.recv()
+
+        except (EOFError, OSError):
+            return self._crashed()
+
+        self.jobs_done += 1
+        if answer["status"] == "MEMORY_LIMIT":
+            self.jobs_done = float("inf")   # heap state unknown: recycled right away
+        if config.CADQUERY_WORKER_MAX_RSS_MB and answer.get("worker_rss_mb", 0) > config.CADQUERY_WORKER_MAX_RSS_MB:
+            self.jobs_done = float("inf")   # grown too much: recycled before the next job
+        return answer
+
+    # True when the worker has answered before the deadline (and before the cancel_event)
+    def _wait(self, deadline, cancel_event):
+        if cancel_event is None:
+            return self.conn.poll(max(deadline - time.monotonic(), 0))
+        while not cancel_event.is_set():
+            remaining = deadline - time.monotonic()
+            if self.conn.poll(max(min(remaining, config.CANCEL_POLL_S), 0)):
+                return True
+            if remaining <= 0:
+                return False
+        return False
+
+    def _cancelled(self):
+        self.kill()
+        return {"ok": False, "status": "CANCELLED", "error": "CANCELLED: the job was abandoned, another candidate passed the test."}
+
+    def _timeout(self, timeout_s):
+        self.kill()
+        return {"ok": False, "status": "TIMEOUT", "error": f"TIMEOUT: the code ran for more than {timeout_s}s."}
+
+    def _crashed(self):
+        self.process.join(timeout = 5)
+        exitcode = self.process.exitcode
+        if hasattr(signal, "SIGXCPU") and exitcode == -signal.SIGXCPU:
+            return {"ok": False, "status": "CPU_LIMIT", "error": "CPU time limit exceeded."}
+        return {"ok": False, "status": "WORKER_CRASH", "error": f"The CadQuery worker crashed (exit code {exitcode})."}
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+            self.process.join(timeout = 2)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout = 5)
+
+class CadQuerySandbox:
+
+    def __init__(self, workers, max_jobs_per_worker, timeout_s, cpu_limit_s, memory_limit_mb):
+        # spawn: the driver has threads running, forking it is not safe
+        self.context = multiprocessing.get_context("spawn")
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.timeout_s = timeout_s
+        self.cpu_limit_s = cpu_limit_s
+        self.memory_limit_mb = memory_limit_mb
+        self.recycled = 0
+        self.generation = 0     # workers of an older generation are replaced (recycle())
+        self.idle = queue.Queue()
+        for _ in range(workers):
+            self.idle.put(SandboxWorker(self.context, memory_limit_mb))
+
+    # mesh_formats: meshes tessellated by the worker along with the STEP file (e.g. EXPORT_MESH_FORMATS)
+    def run(self, code, known_fingerprints = frozenset(), cancel_event = None, mesh_formats = ()):
+        worker = self._acquire(cancel_event)
+        if worker is None:
+            return {"ok": False, "status": "CANCELLED", "error": "CANCELLED: the job was abandoned before a worker was free."}
+        try:
+            if not worker.is_alive() or worker.generation != self.generation:
+                worker = self._replace(worker)
+            return worker.run(code, self.timeout_s, self.cpu_limit_s, known_fingerprints, mesh_formats, cancel_event)
+        finally:
+            # dead, killed, worn-out or recycled workers are replaced before going back to the pool
+            if not worker.is_alive() or worker.jobs_done >= self.max_jobs_per_worker or worker.generation != self.generation:
+                worker = self._replace(worker)
+            self.idle.put(worker)
+
+    # next free worker, None if the cancel_event is set while waiting for it
+    def _acquire(self, cancel_event):
+        if cancel_event is None:
+            return self.idle.get()
+        while not cancel_event.is_set():
+            try:
+                return self.idle.get(timeout = config.CANCEL_POLL_S)
+            except queue.Empty:
+                pass
+        return None
+
+    def _replace(self, worker):
+        worker.stop()
+        self.recycled += 1
+        return SandboxWorker(self.context, self.memory_limit_mb, self.generation)
+
+    # every worker is replaced: the idle ones now, the busy ones when their job is done
+    def recycle(self):
+        self.generation += 1
+        idle = []
+        while True:
+            try:
+                idle.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in idle:
+            self.idle.put(self._replace(worker))
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().stop()
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+# sandbox created the first time it's needed (None when disabled)
+def get_cadquery_sandbox():
+    global _sandbox
+    if not config.CADQUERY_SANDBOX:
+        return None
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = CadQuerySandbox(
+                config.CADQUERY_SANDBOX_WORKERS,
+                config.CADQUERY_WORKER_MAX_JOBS,
+                config.CADQUERY_TIMEOUT_S,
+                config.CADQUERY_CPU_LIMIT_S,
+                config.CADQUERY_MEMORY_LIMIT_MB
+            )
+            atexit.register(_sandbox.close)
+            print(f"{C.CYAN}CadQuery sandbox started with {config.CADQUERY_SANDBOX_WORKERS} workers.{C.END}")
+    return _sandbox
+
+# called by memory_engine.py when the memory ceiling is exceeded (nothing to do if the sandbox isn't running)
+def recycle_cadquery_sandbox():
+    with _sandbox_lock:
+        sandbox = _sandbox
+    if sandbox is not None:
+        sandbox.recycle()
@@ -0,0 +1,126 @@
+import ast
+import threading
+
+import config
+from repair_engine import GENERATED_FILENAME
+
+# Static checks of the generated code, between generate_cad_code() and the engines.
+# The code is parsed (never executed): code that can't work is rejected at once, with a precise error
+# for the repair prompt, instead of paying a FreeCAD process or a CadQuery execution.
+# Checks: leftover markdown, syntax, CAD library (CadQuery or FreeCAD, never both), 'result' variable
+# for CadQuery, at least one document object for FreeCAD, blocked imports and calls.
+# The errors use the traceback format ('File "<generated>", line N'), so repair_engine.py can point to the lines.
+
+FREECAD_MODULES = {"FreeCAD", "FreeCADGui", "App", "Part", "PartDesign", "Sketcher", "Draft", "Mesh", "Import", "BOPTools"}
+CADQUERY_MODULES = {"cadquery", "OCP"}
+
+# executions avoided by the validator, per engine (printed at the end of the benchmark)
+_rejected = {}
+_rejected_lock = threading.Lock()
+
+def _error(status, message, code_lines = None, line = None, engine = None):
+    error = message
+    if line:
+        source = code_lines[line - 1].strip() if 1 <= line <= len(code_lines) else ""
+        error = f'  File "{GENERATED_FILENAME}", line {line}\n    {source}\n{message}'
+    return {"ok": False, "engine": engine, "status": status, "error": error}
+
+def _top_module(name):
+    return (name or "").split(".")[0]
+
+# (module, line) of every import of the code
+def _imports(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield _top_module(alias.name), node.lineno
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            yield _top_module(node.module), node.lineno
+
+def _call_name(node):
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return None
+
+def _engine_of(modules):
+    freecad = modules & FREECAD_MODULES
+    cadquery = modules & CADQUERY_MODULES
+    if freecad and cadquery:
+        return "Mixed"
+    if freecad:
+        return "FreeCAD"
+    if cadquery:
+        return "CadQuery"
+    return None
+
+# it selects which geometrical engine AI has choosen (from the imports, text search if the code doesn't parse)
+def detect_engine(code):
+    try:
+        engine = _engine_of({module for module, line in _imports(ast.parse(code))})
+    except (SyntaxError, ValueError):
+        engine = None
+    if engine in ("FreeCAD", "CadQuery"):
+        return engine
+    if "import FreeCAD" in code or "import Part" in code:
+        return "FreeCAD"
+    return "CadQuery"
+
+# Returns: {"ok": bool, "engine": "CadQuery"/"FreeCAD"/None, "status": str, "error": str}
+def validate_code(code):
+    code_lines = code.splitlines()
+
+    for number, line in enumerate(code_lines, start = 1):
+        if line.strip().startswith("```"):
+            return _error("MARKDOWN_LEFTOVER", "SyntaxError: markdown code fence left in the code, return only the raw Python code.", code_lines, number)
+
+    try:
+        tree = ast.parse(code, filename = GENERATED_FILENAME)
+    except SyntaxError as e:
+        return _error("SYNTAX_ERROR", f"SyntaxError: {e.msg}", code_lines, e.lineno)
+    except ValueError as e:    # null bytes
+        return _error("SYNTAX_ERROR", f"SyntaxError: {e}")
+
+    imports = list(_imports(tree))
+    for module, line in imports:
+        if module in config.VALIDATOR_BLOCKED_MODULES:
+            return _error("BLOCKED_IMPORT", f"ImportError: module '{module}' is not allowed in the generated code.", code_lines, line)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id in config.VALIDATOR_BLOCKED_CALLS:
+                name = node.func.id
+                return _error("BLOCKED_CALL", f"NameError: '{name}()' is not allowed in the generated code.", code_lines, node.lineno)
+
+    modules = {module for module, line in imports}
+    engine = _engine_of(modules)
+    if engine == "Mixed":
+        used = sorted(modules & (FREECAD_MODULES | CADQUERY_MODULES))
+        return _error("MIXED_LIBRARIES", f"ImportError: CadQuery and FreeCAD are mixed ({', '.join(used)}), use only one library.")
+    if engine is None:
+        return _error("NO_LIBRARY", "ImportError: neither cadquery nor FreeCAD is imported.")
+
+    if engine == "CadQuery":
+        assigned = any(isinstance(node, ast.Name) and node.id == "result" and isinstance(node.ctx, ast.Store) for node in ast.walk(tree))
+        if not assigned:
+            return _error("NO_RESULT_VAR", "NameError: the final object must be assigned to a variable called 'result'.", engine = engine)
+    else:
+        calls = {_call_name(node) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+        if not calls & {"addObject", "newObject", "show"}:
+            return _error("NO_DOC_OBJECT", "FREECAD_ERROR: no object is added to the document (use doc.addObject(...)).", engine = engine)
+
+    return {"ok": True, "engine": engine, "status": "", "error": ""}
+
+# one execution saved: the rejected code never reaches the engine
+def count_rejected(engine):
+    with _rejected_lock:
+        _rejected[engine] = _rejected.get(engine, 0) + 1
+
+def print_validator_stats():
+    with _rejected_lock:
+        rejected = dict(_rejected)
+    if not rejected:
+        return
+    details = ", ".join(f"{count} {engine or 'unknown engine'}" for engine, count in sorted(rejected.items(), key = lambda item: str(item[0])))
+    print(f"Code validator: {sum(rejected.values())} executions saved ({details}).")
@@ -2,8 +2,145 @@ import os
 
 OUTPUT_DIR = "output"
 MAX_RETRIES = 3 # max self-recorrections retries
-EXCEL_FILE = f"{OUTPUT_DIR}/performance.xlsx"
+SPECULATIVE_CANDIDATES = 1 # candidates generated in parallel per attempt, the first valid wins (1 = off)
+CANCEL_POLL_S = 0.1 # how often a sandbox or FreeCAD job of a candidate checks if another one already won
+EXCEL_FILE = f"{OUTPUT_DIR}/performance.xlsx" # formatted report
+RUNS_FILE = f"{OUTPUT_DIR}/runs.jsonl" # append-only run store, one json line per run
+EXCEL_REPORT = False # rebuild the formatted excel with every run at the end of a benchmark (slow with a long history)
+REPORT_SUMMARY_FILE = f"{OUTPUT_DIR}/summary.csv" # aggregates per model and library (report_engine.py)
+REPORT_STATE_FILE = f"{OUTPUT_DIR}/report_state.json" # aggregates and offset already read, for incremental reports
+REPORT_CHUNK_RUNS = 20000 # runs decoded and aggregated at a time (memory bound)
+
+# few-shot examples from the past successful runs (retrieval_engine.py)
+RETRIEVAL_ENABLED = True
+RETRIEVAL_FILE = f"{OUTPUT_DIR}/retrieval_index.jsonl"
+RETRIEVAL_DIM = 1024 # hashed TF-IDF buckets
+RETRIEVAL_TOP_K = 2 # examples added to the first prompt
+RETRIEVAL_MIN_SCORE = 0.15 # cosine similarity below this is not an example
+RETRIEVAL_MAX_TOKENS = 800 # budget of the examples in the prompt
+RETRIEVAL_SCOPE = "model" # "model" = only examples of the same model, "all" = every model
+RETRIEVAL_HOLDOUT = 0.0 # share of the requests without examples (A/B comparison in the report)
+
+# artifact store (artifact_store.py): version index, manifest and content-addressed files
+ARTIFACT_STORE = True
+ARTIFACT_DB = f"{OUTPUT_DIR}/artifacts.db"
+ARTIFACT_BLOB_DIR = f"{OUTPUT_DIR}/.blobs"
 FREECAD_PATH = "C:\\Program Files\\FreeCAD 1.0\\bin\\freecadcmd.exe"
+FREECAD_TIMEOUT = 60 # seconds per script
+# the geometry metrics are computed inside FreeCAD by the footer (freecad_engine.py);
+# True = the STEP file is also imported in CadQuery to check them (slower, CadQuery mesh hash)
+FREECAD_CADQUERY_CROSSCHECK = False
+FREECAD_CROSSCHECK_TOLERANCE = 1e-3 # relative volume difference reported as a mismatch
+
+# warm FreeCAD workers (freecad_pool.py), 0 = one freecadcmd process per script
+FREECAD_POOL_SIZE = 2
+FREECAD_WORKER_MAX_JOBS = 50 # a worker is restarted after this many scripts
+# command used to launch a worker, None = [FREECAD_PATH]
+# e.g. [sys.executable] runs a stand-in worker without FreeCAD
+FREECAD_WORKER_COMMAND = None
+
+# sandbox for the AI CadQuery code (cadquery_sandbox.py): pre-warmed worker processes with limits
+CADQUERY_SANDBOX = True # False = exec() inside the main process
+CADQUERY_SANDBOX_WORKERS = min(os.cpu_count() or 1, 4)
+CADQUERY_WORKER_MAX_JOBS = 25 # a worker is restarted after this many jobs
+CADQUERY_TIMEOUT_S = 90 # wall-clock limit per job
+CADQUERY_CPU_LIMIT_S = 60 # CPU time limit per job (POSIX only)
+CADQUERY_MEMORY_LIMIT_MB = 4096 # address space limit per worker (POSIX only)
+CADQUERY_WORKER_MAX_RSS_MB = 1024 # a worker that grew over this is restarted after its job (0 = off)
+
+# parametric sweep of a saved script (sweep_engine.py, "main.py sweep"), no LLM call
+SWEEP_WORKERS = os.cpu_count() or 1 # CadQuery processes of the sweep (FreeCAD scripts use the FreeCAD pool)
+SWEEP_WORKER_MAX_JOBS = 200 # variants per worker before a restart (same script, the startup cost matters more)
+SWEEP_MAX_VARIANTS = 10000 # grids bigger than this are refused
+
+# shape accuracy against the reference STEP of a suite entry (scoring_engine.py)
+SCORE_ENABLED = True
+SCORE_TOLERANCE = 0.5 # mm: tessellation, voxel size and point spacing (smaller = more accurate, slower)
+SCORE_MAX_VOXELS = 96 # voxels along the longest side of the compared parts
+SCORE_MAX_POINTS = 4096 # surface samples per part for the Chamfer distance
+SCORE_ALIGN = True # parts centered on their bounding box before the comparison
+SCORE_CACHE_SIZE = 64 # tessellated parts kept in memory (the references are reused for every model)
+
+# memory of long runs (memory_engine.py)
+MEMORY_CEILING_MB = 2048 # RSS of the main process that recycles caches and sandbox workers (0 = off)
+MEMORY_SAMPLE_S = 0.2 # RSS sampling period for the peak of every run
+MEMORY_TRACEMALLOC = False # Python allocations per run (Py_Alloc_Delta_KB), slows every allocation: off = RSS only
+MEMORY_GC_EVERY_RUN = True # collects the reference cycles of the generated code after every request
+
+# analyses kept in memory by geometrical_analysis.py (memoized by shape hash)
+GEOMETRY_CACHE_SIZE = 256
+
+# geometric fingerprints (fingerprint_engine.py) used to find identical results
+FINGERPRINT_FILE = f"{OUTPUT_DIR}/fingerprints.jsonl"
+FINGERPRINT_DECIMALS = 2 # rounding of volume, area, bounding box and mesh vertices (mm)
+FINGERPRINT_TOLERANCE = 0.1 # tessellation tolerance for the mesh hash (mm)
+FINGERPRINT_SKIP_EXPORT_MAX = 256 # newest known geometries sent to the sandbox workers (their STEP export is skipped)
+
+# export stage (export_engine.py): STEP plus meshes, written by a background thread pool
+EXPORT_BACKGROUND = True
+EXPORT_WORKERS = 2
+EXPORT_MESH_FORMATS = ["stl", "glb"] # [] = STEP only
+EXPORT_STL_TOLERANCE = 0.05 # linear deflection of the STL mesh (mm)
+EXPORT_GLB_TOLERANCE = 0.1 # linear deflection of the glb preview mesh (mm)
+EXPORT_ANGULAR_TOLERANCE = 0.2 # angular deflection (rad)
+
+# concurrent benchmark: every model of LLM_MODELS runs in its own thread
+PARALLEL_MODELS = True
+MAX_PARALLEL_MODELS = 4 # max models running at the same time
+
+# batch mode (python main.py batch suite.jsonl): prompt x model cells running at the same time
+BATCH_WORKERS = 4
+BATCH_DIR = f"{OUTPUT_DIR}/batches" # checkpoints of the batch runs
+
+# OpenRouter endpoint (it can point to mock_openrouter.py for offline tests)
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# request scheduler (scheduler_engine.py)
+API_MAX_CONCURRENCY_PER_MODEL = 4
+API_MAX_CONCURRENCY_PER_PROVIDER = 8
+# provider (first part of the orcode) -> (requests per second, burst)
+API_RATE_LIMITS = {
+    "default": (2.0, 5),
+}
+API_TRANSPORT_RETRIES = 5 # retries for 429, 5xx, timeouts (they don't use MAX_RETRIES)
+API_BACKOFF_BASE_S = 1.0
+API_BACKOFF_MAX_S = 60.0
+API_REQUEST_TIMEOUT_S = 600
+
+# streaming completions: time to first token and tokens/s are measured for every call,
+# the stream is cancelled when one of the budgets is exceeded
+STREAM_COMPLETIONS = True
+STREAM_MAX_TOKENS = 4000
+STREAM_MAX_SECONDS = 180 # budget of the whole streamed call: exceeded = StreamBudgetExceeded, not retried
+STREAM_CONNECT_TIMEOUT_S = 10 # transport timeouts of a streamed call (retried by the scheduler)
+STREAM_READ_TIMEOUT_S = 60 # longest silence between two chunks
+
+# repair prompts of the self-correction loop (repair_engine.py), sizes in tokens
+REPAIR_PROMPT_BUDGET = 1500 # max size of a repair prompt
+REPAIR_ERROR_BUDGET = 300 # max size of the error log inside it
+REPAIR_TRACEBACK_FRAMES = 2 # library frames kept at the end of a traceback
+REPAIR_PATCH_MIN_LINES = 30 # shorter scripts are always rewritten, longer ones can be patched by line
+REPAIR_CONTEXT_LINES = 5 # lines sent around an error line when the script doesn't fit in the budget
+
+# static checks of the generated code before any execution (code_validator.py)
+VALIDATOR_ENABLED = True
+VALIDATOR_BLOCKED_MODULES = [
+    "os", "subprocess", "shutil", "socket", "ctypes", "multiprocessing", "threading",
+    "importlib", "pickle", "marshal", "urllib", "http", "requests", "pathlib", "signal", "asyncio"
+]
+# show_object/debug only exist inside CQ-editor
+VALIDATOR_BLOCKED_CALLS = ["eval", "exec", "compile", "__import__", "open", "input", "breakpoint", "exit", "quit", "show_object", "debug"]
+
+# Chrome trace / Perfetto json of every benchmark (trace_engine.py), QTC_TRACE=1 to enable it
+TRACE_ENABLED = os.getenv("QTC_TRACE", "0") == "1"
+TRACE_DIR = f"{OUTPUT_DIR}/traces"
+
+# on-disk cache of the LLM answers: "off", "write" (answers recorded, never served: the benchmark latencies
+# are real calls), "readwrite" or "replay" (cache only, no API calls)
+LLM_CACHE_MODE = os.getenv("QTC_LLM_CACHE", "write")
+LLM_CACHE_DIR = f"{OUTPUT_DIR}/.llm_cache"
+LLM_CACHE_MAX_MB = 200
+LLM_CACHE_MAX_AGE_DAYS = 90
 
 LLM_MODELS = [
     {
@@ -35,5 +172,13 @@ class Colors:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
-if not os.path.exists(FREECAD_PATH):
-    print(f"{Colors.YELLOW}WARNING: freecadcmd.exe non trovato in {FREECAD_PATH}{Colors.END}")
\ No newline at end of file
+# checked the first time FreeCAD is needed, not at import time
+_freecad_path_checked = False
+
+def check_freecad_path():
+    global _freecad_path_checked
+    if _freecad_path_checked:
+        return
+    _freecad_path_checked = True
+    if not os.path.exists(FREECAD_PATH):
+        print(f"{Colors.YELLOW}WARNING: freecadcmd.exe non trovato in {FREECAD_PATH}{Colors.END}")
@@ -1,13 +1,15 @@
 import os
-import time     
-import pandas                   # standard for managing tables in 
+import json
+import queue
+import threading
 from datetime import datetime   # timestamp for each test
-from config import EXCEL_FILE, Colors as C
+from config import EXCEL_FILE, RUNS_FILE, Colors as C
+from trace_engine import span
 
-# for better styling excel file
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Font, Alignment
-from openpyxl.utils import get_column_letter
+# openpyxl (for better styling excel file) is imported only when a report is built
+
+# Every run is appended as one json line to RUNS_FILE (O(1) per run, safe with parallel writers).
+# The formatted excel file is only a report, rebuilt from RUNS_FILE with build_excel_report().
 
 # create the dictionary (factory pattern)
 def init_run_data(model_name, project_name, prompt):
@@ -21,108 +23,218 @@ def init_run_data(model_name, project_name, prompt):
         "Exec_Time_s": 0,
         "Volume_mm3": 0,
         "Faces_Count": 0,
+        "Area_mm2": 0,
+        "BBox_mm": "",
+        "Edges_Count": 0,
+        "Vertices_Count": 0,
+        "Solids_Count": 0,
+        "Center_Of_Mass": [],
+        "Is_Valid": False,
+        "Metrics_Source": "", # FreeCAD runs: metrics from the FreeCAD process or from the CadQuery import
+        "Crosscheck_Volume_Diff": 0, # relative volume difference FreeCAD / CadQuery (FREECAD_CADQUERY_CROSSCHECK)
+        "Reference": "",    # reference STEP of the prompt, if any (scoring_engine.py)
+        "Score_IoU": -1,    # -1 = not scored
+        "Score_Chamfer_mm": -1,
+        "Score_BBox_Err": -1,
+        "Score_Time_s": 0,
+        "Fingerprint": "",  # geometric fingerprint (fingerprint_engine.py)
+        "Duplicate_Of": "", # earlier result with the same geometry
         "Error_Log": "",
+        "Validator_Rejects": 0, # attempts rejected by code_validator.py (executions saved)
         "Code_Lines": 0,
-        "Library": "None"
+        "Library": "None",
+        "Cache_Hits": 0,
+        "TTFT_s": 0,
+        "Tokens_per_s": 0,
+        "API_Calls": [],    # statistics of every streamed call
+        "Transport_Retries": 0, # 429/5xx/timeouts retried by the scheduler
+        "Prompt_Tokens": 0,
+        "Completion_Tokens": 0,
+        "Attempt_Tokens": [], # prompt type (initial/repair/patch) and tokens of every attempt
+        "Retrieval_Used": 0, # few-shot examples in the first prompt (retrieval_engine.py)
+        "Retrieval_Score": 0, # similarity of the best example
+        "Candidates": 1,    # speculative candidates per attempt (speculative_engine.py)
+        "Winner_Candidate": -1,
+        "Cancelled_Candidates": 0,
+        "Time_To_Valid_s": 0, # from the first call to the first code that passed the test
+        "Total_Time_s": 0,
+        "RSS_Start_MB": 0,  # memory of the process (memory_engine.py)
+        "RSS_End_MB": 0,
+        "Peak_RSS_MB": 0,
+        "Py_Alloc_Delta_KB": 0, # Python allocations left by the run (tracemalloc, only with MEMORY_TRACEMALLOC)
+        "Worker_RSS_MB": 0, # RSS of the CadQuery sandbox worker after the job
+        "Export_Status": "", # background exports (export_engine.py): PENDING, DONE, PARTIAL, FAILED
+        "Export_Time_s": 0,
+        "Exports": {},      # format -> file and seconds
+        "Attempts": 0,
+        "Stage_Times": {},  # seconds per pipeline stage (trace_engine.py)
+        "Attempt_Times": [] # seconds per stage of every attempt
     }
 
-# to adjust column width and row coloring based on status (SUCCESS, FAIL...)
-def format_excel_file(filepath):
+# single background thread that owns the run store:
+# rows coming from parallel models are queued and written one at a time
+_excel_queue = None
+_excel_thread = None
+
+def _excel_writer_loop(rows):
+    while True:
+        obj_data = rows.get()
+        if obj_data is None:    # stop signal
+            rows.task_done()
+            break
+        _write_row(obj_data)
+        rows.task_done()
+
+def start_excel_writer():
+    global _excel_queue, _excel_thread
+    if _excel_thread is not None:
+        return
+    _excel_queue = queue.Queue()
+    _excel_thread = threading.Thread(target=_excel_writer_loop, args=(_excel_queue,), name="excel-writer", daemon=True)
+    _excel_thread.start()
+
+# waits until every queued row has been written, then stops the writer
+def stop_excel_writer():
+    global _excel_queue, _excel_thread
+    if _excel_thread is None:
+        return
+    _excel_queue.put(None)
+    _excel_thread.join()
+    _excel_queue = None
+    _excel_thread = None
+
+# while the writer is running rows are queued (a copy, since run_data keeps changing),
+# otherwise they are written directly
+# (the name is kept from when every run rewrote the whole excel file)
+def save_to_excel(obj_data):
+    if _excel_queue is not None:
+        _excel_queue.put(dict(obj_data))
+    else:
+        _write_row(obj_data)
+
+_file_lock = threading.Lock()
+
+# appends a single run to the store: one line, one write call
+def _write_row(obj_data):
+    line = json.dumps(obj_data, ensure_ascii=False, default=str) + "\n"
     try:
-        wb = load_workbook(filepath)    # loading excel file as an editable object
-        ws = wb.active                  # considering the active sheet
-
-        # defining colors (HEX codes)
-        green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid") # Verde pastello
-        green_font = Font(color="006100") 
-        
-        red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")   # Rosso pastello
-        red_font = Font(color="9C0006")   
-
-        yellow_fill = PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid") # Giallo
-        yellow_font = Font(color="9C6500")
-
-        # adjust column width
-        for column in ws.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column) # 'A', 'B', 'C', ...
-            
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-           
-            adjusted_width = (max_length + 2)   # setting width with a little margin
-            if adjusted_width > 35:             # setting a limit to avoid infinite column
-                adjusted_width = 35
-            
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        # searching for status column
-        status_col_index = None
-        for cell in ws[1]: 
-            if cell.value == "Status":
-                status_col_index = cell.column
-                break
-
-        # conditional coloring status based
-        if status_col_index:
-            for row in range(2, ws.max_row + 1):
-                cell = ws.cell(row=row, column=status_col_index)
-                status_text = str(cell.value).upper()
-
-                if "SUCCESS" in status_text:
-                    cell.fill = green_fill
-                    cell.font = green_font
-                elif "ERROR" in status_text or "FAIL" in status_text:
-                    cell.fill = red_fill
-                    cell.font = red_font
-                elif "EMPTY" in status_text or "PENDING" in status_text:
-                    cell.fill = yellow_fill
-                    cell.font = yellow_font
-
-        wb.save(filepath)
-        print("Excel formatted successfully.")
+        with _file_lock, span("log", model = obj_data.get("Model"), project = obj_data.get("Project_Name")):
+            _import_legacy_excel()
+            with open(RUNS_FILE, "a", encoding="utf-8") as f:
+                f.write(line)
+        print(f"Run saved in {RUNS_FILE}")
 
     except Exception as e:
-        print(f"{C.RED}ERROR: Unable to format Excel.\n{e}{C.END}")
-
-# function to manage excel file (creation/reading/writing/errors)
-def save_to_excel(obj_data):
+        print(f"{C.RED}ERROR: an unexpected error occurred while saving file.\n{e}{C.END}")
+        print(f"{C.RED}ERROR: UNABLE TO SAVE THE RUN. The data from this run is only printed to screen.\n{line}{C.END}")
+
+# the runs saved by the old versions only live in the excel file:
+# they are copied once in the store, otherwise the next report would overwrite them
+def _import_legacy_excel():
+    if os.path.exists(RUNS_FILE) or not os.path.exists(EXCEL_FILE):
+        return
+    from openpyxl import load_workbook
+
+    wb = load_workbook(EXCEL_FILE, read_only = True)
+    rows = wb.active.iter_rows(values_only = True)
+    header = next(rows, None)
+    with open(RUNS_FILE, "w", encoding="utf-8") as f:
+        if header:
+            for row in rows:
+                record = {key: value for key, value in zip(header, row) if key is not None}
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    wb.close()
+    print(f"Previous runs imported from {EXCEL_FILE} into {RUNS_FILE}")
+
+# streaming reader of the run store, one record at a time
+def iter_runs(runs_file = RUNS_FILE):
+    if not os.path.exists(runs_file):
+        return
+    with open(runs_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue # half written line (crash while saving)
+
+# defining colors (HEX codes): (fill, font) for every kind of status
+def _status_styles():
+    from openpyxl.styles import PatternFill, Font
+    return {
+        "green": (PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid"), Font(color="006100")),   # Verde pastello
+        "red": (PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid"), Font(color="9C0006")),     # Rosso pastello
+        "yellow": (PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid"), Font(color="9C6500"))   # Giallo
+    }
 
-    # pass the object data dictionary into a list to prevent pandas from getting confused
-    new_df = pandas.DataFrame([obj_data])
-
-    # save file retry logic
-    max_retries = 5
-    for attempt in range(max_retries):
-        try:    
-            if os.path.exists(EXCEL_FILE):
-                # read the entire file
-                existing_df = pandas.read_excel(EXCEL_FILE)
-                # create a history of changes, discarding old row/column index
-                final_df = pandas.concat([existing_df, new_df], ignore_index = True)
+# status cell colored on the fly, nothing is restyled afterwards
+def _status_cell(ws, value, styles, cell_class):
+    cell = cell_class(ws, value = value)
+    status_text = str(value).upper()
+    color = None
+    if "SUCCESS" in status_text:
+        color = "green"
+    elif "ERROR" in status_text or "FAIL" in status_text:
+        color = "red"
+    elif "EMPTY" in status_text or "PENDING" in status_text:
+        color = "yellow"
+    if color:
+        cell.fill, cell.font = styles[color]
+    return cell
+
+# builds the formatted excel report from the run store (on demand or at the end of a batch)
+# two streaming passes over the json lines and a write-only workbook: memory doesn't grow with the runs
+def build_excel_report(runs_file = RUNS_FILE, excel_file = EXCEL_FILE):
+    with _file_lock:
+        _import_legacy_excel()
+
+    # first pass: columns (in order of appearance) and their width
+    columns = []
+    widths = {}
+    for record in iter_runs(runs_file):
+        for key, value in record.items():
+            if key not in widths:
+                columns.append(key)
+                widths[key] = len(str(key))
+            widths[key] = max(widths[key], len(str(value)))
+
+    if not columns:
+        print(f"{C.YELLOW}WARNING: no runs saved yet, excel report not created.{C.END}")
+        return
+
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only = True)
+    ws = wb.create_sheet()
+    styles = _status_styles()
+
+    # adjust column width (with a little margin and a limit to avoid infinite columns)
+    for index, key in enumerate(columns, start = 1):
+        ws.column_dimensions[get_column_letter(index)].width = min(widths[key] + 2, 35)
+
+    # second pass: rows written one by one
+    ws.append(columns)
+    for record in iter_runs(runs_file):
+        row = []
+        for key in columns:
+            value = record.get(key)
+            if key == "Status":
+                row.append(_status_cell(ws, value, styles, WriteOnlyCell))
+            elif isinstance(value, (list, dict)):
+                row.append(json.dumps(value))   # per call / per attempt details
             else:
-                final_df = new_df 
-        
-            # write the file to disk without the row number column
-            final_df.to_excel(EXCEL_FILE, index = False)
-            format_excel_file(EXCEL_FILE) 
-            print(f"Excel file updated successfully: {EXCEL_FILE}")
-            return
-        
-        # if we try to edit the excel file while it's open, an error will occur
-        except PermissionError:
-            print(f"""{C.YELLOW}
-            WARNING: the excel file '{EXCEL_FILE}' seems to be open!\n
-            Please close it within 5 second, otherwise all data will be lost.\n
-            Attempt {attempt+1}/{max_retries}.{C.END}
-            """)
-
-        except Exception as e:
-            print(f"{C.RED}ERROR: an unexpected error occurred while saving file.\n{e}{C.END}")
-            break
+                row.append(value)
+        ws.append(row)
+
+    try:
+        wb.save(excel_file)
+        print(f"Excel report updated successfully: {excel_file}")
 
-    print(f"{C.RED}ERROR: UNABLE TO SAVE TO EXCEL. The data from this run is lost or only printed to screen.{C.END}")
\ No newline at end of file
+    # if we try to edit the excel file while it's open, an error will occur
+    except PermissionError:
+        print(f"{C.YELLOW}WARNING: the excel file '{excel_file}' seems to be open, report not updated.\n"
+              f"The runs are safe in {runs_file}, close the file and build the report again.{C.END}")
@@ -0,0 +1,213 @@
+import os
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from config import Colors as C
+from trace_engine import span
+from excel_engine import save_to_excel
+from fingerprint_engine import register_result
+from artifact_store import store_artifacts, update_manifest
+from scoring_engine import score_run
+
+# Export stage: the finished shape is written as STEP plus the mesh formats of EXPORT_MESH_FORMATS
+# (stl, glb) on a background thread pool, so the benchmark moves on to the next model or prompt
+# while the files are written.
+#   - sandbox results arrive as bytes (STEP and meshes, tessellated by the worker with write_mesh()):
+#     no shape is rebuilt in the driver; only FreeCAD results and the meshes missing for a copied
+#     geometry are imported from the STEP file
+#   - every file is written under a temporary name and renamed: a file that exists is complete
+#     (the fingerprint index only points to complete STEP files)
+#   - identical geometry (Duplicate_Of) copies the files of the earlier result
+#   - the run record is saved only when its exports are done (save_when_exported()), with
+#     Exports (file and seconds per format), Export_Time_s and Export_Status
+# cadquery is imported inside the jobs, the generated code already loaded it.
+
+_pool = None
+_pool_lock = threading.Lock()
+_jobs = {}  # (model, project) -> _ExportJob, until the run asks to be saved
+_running = set()    # futures of the jobs not finished yet (record save included)
+_jobs_lock = threading.Lock()
+
+class _ExportJob:
+
+    def __init__(self):
+        self.done = False
+        self.save = None    # (run_data, on_saved) once the run is finished
+        self.future = None
+        self.lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers = config.EXPORT_WORKERS, thread_name_prefix = "export")
+    return _pool
+
+def _run_key(run_data):
+    return (run_data["Model"], run_data["Project_Name"])
+
+# the file appears with its final name only when it's complete
+def _atomic_write(path, write):
+    base, ext = os.path.splitext(path)
+    tmp_path = f"{base}.tmp{ext}"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+# everything the workplane contains, as one shape
+def _shape_of(part, step_file):
+    import cadquery as cq
+    if part is None:
+        part = cq.importers.importStep(step_file)  # FreeCAD results, copied geometry without its meshes
+    if isinstance(part, cq.Workplane):
+        shapes = [obj for obj in part.vals() if isinstance(obj, cq.Shape)]
+        return shapes[0] if len(shapes) == 1 else cq.Compound.makeCompound(shapes)
+    return part
+
+# shape: a workplane or a shape; also used by the CadQuery sandbox workers (cadquery_sandbox.py)
+def write_mesh(shape, path, mesh_format):
+    import cadquery as cq
+    shape = _shape_of(shape, None)
+    if mesh_format == "stl":
+        cq.exporters.export(shape, path, exportType = "STL",
+                            tolerance = config.EXPORT_STL_TOLERANCE, angularTolerance = config.EXPORT_ANGULAR_TOLERANCE)
+    elif mesh_format == "glb":
+        # binary glTF (the extension of the path chooses glb over gltf)
+        cq.Assembly(shape).export(path, "GLTF",
+                                  tolerance = config.EXPORT_GLB_TOLERANCE, angularTolerance = config.EXPORT_ANGULAR_TOLERANCE)
+    else:
+        raise ValueError(f"unknown export format: {mesh_format}")
+
+def _export(run_data, step_file, part, step_bytes, duplicate_step, register, meshes):
+    exports = {}
+    start_export = time.perf_counter()
+
+    def timed(export_format, path, write):
+        start = time.perf_counter()
+        try:
+            with span("export", run_data, format = export_format, background = True):
+                write()
+            exports[export_format] = {"file": path, "s": round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            exports[export_format] = {"file": "", "error": str(e)}
+            print(f"{C.YELLOW}WARNING: {export_format.upper()} export of {run_data['Project_Name']} failed: {e}{C.END}")
+
+    # STEP first: the other formats can be rebuilt from it
+    if duplicate_step:
+        timed("step", step_file, lambda: _atomic_write(step_file, lambda tmp: shutil.copyfile(duplicate_step, tmp)))
+    elif step_bytes is not None:
+        timed("step", step_file, lambda: _atomic_write(step_file, lambda tmp: _write_bytes(tmp, step_bytes)))
+    elif part is not None:
+        import cadquery as cq
+        timed("step", step_file, lambda: _atomic_write(step_file, lambda tmp: cq.exporters.export(part, tmp, exportType = "STEP")))
+    else:
+        exports["step"] = {"file": step_file, "s": 0}    # already written by FreeCAD
+
+    if "error" in exports["step"]:
+        run_data["Status"] = "EXPORT_ERROR"
+        run_data["Error_Log"] = f"STEP export failed: {exports['step']['error']}"
+    else:
+        if register:
+            register_result(run_data, step_file)
+
+        shape = None
+        base = os.path.splitext(step_file)[0]
+        for mesh_format in config.EXPORT_MESH_FORMATS:
+            path = f"{base}.{mesh_format}"
+            duplicate_mesh = f"{os.path.splitext(duplicate_step)[0]}.{mesh_format}" if duplicate_step else None
+            if duplicate_mesh and os.path.exists(duplicate_mesh):
+                timed(mesh_format, path, lambda: _atomic_write(path, lambda tmp: shutil.copyfile(duplicate_mesh, tmp)))
+                continue
+            mesh = meshes.get(mesh_format)
+            if mesh is not None:
+                # tessellated by the sandbox worker
+                if "error" in mesh:
+                    exports[mesh_format] = {"file": "", "error": mesh["error"]}
+                    continue
+                timed(mesh_format, path, lambda: _atomic_write(path, lambda tmp: _write_bytes(tmp, mesh["bytes"])))
+                if "s" in exports[mesh_format]:
+                    exports[mesh_format]["s"] = round(exports[mesh_format]["s"] + mesh["s"], 3)
+                continue
+            if shape is None:
+                try:
+                    shape = _shape_of(part, step_file)
+                except Exception as e:
+                    exports[mesh_format] = {"file": "", "error": f"shape not available: {e}"}
+                    continue
+            timed(mesh_format, path, lambda: _atomic_write(path, lambda tmp: write_mesh(shape, tmp, mesh_format)))
+
+    # complete files only, in the content-addressed store
+    store_artifacts(run_data, {export_format: export["file"] for export_format, export in exports.items() if "error" not in export})
+
+    failed = [export_format for export_format, export in exports.items() if "error" in export]
+    run_data["Exports"] = exports
+    run_data["Export_Time_s"] = round(time.perf_counter() - start_export, 3)
+    run_data["Export_Status"] = "DONE" if not failed else ("FAILED" if "step" in failed else "PARTIAL")
+
+def _run_job(job, run_data, *args):
+    try:
+        _export(run_data, *args)
+    except Exception as e:
+        run_data["Export_Status"] = "FAILED"
+        print(f"{C.RED}ERROR: export of {run_data['Project_Name']} crashed.\n{e}{C.END}")
+    finally:
+        with job.lock:
+            job.done = True
+            save = job.save
+        if save is not None:
+            _save(*save)
+        with _jobs_lock:
+            _running.discard(job.future)
+
+def _save(run_data, on_saved):
+    # the STEP file is complete: accuracy against the reference before the record is written
+    score_run(run_data)
+    update_manifest(run_data)
+    save_to_excel(run_data)
+    if on_saved is not None:
+        on_saved()
+
+# Called by the engines when the result is valid: returns immediately (EXPORT_BACKGROUND),
+# the STEP file is written from part (CadQuery object), step_bytes (sandbox) or duplicate_step (copy).
+# With none of them the STEP file already exists (FreeCAD) and only the meshes are written.
+# meshes: format -> {"bytes", "s"} or {"error"} already tessellated by the sandbox worker.
+# register=True adds the result to the fingerprint index once its STEP file is complete.
+def submit_export(run_data, step_file, part = None, step_bytes = None, duplicate_step = None, register = True, meshes = None):
+    run_data["Export_Status"] = "PENDING"
+    job = _ExportJob()
+    args = (run_data, step_file, part, step_bytes, duplicate_step, register, meshes or {})
+    if not config.EXPORT_BACKGROUND:
+        _export(*args)
+        return
+    with _jobs_lock:
+        _jobs[_run_key(run_data)] = job
+        job.future = _get_pool().submit(_run_job, job, *args)
+        _running.add(job.future)
+
+# Saves the run record now, or as soon as its exports are done.
+# on_saved is called after the record is saved (e.g. the batch checkpoint).
+def save_when_exported(run_data, on_saved = None):
+    with _jobs_lock:
+        job = _jobs.pop(_run_key(run_data), None)
+    if job is not None:
+        with job.lock:
+            if not job.done:
+                job.save = (run_data, on_saved)
+                return
+    _save(run_data, on_saved)
+
+# waits for every export (and the record saves that depend on them), before stopping the excel writer
+def wait_for_exports():
+    while True:
+        with _jobs_lock:
+            futures = list(_running)
+        if not futures:
+            return
+        for future in futures:
+            future.result()
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import config
+from config import Colors as C
+
+# Geometric fingerprint of a result: two parts with the same fingerprint are the same solid,
+# even if they come from different models, attempts or scripts.
+# Components (all from analyze_geometry): rounded volume, area, bounding box size and position,
+# histogram of the face types and hash of the tessellation.
+# The position is part of it: the same solid moved somewhere else is a different result
+# (its STEP file can't be a copy of the first one).
+# The index of the fingerprints already seen is kept in FINGERPRINT_FILE (one json line per result):
+# a known fingerprint skips the STEP export (export_engine.py copies the existing files) and tells
+# which models converged on the same geometry.
+
+def compute_fingerprint(geom_stats):
+    decimals = config.FINGERPRINT_DECIMALS
+    bbox = geom_stats["bbox"]
+    components = {
+        "volume": round(geom_stats["volume"], decimals),
+        "area": round(geom_stats["area"], decimals),
+        "bbox": [round(bbox["xlen"], decimals), round(bbox["ylen"], decimals), round(bbox["zlen"], decimals)],
+        "position": [round(bbox[key], decimals) + 0.0 for key in ("xmin", "ymin", "zmin", "xmax", "ymax", "zmax")],
+        "face_types": geom_stats["face_types"],
+        "mesh_hash": geom_stats["mesh_hash"]
+    }
+    canonical = json.dumps(components, sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+class FingerprintIndex:
+
+    def __init__(self, index_path):
+        self.path = index_path
+        self.first_seen = {}    # fingerprint -> first result with that geometry
+        self.models = {}        # fingerprint -> models that produced it
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except (ValueError, KeyError):
+                        continue
+
+    def _add(self, entry):
+        fingerprint = entry["fingerprint"]
+        self.first_seen.setdefault(fingerprint, entry)
+        self.models.setdefault(fingerprint, set()).add(entry["model"])
+
+    # the newest fingerprints whose STEP file still exists (at most limit): a sandbox worker skips
+    # the export of these geometries, so the set sent with every job stays small
+    def known_fingerprints(self, limit = None):
+        limit = config.FINGERPRINT_SKIP_EXPORT_MAX if limit is None else limit
+        with self._lock:
+            entries = list(self.first_seen.values())[-limit:] if limit > 0 else []
+        return frozenset(entry["fingerprint"] for entry in entries if os.path.exists(entry["step_file"]))
+
+    # first result with the same geometry whose STEP file still exists, or None
+    def lookup(self, fingerprint):
+        with self._lock:
+            entry = self.first_seen.get(fingerprint)
+        if entry and os.path.exists(entry["step_file"]):
+            return entry
+        return None
+
+    def register(self, fingerprint, run_data, step_file):
+        entry = {
+            "fingerprint": fingerprint,
+            "model": run_data["Model"],
+            "project": run_data["Project_Name"],
+            "prompt": run_data["Prompt"],
+            "step_file": step_file,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        with self._lock:
+            self._add(entry)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    # fingerprint -> sorted list of models, only for geometries produced by more than one model
+    def convergence(self):
+        with self._lock:
+            return {fp: sorted(models) for fp, models in self.models.items() if len(models) > 1}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_fingerprint_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            os.makedirs(os.path.dirname(config.FINGERPRINT_FILE) or ".", exist_ok = True)
+            _index = FingerprintIndex(config.FINGERPRINT_FILE)
+    return _index
+
+# Called after the analysis of a successful result, before the STEP export.
+# Records the fingerprint in the run and returns the STEP file of an identical earlier result (or None).
+def check_duplicate(run_data, geom_stats):
+    fingerprint = compute_fingerprint(geom_stats)
+    run_data["Fingerprint"] = fingerprint
+
+    duplicate = get_fingerprint_index().lookup(fingerprint)
+    if duplicate is not None:
+        run_data["Duplicate_Of"] = f"{duplicate['model']}/{duplicate['project']}"
+        print(f"{C.CYAN}Same geometry as {run_data['Duplicate_Of']}: export skipped.{C.END}")
+        return duplicate["step_file"]
+    return None
+
+def register_result(run_data, step_file):
+    if run_data.get("Fingerprint"):
+        get_fingerprint_index().register(run_data["Fingerprint"], run_data, step_file)
+
+def print_convergence_report():
+    if _index is None:
+        return
+    convergence = _index.convergence()
+    if not convergence:
+        return
+    print(f"\n{C.BOLD}Models that converged on the same geometry:{C.END}")
+    for fingerprint, models in convergence.items():
+        entry = _index.first_seen[fingerprint]
+        print(f"  {fingerprint[:12]} ({entry['prompt'][:40]}): {', '.join(models)}")
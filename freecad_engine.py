@@ -1,30 +1,96 @@
 import os, time
+import json
 import subprocess
 import config
-import cadquery as cq
 
 from config import OUTPUT_DIR, Colors as C
-from geometrical_analysis import analyze_geometry
+from freecad_pool import get_freecad_pool
+from trace_engine import span
+from geometrical_analysis import analyze_step_file, record_geometry
+from fingerprint_engine import check_duplicate, register_result
+from export_engine import submit_export
 
 # Here we're going to lauch freecad in headless mode.
 # In order to do that, freecad needs explicit instructions to export the code.
 
-def run_freecad_script(script_path, output_step_path):
+# Geometry metrics computed by the footer inside the FreeCAD process (no second parse of the STEP file):
+# volume, area, faces, bounding box, validity, ... of all the visible result shapes, printed as one
+# json line after METRICS_MARKER. Same keys and units of geometrical_analysis.analyze_geometry(), the
+# surface types with the CadQuery names. The mesh hash comes from the FreeCAD tessellation: equal for the
+# same FreeCAD geometry, not comparable with the CadQuery one (FREECAD_CADQUERY_CROSSCHECK for that).
+METRICS_MARKER = "FREECAD_METRICS "
 
-    # those lines are needed because FreeCAD only read absolute path
-    # giving the relative path, FreeCAD crashes
-    abs_script_path = os.path.abspath(script_path)
-    abs_output_path = os.path.abspath(output_step_path)
-
-    # create a temporary wrapper file to append an export command
-    wrapper_script_path = script_path.replace(".py", "_wrapper.py")
-
-    # this extra code has to be added to AI's script in the footer
-    # to correctrly export the object due to AI common errors
-    footer_code = f"""
+FOOTER_CODE = """
 import FreeCAD
 import Part
 import sys
+import json
+import hashlib
+
+_QTC_FACE_TYPES = {
+    "Plane": "PLANE", "Cylinder": "CYLINDER", "Cone": "CONE", "Sphere": "SPHERE", "Toroid": "TORUS",
+    "BezierSurface": "BEZIER", "BSplineSurface": "BSPLINE", "SurfaceOfRevolution": "REVOLUTION",
+    "SurfaceOfExtrusion": "EXTRUSION", "OffsetSurface": "OFFSET"
+}
+
+# result shapes: visible objects with faces that no other shape object uses
+# (the inputs of a boolean, the features of a Body, ... are intermediate steps)
+def _qtc_results(doc):
+    results = []
+    for obj in doc.Objects:
+        shape = getattr(obj, "Shape", None)
+        if shape is None or shape.isNull() or not shape.Faces:
+            continue
+        if not getattr(obj, "Visibility", True):
+            continue
+        if any(hasattr(parent, "Shape") for parent in obj.InList):
+            continue
+        results.append(obj)
+    return results
+
+def _qtc_metrics(shape):
+    try:
+        box = shape.optimalBoundingBox(True, False)    # tight box, like the CadQuery analysis
+    except Exception:
+        box = shape.BoundBox
+    solids = shape.Solids
+    volume = sum(solid.Volume for solid in solids)
+    if volume:
+        center = [sum(getattr(solid.CenterOfMass, axis) * solid.Volume for solid in solids) / volume for axis in "xyz"]
+    else:
+        center = [box.Center.x, box.Center.y, box.Center.z]
+
+    face_types = {}
+    for face in shape.Faces:
+        face_type = _QTC_FACE_TYPES.get(type(face.Surface).__name__, "OTHER")
+        face_types[face_type] = face_types.get(face_type, 0) + 1
+
+    # same normalization of geometrical_analysis._mesh_hash()
+    vertices, triangles = shape.tessellate(_QTC_TOLERANCE)
+    points = sorted(
+        (round(v.x - box.XMin, _QTC_DECIMALS), round(v.y - box.YMin, _QTC_DECIMALS), round(v.z - box.ZMin, _QTC_DECIMALS))
+        for v in vertices
+    )
+    digest = hashlib.sha256(("%d|" % len(triangles)).encode("ascii"))
+    digest.update(repr(points).encode("ascii"))
+
+    return {
+        "volume": volume,
+        "faces": len(shape.Faces),
+        "area": shape.Area,
+        "edges": len(shape.Edges),
+        "vertices": len(shape.Vertexes),
+        "solids": len(solids),
+        "bbox": {
+            "xmin": box.XMin, "ymin": box.YMin, "zmin": box.ZMin,
+            "xmax": box.XMax, "ymax": box.YMax, "zmax": box.ZMax,
+            "xlen": box.XLength, "ylen": box.YLength, "zlen": box.ZLength
+        },
+        "center_of_mass": center,
+        "valid": shape.isValid(),
+        "face_types": dict(sorted(face_types.items())),
+        "mesh_hash": digest.hexdigest()
+    }
 
 try: 
     doc = FreeCAD.ActiveDocument
@@ -35,21 +101,58 @@ try:
 
     # if the file exists, it checks if it's empty
     if not doc.Objects:
-        print(f"FREECAD_ERROR: no valid object in the document.")
+        print("FREECAD_ERROR: no valid object in the document.")
         sys.exit(1)
 
-    # it takes the last created object = final result
-    # this is because FreeCAD inserts the object in a history list
-    obj = doc.Objects[-1]
+    doc.recompute()
+    objects = _qtc_results(doc)
+    if not objects:
+        # nothing recognized as a result: the last created object, like the FreeCAD history
+        objects = [doc.Objects[-1]]
+
+    # native export command of FreeCAD, all the results in the same file
+    Part.export(objects, _QTC_OUTPUT)
+
+    if _QTC_METRICS:
+        try:
+            shapes = [obj.Shape for obj in objects if hasattr(obj, "Shape")]
+            shape = shapes[0] if len(shapes) == 1 else Part.makeCompound(shapes)
+            metrics = _qtc_metrics(shape)
+            metrics["objects"] = [obj.Name for obj in objects]
+            print(_QTC_MARKER + json.dumps(metrics))
+        except Exception as e:
+            # the STEP file is there: the analysis can still import it
+            print("FREECAD_METRICS_ERROR: %s" % e)
 
-    # native export command of FreeCAD
-    Part.export([obj], r"{abs_output_path}")
     print("FREECAD_SUCCESS: export completed.")
 
 except Exception as e:
-    print(f"FREECAD_ERROR: {{e}}")
+    print("FREECAD_ERROR: %s" % e)
     sys.exit(1)
-    """
+"""
+
+# metrics=False (test runs): only the export, the footer skips the analysis
+# cancel_event (speculative candidates): the FreeCAD process is killed as soon as it's set
+def run_freecad_script(script_path, output_step_path, metrics = True, cancel_event = None):
+
+    # those lines are needed because FreeCAD only read absolute path
+    # giving the relative path, FreeCAD crashes
+    abs_script_path = os.path.abspath(script_path)
+    abs_output_path = os.path.abspath(output_step_path)
+
+    # create a temporary wrapper file to append an export command
+    wrapper_script_path = script_path.replace(".py", "_wrapper.py")
+
+    # this extra code has to be added to AI's script in the footer
+    # to correctrly export the object due to AI common errors
+    footer_code = f"""
+_QTC_OUTPUT = r"{abs_output_path}"
+_QTC_METRICS = {bool(metrics)}
+_QTC_MARKER = {METRICS_MARKER!r}
+_QTC_TOLERANCE = {config.FINGERPRINT_TOLERANCE}
+_QTC_DECIMALS = {config.FINGERPRINT_DECIMALS}
+""" + FOOTER_CODE
+
     # reading original script
     with open(script_path, "r", encoding="utf-8") as f:
         original_code = f.read()
@@ -58,19 +161,27 @@ except Exception as e:
     with open(wrapper_script_path, "w", encoding="utf-8") as f:
         f.write(original_code + "\n" + footer_code)
 
-    # launching process (it's like launching it from the terminal)
+    config.check_freecad_path()
     try: 
-        result = subprocess.run(
-            [config.FREECAD_PATH, wrapper_script_path], # executable path
-            capture_output=True,    # listen to captrue FreeCAD output
-            text=True,              # it reads the output as text
-            timeout=60,             # if FreeCAD blocks for more than 60sec, it kills it
-            encoding='utf-8',       # in order to avoid external decoding character errors
-            errors='ignore'
-        )
+        pool = get_freecad_pool()
+        if pool is not None:
+            # script sent to an already running FreeCAD worker
+            returncode, log = pool.run_script(os.path.abspath(wrapper_script_path), config.FREECAD_TIMEOUT, cancel_event)
+        elif cancel_event is not None:
+            log = _run_cancellable([config.FREECAD_PATH, wrapper_script_path], config.FREECAD_TIMEOUT, cancel_event)
+        else:
+            # launching process (it's like launching it from the terminal)
+            result = subprocess.run(
+                [config.FREECAD_PATH, wrapper_script_path], # executable path
+                capture_output=True,    # listen to captrue FreeCAD output
+                text=True,              # it reads the output as text
+                timeout=config.FREECAD_TIMEOUT, # if FreeCAD blocks for too long, it kills it
+                encoding='utf-8',       # in order to avoid external decoding character errors
+                errors='ignore'
+            )
         
-        # analizing FreeCAD console output
-        log = result.stdout + result.stderr
+            # analizing FreeCAD console output
+            log = result.stdout + result.stderr
 
         # it looks for the keyword in the footer
         if "FREECAD_SUCCESS" in log and os.path.exists(output_step_path):
@@ -87,7 +198,50 @@ except Exception as e:
     except Exception as e:
         return False, f"SYSTEM ERROR: {e}"
 
-def freecad_workflow(run_data, code, testing = False):
+# one-shot freecadcmd process that is killed when cancel_event is set
+# Returns: str: log (stdout + stderr)
+def _run_cancellable(command, timeout, cancel_event):
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, encoding='utf-8', errors='ignore')
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=max(min(deadline - time.monotonic(), config.CANCEL_POLL_S), 0))
+            return stdout + stderr
+        except subprocess.TimeoutExpired:
+            if cancel_event.is_set() or time.monotonic() >= deadline:
+                process.kill()
+                stdout, stderr = process.communicate()
+                if cancel_event.is_set():
+                    return stdout + stderr + "\nCANCELLED: the script was abandoned, another candidate passed the test."
+                raise subprocess.TimeoutExpired(command, timeout)
+
+# metrics line printed by the footer, None when it's missing (metrics error, old footer)
+def parse_metrics(log):
+    for line in reversed(log.splitlines()):
+        if line.startswith(METRICS_MARKER):
+            try:
+                stats = json.loads(line[len(METRICS_MARKER):])
+            except ValueError:
+                return None
+            stats["center_of_mass"] = tuple(stats["center_of_mass"])
+            return stats
+    return None
+
+# Optional check of the FreeCAD metrics against the CadQuery analysis of the STEP file.
+# The CadQuery stats are kept (mesh hash comparable with the CadQuery results for the fingerprints).
+def _crosscheck(run_data, geom_stats, step_file):
+    with span("crosscheck", run_data):
+        cq_stats = analyze_step_file(step_file)
+    reference = max(abs(cq_stats["volume"]), 1e-9)
+    difference = abs(geom_stats["volume"] - cq_stats["volume"]) / reference
+    run_data["Crosscheck_Volume_Diff"] = round(difference, 6)
+    if difference > config.FREECAD_CROSSCHECK_TOLERANCE or geom_stats["faces"] != cq_stats["faces"]:
+        print(f"{C.YELLOW}WARNING: FreeCAD and CadQuery metrics differ: volume {geom_stats['volume']:.2f} / {cq_stats['volume']:.2f} mm3, "
+              f"faces {geom_stats['faces']} / {cq_stats['faces']}.{C.END}")
+    return cq_stats
+
+def freecad_workflow(run_data, code, testing = False, cancel_event = None):
     # saving the choosen library in excel, .step and .py file
     run_data["Library"] = "FreeCAD" 
     model_name = run_data["Model"]
@@ -105,25 +259,36 @@ def freecad_workflow(run_data, code, testing = False):
         f.write(code)
 
     # external script execution
-    success, log = run_freecad_script(script_path, step_file)
+    with span("freecad_script", run_data):
+        success, log = run_freecad_script(script_path, step_file, metrics = not testing, cancel_event = cancel_event)
 
-    # if the file has been saved, it must be loaded into memory 
-    # to check the volumes and geometries with CadQuery
+    # the metrics come from the FreeCAD process; the STEP file is imported in CadQuery
+    # only for the cross-check or when the footer couldn't compute them
     if success:
         if testing:
             return True, ""
         try:
-            # importing .step file in CadQuary
-            part = cq.importers.importStep(step_file)
-
-            # analyzing geometry
-            geom_stats = analyze_geometry(part)
-            run_data["Volume_mm3"] = round(geom_stats["volume"], 2) # round to 2 decimal places instead of 15
-            run_data["Faces_Count"] = geom_stats["faces"]
+            geom_stats = parse_metrics(log)
+            if geom_stats is None:
+                run_data["Metrics_Source"] = "CadQuery"
+                # importing .step file in CadQuary and analyzing geometry
+                # (skipped when the same file was already analyzed)
+                with span("analyze", run_data):
+                    geom_stats = analyze_step_file(step_file)
+            else:
+                run_data["Metrics_Source"] = "FreeCAD"
+                if config.FREECAD_CADQUERY_CROSSCHECK:
+                    geom_stats = _crosscheck(run_data, geom_stats, step_file)
+            record_geometry(run_data, geom_stats)
 
             # volume validity check and {OUTPUT_DIR} export
             if run_data["Volume_mm3"] > 0:
                 run_data["Status"] = "SUCCESS"
+                # FreeCAD already wrote the STEP file: the fingerprint only tracks duplicates
+                check_duplicate(run_data, geom_stats)
+                register_result(run_data, step_file)
+                # the meshes are written in background from the STEP file (export_engine.py)
+                submit_export(run_data, step_file, register = False)
                 print(f"{C.GREEN}SUCCESS: .step project correctly saved in {step_file}{C.END}")
                 return True, ""
             else:
@@ -132,8 +297,8 @@ def freecad_workflow(run_data, code, testing = False):
 
         except Exception as e:
             run_data["Status"] = "ANALYSIS_FAIL"
-            run_data["Error_Log"] = f"FreeCAD generated file, but CadQuery import failed: {e}"
-            return False, f"FreeCAD generated file, but CadQuery import failed: {e}"
+            run_data["Error_Log"] = f"FreeCAD generated file, but the geometry analysis failed: {e}"
+            return False, f"FreeCAD generated file, but the geometry analysis failed: {e}"
     else:
         run_data["Status"] = "EXEC_ERROR"
         run_data["Error_Log"] = log[-300:] # last 300 characters
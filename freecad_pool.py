@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import queue
+import atexit
+import itertools
+import threading
+import subprocess
+
+import config
+from config import Colors as C
+
+# Pool of warm headless FreeCAD processes (see freecad_worker.py).
+# Launching freecadcmd often takes longer than the modelling itself,
+# so the workers are started once and then receive the scripts through a pipe.
+# A worker that crashes, hangs (timeout) or has done too many jobs is replaced by a new one.
+# If the new one can't be started the slot stays in the pool empty (None) and is filled at the next acquire.
+# A script with a cancel_event (speculative candidates) is abandoned when the event is set: the worker is killed and replaced.
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "freecad_worker.py")
+RESULT_MARKER = "QTC_WORKER_RESULT "
+
+class WorkerCrashed(Exception):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class FreeCADWorker:
+
+    def __init__(self, command):
+        self.jobs_done = 0
+        self.process = subprocess.Popen(
+            command + [WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,   # FreeCAD console messages end up in the job log
+            text=True,
+            encoding='utf-8',
+            errors='ignore',
+            bufsize=1                   # line buffered
+        )
+        # stdout is read by a thread, so the pool can wait with a timeout
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put(None)    # EOF: the process is dead
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    # sends the script and waits for its result line
+    # Returns: (int: returncode, str: log)
+    def run(self, job_id, script_path, timeout, cancel_event = None):
+        try:
+            self.process.stdin.write(json.dumps({"id": job_id, "script": script_path}) + "\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise WorkerCrashed(f"worker not reachable: {e}")
+
+        noise = []
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(script_path, timeout, output="".join(noise))
+            if cancel_event is not None and cancel_event.is_set():
+                raise JobCancelled("".join(noise))
+            try:
+                line = self.lines.get(timeout=remaining if cancel_event is None else min(remaining, config.CANCEL_POLL_S))
+            except queue.Empty:
+                continue
+
+            if line is None:
+                raise WorkerCrashed("".join(noise))
+
+            if line.startswith(RESULT_MARKER):
+                answer = json.loads(line[len(RESULT_MARKER):])
+                if answer["id"] == job_id:
+                    self.jobs_done += 1
+                    return answer["returncode"], "".join(noise) + answer["log"]
+            else:
+                noise.append(line)
+
+    def stop(self, wait = 2):
+        try:
+            self.process.stdin.close()  # the worker loop ends when stdin is closed
+            self.process.wait(timeout=wait)
+        except Exception:
+            self.kill()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+
+class FreeCADPool:
+
+    def __init__(self, command, size, max_jobs_per_worker):
+        self.command = command
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.idle = queue.Queue()
+        self.job_ids = itertools.count(1)
+        self.recycled = 0
+        self.closed = False
+
+        # workers are started immediately, so the FreeCAD startup cost is paid once
+        for _ in range(size):
+            self.idle.put(FreeCADWorker(self.command))
+
+    # Returns: (int: returncode, str: log), like a one-shot freecadcmd run
+    def run_script(self, script_path, timeout, cancel_event = None):
+        try:
+            worker = self._acquire(cancel_event)
+        except JobCancelled:
+            return 1, "CANCELLED: the script was abandoned before a FreeCAD worker was free."
+        if worker is None or not worker.is_alive():
+            worker = self._replace(worker)
+            if worker is None:
+                self.idle.put(None)     # the slot is kept, the next acquire tries again
+                return 1, "SYSTEM ERROR: unable to start a FreeCAD worker."
+
+        try:
+            return worker.run(next(self.job_ids), script_path, timeout, cancel_event)
+
+        except JobCancelled as e:
+            # another candidate already won: the worker is killed in the middle of the script
+            worker = self._replace(worker)
+            return 1, f"{e}\nCANCELLED: the script was abandoned, another candidate passed the test."
+
+        except subprocess.TimeoutExpired:
+            # the worker is stuck on the script: killed and replaced
+            worker = self._replace(worker)
+            raise
+
+        except WorkerCrashed as e:
+            worker = self._replace(worker)
+            return 1, f"{e}\nSYSTEM ERROR: FreeCAD worker crashed while running the script."
+
+        finally:
+            # the slot always goes back to the pool, with None if the new worker couldn't be started
+            if worker is not None and worker.jobs_done >= self.max_jobs_per_worker:
+                worker.stop()
+                worker = self._spawn()
+            self.idle.put(worker)
+
+    # next slot of the pool (a worker or None), JobCancelled if the cancel_event is set while waiting for it
+    def _acquire(self, cancel_event):
+        if cancel_event is None:
+            return self.idle.get()
+        while not cancel_event.is_set():
+            try:
+                return self.idle.get(timeout = config.CANCEL_POLL_S)
+            except queue.Empty:
+                pass
+        raise JobCancelled("")
+
+    def _replace(self, worker):
+        if worker is not None:
+            worker.kill()
+        return self._spawn()
+
+    # new worker for a slot, None if it can't be started
+    def _spawn(self):
+        self.recycled += 1
+        try:
+            return FreeCADWorker(self.command)
+        except Exception as e:
+            print(f"{C.YELLOW}WARNING: unable to start a new FreeCAD worker, retrying at the next script.\n{e}{C.END}")
+            return None
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while not self.idle.empty():
+            worker = self.idle.get()
+            if worker is not None:
+                worker.stop()
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_failed = False
+
+# pool created the first time it's needed; None when disabled or when FreeCAD can't be launched
+def get_freecad_pool():
+    global _pool, _pool_failed
+    if config.FREECAD_POOL_SIZE <= 0 or _pool_failed:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            command = config.FREECAD_WORKER_COMMAND or [config.FREECAD_PATH]
+            try:
+                _pool = FreeCADPool(command, config.FREECAD_POOL_SIZE, config.FREECAD_WORKER_MAX_JOBS)
+                atexit.register(_pool.close)
+            except OSError as e:
+                _pool_failed = True
+                print(f"{C.YELLOW}WARNING: unable to start the FreeCAD workers, using one process per script.\n{e}{C.END}")
+                return None
+    return _pool
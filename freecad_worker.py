@@ -0,0 +1,82 @@
+# Long-lived headless FreeCAD worker, launched by freecad_pool.py as:
+#   freecadcmd freecad_worker.py
+# It receives one job per line on stdin ({"id": ..., "script": <absolute path>}),
+# runs the script starting from an empty session and answers with one line:
+#   QTC_WORKER_RESULT {"id": ..., "returncode": ..., "log": ...}
+# Everything else printed on stdout (FreeCAD console messages) is just log noise for the pool.
+#
+# The same file also works with a plain python interpreter (stand-in worker),
+# so the pool can be tested when FreeCAD is not installed.
+
+import io
+import os
+import sys
+import json
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+
+RESULT_MARKER = "QTC_WORKER_RESULT "
+
+# importing FreeCAD only once is the whole point of the worker
+try:
+    import FreeCAD
+    import Part  # noqa: F401
+except ImportError:
+    FreeCAD = None
+
+# every job starts (and ends) with no open document
+def reset_documents():
+    if FreeCAD is None:
+        return
+    for doc_name in list(FreeCAD.listDocuments()):
+        FreeCAD.closeDocument(doc_name)
+
+def run_job(script_path):
+    buffer = io.StringIO()
+    returncode = 0
+
+    with redirect_stdout(buffer), redirect_stderr(buffer):
+        try:
+            with open(script_path, "r", encoding="utf-8") as f:
+                source = f.read()
+            # fresh namespace for every script, like a new freecadcmd process
+            exec(compile(source, script_path, "exec"), {"__name__": "__main__", "__file__": script_path})
+
+        # the footer uses sys.exit(1) to report a failed export
+        except SystemExit as e:
+            if e.code is None:
+                returncode = 0
+            elif isinstance(e.code, int):
+                returncode = e.code
+            else:
+                print(e.code)
+                returncode = 1
+
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+
+    try:
+        reset_documents()
+    except Exception:
+        pass
+
+    return returncode, buffer.getvalue()
+
+# writing straight on the file descriptor: FreeCAD may replace sys.stdout
+def send(message):
+    os.write(1, (RESULT_MARKER + json.dumps(message) + "\n").encode("utf-8"))
+
+def worker_loop():
+    reset_documents()
+    stdin = sys.__stdin__ if sys.__stdin__ is not None else sys.stdin
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        job = json.loads(line)
+        returncode, log = run_job(job["script"])
+        send({"id": job["id"], "returncode": returncode, "log": log})
+
+# freecadcmd doesn't always run the file as __main__, so the loop starts unconditionally
+worker_loop()
@@ -1,39 +1,197 @@
-import cadquery as cq
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+
+import config
+
+# cadquery and OCP are imported inside the functions (first analysis),
+# so importing this module doesn't slow down the startup
+
+# results of the analysis, memoized by the hash of the shape (or of the STEP file)
+# so analyzing the same geometry twice (FreeCAD import, re-runs, replays) is free
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _empty_stats():
+    return {
+        "volume": 0,
+        "faces": 0,
+        "area": 0,
+        "edges": 0,
+        "vertices": 0,
+        "solids": 0,
+        "bbox": {"xmin": 0, "ymin": 0, "zmin": 0, "xmax": 0, "ymax": 0, "zmax": 0, "xlen": 0, "ylen": 0, "zlen": 0},
+        "center_of_mass": (0, 0, 0),
+        "valid": False,
+        "face_types": {},
+        "mesh_hash": ""
+    }
+
+def _cache_get(key):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return dict(_cache[key])
+    return None
+
+def _cache_put(key, stats):
+    with _cache_lock:
+        _cache[key] = dict(stats)
+        _cache.move_to_end(key)
+        while len(_cache) > config.GEOMETRY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def clear_geometry_cache():
+    with _cache_lock:
+        _cache.clear()
+
+# every geometric object of the workplane in a single compound: one pass for all the solids
+def _to_compound(cq_object):
+    import cadquery as cq
+
+    # checking whether cq_object it's a workplane or not
+    if isinstance(cq_object, cq.Workplane):
+        # extracts the list of actual solid objects from the container
+        shapes = [obj for obj in cq_object.vals() if isinstance(obj, cq.Shape)]
+    elif isinstance(cq_object, cq.Shape):
+        # if it's not a workplane, we assume that it's a geometric object
+        shapes = [cq_object]
+    else:
+        shapes = []
+
+    if len(shapes) == 1:
+        return shapes[0]
+    return cq.Compound.makeCompound(shapes)
+
+# content hash of a shape: same geometry and topology -> same BRep text -> same key
+# The text is written from a copy of the topology (geometry shared, no mesh), without triangles and with
+# the state flags cleared: the analysis tessellates and checks the shape, and the mesh and the flags it
+# leaves on the original would give the same shape a new key after its first analysis.
+def shape_hash(shape):
+    from OCP.TopExp import TopExp
+    from OCP.BRepTools import BRepTools
+    from OCP.BRepBuilderAPI import BRepBuilderAPI_Copy
+    from OCP.TopTools import TopTools_FormatVersion_CURRENT, TopTools_IndexedMapOfShape
+
+    clean = BRepBuilderAPI_Copy(shape.wrapped, False, False).Shape()
+    sub_shapes = TopTools_IndexedMapOfShape()
+    TopExp.MapShapes_s(clean, sub_shapes)
+    for index in range(1, sub_shapes.Extent() + 1):
+        sub_shapes.FindKey(index).Checked(False)    # the copy has its own TShapes, the original is untouched
+    buffer = io.BytesIO()
+    BRepTools.Write_s(clean, buffer, False, False, TopTools_FormatVersion_CURRENT)
+    return hashlib.sha256(buffer.getvalue()).hexdigest()
+
+def _count(shape, shape_type):
+    from OCP.TopExp import TopExp
+    from OCP.TopTools import TopTools_IndexedMapOfShape
+
+    shapes_map = TopTools_IndexedMapOfShape()
+    TopExp.MapShapes_s(shape, shape_type, shapes_map)
+    return shapes_map.Extent()
+
+# histogram of the surface types (PLANE, CYLINDER, BSPLINE, ...)
+def _face_types(shape):
+    histogram = {}
+    for face in shape.Faces():
+        face_type = face.geomType()
+        histogram[face_type] = histogram.get(face_type, 0) + 1
+    return dict(sorted(histogram.items()))
+
+# hash of the tessellation, independent from the position of the part and from the vertex order
+def _mesh_hash(shape, origin):
+    vertices, triangles = shape.tessellate(config.FINGERPRINT_TOLERANCE, 0.5)
+    ox, oy, oz = origin
+    decimals = config.FINGERPRINT_DECIMALS
+    points = sorted(
+        (round(v.x - ox, decimals), round(v.y - oy, decimals), round(v.z - oz, decimals))
+        for v in vertices
+    )
+    digest = hashlib.sha256(f"{len(triangles)}|".encode("ascii"))
+    digest.update(repr(points).encode("ascii"))
+    return digest.hexdigest()
+
+# all the metrics of a shape in a single pass
+def _analyze_shape(shape):
+    from OCP.GProp import GProp_GProps
+    from OCP.BRepGProp import BRepGProp
+    from OCP.BRepBndLib import BRepBndLib
+    from OCP.Bnd import Bnd_Box
+    from OCP.BRepCheck import BRepCheck_Analyzer
+    from OCP.TopAbs import TopAbs_SOLID, TopAbs_FACE, TopAbs_EDGE, TopAbs_VERTEX
+
+    wrapped = shape.wrapped
+
+    # mass properties (volume and center of mass), surface properties (area)
+    volume_props = GProp_GProps()
+    BRepGProp.VolumeProperties_s(wrapped, volume_props)
+    surface_props = GProp_GProps()
+    BRepGProp.SurfaceProperties_s(wrapped, surface_props)
+    center = volume_props.CentreOfMass()
+
+    box = Bnd_Box()
+    BRepBndLib.AddOptimal_s(wrapped, box, True, False) # tight box, no tolerance gap
+    if box.IsVoid():
+        bbox = _empty_stats()["bbox"]
+    else:
+        xmin, ymin, zmin, xmax, ymax, zmax = box.Get()
+        bbox = {
+            "xmin": xmin, "ymin": ymin, "zmin": zmin,
+            "xmax": xmax, "ymax": ymax, "zmax": zmax,
+            "xlen": xmax - xmin, "ylen": ymax - ymin, "zlen": zmax - zmin
+        }
+
+    return {
+        "volume": volume_props.Mass(),
+        "faces": _count(wrapped, TopAbs_FACE),
+        "area": surface_props.Mass(),
+        "edges": _count(wrapped, TopAbs_EDGE),
+        "vertices": _count(wrapped, TopAbs_VERTEX),
+        "solids": _count(wrapped, TopAbs_SOLID),
+        "bbox": bbox,
+        "center_of_mass": (center.X(), center.Y(), center.Z()),
+        "valid": BRepCheck_Analyzer(wrapped).IsValid(),
+        "face_types": _face_types(shape),
+        "mesh_hash": _mesh_hash(shape, (bbox["xmin"], bbox["ymin"], bbox["zmin"]))
+    }
 
 # function to analyze the object to determine if it's valid
 def analyze_geometry(cq_object):
-    
-    total_volume = 0
-    total_faces = 0
-    
     try:
-        obj_to_analyze = []
-        
-        # checking whether cq_object it's a workplane or not 
-        if isinstance(cq_object, cq.Workplane):
-            # extracts the list of actual solid objects from the container
-            obj_to_analyze = cq_object.vals() 
-        else:
-            # if it's not a workplane, we assume that it's a geometric object
-            obj_to_analyze = [cq_object] 
-
-        for obj in obj_to_analyze:
-
-            # checking and calculating the total volume
-            if hasattr(obj, "Volume"):
-                obj_vol = obj.Volume()
-                total_volume += obj_vol
-
-            # checking and calculating the number of faces
-            if hasattr(obj, "Faces"):
-                obj_faces = len(obj.Faces())
-                total_faces += obj_faces
-        
+        shape = _to_compound(cq_object)
+        key = shape_hash(shape)
+        stats = _cache_get(key)
+        if stats is None:
+            stats = _analyze_shape(shape)
+            _cache_put(key, stats)
+        return stats
+
     except Exception as e:
         print(f"An error occurred during the geometrical analysis: {e}")
-        return {"volume": 0, "faces": 0}
+        return _empty_stats()
 
-    return {
-        "volume": total_volume, 
-        "faces": total_faces
-    }
\ No newline at end of file
+# analysis of a STEP file, memoized by the file content: a cache hit doesn't even import it
+def analyze_step_file(step_path):
+    import cadquery as cq
+
+    with open(step_path, "rb") as f:
+        key = "step:" + hashlib.sha256(f.read()).hexdigest()
+    stats = _cache_get(key)
+    if stats is None:
+        stats = analyze_geometry(cq.importers.importStep(step_path))
+        _cache_put(key, stats)
+    return stats
+
+# copies the metrics in the run record
+def record_geometry(run_data, geom_stats):
+    bbox = geom_stats["bbox"]
+    run_data["Volume_mm3"] = round(geom_stats["volume"], 2) # round to 2 decimal places instead of 15
+    run_data["Faces_Count"] = geom_stats["faces"]
+    run_data["Area_mm2"] = round(geom_stats["area"], 2)
+    run_data["BBox_mm"] = f"{round(bbox['xlen'], 2)} x {round(bbox['ylen'], 2)} x {round(bbox['zlen'], 2)}"
+    run_data["Edges_Count"] = geom_stats["edges"]
+    run_data["Vertices_Count"] = geom_stats["vertices"]
+    run_data["Solids_Count"] = geom_stats["solids"]
+    run_data["Center_Of_Mass"] = [round(value, 3) for value in geom_stats["center_of_mass"]]
+    run_data["Is_Valid"] = geom_stats["valid"]
@@ -1,51 +1,146 @@
 import os
 import time                     # to time the llm's production times
+import argparse
 import config
-import cadquery as cq           # CAD engine
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import OUTPUT_DIR, Colors as C
-from workflow_manager import request_manager
-from excel_engine import init_run_data, save_to_excel
+from workflow_manager import request_manager, create_output_folder
+from batch_engine import run_batch
+from excel_engine import init_run_data, start_excel_writer, stop_excel_writer, build_excel_report
+from export_engine import save_when_exported, wait_for_exports
+from cache_engine import print_cache_stats
+from code_validator import print_validator_stats
+from speculative_engine import print_speculation_report
+from trace_engine import write_trace
+from fingerprint_engine import print_convergence_report
+from report_engine import update_report
+from memory_engine import print_memory_stats
+from artifact_store import print_artifact_stats, print_manifest
+from retrieval_engine import rebuild_index
+from sweep_engine import run_sweep
+from scoring_engine import score_files
 
 # creating output directory
 if not os.path.exists(f"{OUTPUT_DIR}"):
     os.makedirs(f"{OUTPUT_DIR}")
 
-# creating project output folder with object version check
-def create_output_folder(output_dir, model_name, name_base):
-    
-    if not os.path.exists(f"{output_dir}/{model_name}"):
-        os.makedirs(f"{output_dir}/{model_name}")
-    
-    version = 1
-    while True:
-        complete_project_name = name_base + "_v" + str(version)
-        if not os.path.exists(f"{output_dir}/{model_name}/{complete_project_name}"):
-            os.makedirs(f"{output_dir}/{model_name}/{complete_project_name}")
-            break
-        else:
-            version += 1
-    return complete_project_name
+# full benchmark of a single model: every model has its own run_data and output folder
+def run_model(model, user_input, project_name_base):
+    model_name = model["name"]
+    print(f"\n\n{C.BOLD}{C.CYAN}TESTING MODEL: {model_name}{C.END}\n")
+    project_name = create_output_folder(OUTPUT_DIR, model_name, project_name_base)
+
+    # dictionary for excel data
+    run_data = init_run_data(model_name, project_name, user_input)
+
+    request_manager(run_data, user_input, model["orcode"])
+    return run_data
+
+# command line: no arguments = interactive mode
+def parse_args():
+    parser = argparse.ArgumentParser(description="QueryToCAD: LLM to CAD benchmark")
+    commands = parser.add_subparsers(dest="command")
+
+    batch = commands.add_parser("batch", help="run a prompt suite against every model (non interactive)")
+    batch.add_argument("suite", help="prompt suite (.jsonl or .yaml) with 'name' and 'prompt' for each entry")
+    batch.add_argument("--workers", type=int, default=config.BATCH_WORKERS, help="cells running at the same time")
+    batch.add_argument("--models", nargs="+", help="only these model names (default: all of config.LLM_MODELS)")
+    batch.add_argument("--fresh", action="store_true", help="ignore the checkpoint and run every cell again")
+
+    report = commands.add_parser("report", help="summary per model and library from the run history (incremental)")
+    report.add_argument("--rebuild", action="store_true", help="read the whole run history again")
+    report.add_argument("--excel", action="store_true", help="also rebuild the formatted excel with every run")
+
+    artifacts = commands.add_parser("artifacts", help="manifest of the projects and of their files (artifact store)")
+    artifacts.add_argument("--model", default=None, help="only this model name")
+    artifacts.add_argument("--status", default=None, help="only this status (e.g. SUCCESS)")
+    artifacts.add_argument("--limit", type=int, default=50, help="newest projects shown")
+
+    commands.add_parser("index", help="add the successful runs of the history to the few-shot retrieval index")
+
+    sweep = commands.add_parser("sweep", help="run a saved script again over a grid of its top-level numeric variables (no LLM)")
+    sweep.add_argument("script", help="saved script (e.g. output/<model>/<project>/<project>.py)")
+    sweep.add_argument("--param", action="append", default=[], metavar="NAME=VALUES",
+                       help="values of a variable: 'width=10,20,30' or 'width=10:50:5' (start:stop:step); none = list the variables")
+    sweep.add_argument("--workers", type=int, default=None, help="variants running at the same time")
+    sweep.add_argument("--out", default=None, help="output folder (default: sweep_<timestamp> next to the script)")
+
+    score = commands.add_parser("score", help="shape accuracy (IoU, Chamfer, bbox error) of STEP files against a reference")
+    score.add_argument("reference", help="reference STEP file")
+    score.add_argument("steps", nargs="+", help="STEP files to score")
+    score.add_argument("--tolerance", type=float, default=None, help="mm, accuracy/speed knob (default: config.SCORE_TOLERANCE)")
+    score.add_argument("--csv", default=None, help="also write the scores in this csv file")
+
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    if args.command == "batch":
+        run_batch(args.suite, args.workers, args.models, args.fresh)
+        return
+    if args.command == "report":
+        update_report(rebuild = args.rebuild)
+        if args.excel:
+            build_excel_report()
+        return
+    if args.command == "artifacts":
+        print_manifest(args.model, args.status, args.limit)
+        return
+    if args.command == "index":
+        rebuild_index()
+        return
+    if args.command == "sweep":
+        run_sweep(args.script, args.param, args.out, args.workers)
+        return
+    if args.command == "score":
+        score_files(args.reference, args.steps, args.csv, args.tolerance)
+        return
+
     # --- USER INTERACTION --- #
     print(f"\n{C.HEADER}{C.BOLD}# --- QueryToCAD v1.1 --- #{C.END}\n")
     user_input = input("Scrivi cosa vuoi modellare > ")
     project_name_base = input("Nome del file del progetto > ")
+    start_benchmark = time.time()
 
     # --- LLM LOOP --- #
-    for model in config.LLM_MODELS:
-        model_name = model["name"]
-        print(f"\n\n{C.BOLD}{C.CYAN}TESTING MODEL: {model_name}{C.END}\n")
-        project_name = create_output_folder(OUTPUT_DIR, model_name, project_name_base)
-
-        # dictionary for excel data
-        run_data = init_run_data(model_name, project_name, user_input)
-
-        request_manager(run_data, user_input, model["orcode"])
+    if config.PARALLEL_MODELS:
+        # every model runs in its own thread, the excel writer serializes the results
+        start_excel_writer()
+        try:
+            with ThreadPoolExecutor(max_workers = config.MAX_PARALLEL_MODELS) as pool:
+                futures = {
+                    pool.submit(run_model, model, user_input, project_name_base): model["name"]
+                    for model in config.LLM_MODELS
+                }
+                for future in as_completed(futures):
+                    try:
+                        # the run is saved when its files are written, the next model doesn't wait
+                        save_when_exported(future.result())
+                    except Exception as e:
+                        print(f"{C.RED}ERROR: model {futures[future]} crashed.\n{e}{C.END}")
+        finally:
+            wait_for_exports()
+            stop_excel_writer()
+    else:
+        for model in config.LLM_MODELS:
+            run_data = run_model(model, user_input, project_name_base)
+            save_when_exported(run_data)
+        wait_for_exports()
 
-        save_to_excel(run_data)
+    # summary per model and library (only the new runs are read), the full excel only on request
+    update_report()
+    if config.EXCEL_REPORT:
+        build_excel_report()
 
+    print(f"\nTotal benchmark time: {round(time.time() - start_benchmark, 2)}s")
+    print_cache_stats()
+    print_validator_stats()
+    print_speculation_report()
+    print_memory_stats()
+    print_artifact_stats()
+    print_convergence_report()
+    write_trace()
     print(f"\n{C.HEADER}{C.BOLD}# --- BENCHMARK COMPLETED --- #{C.END}\n")
 
 if __name__ == "__main__":
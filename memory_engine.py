@@ -0,0 +1,139 @@
+import os
+import gc
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import config
+from config import Colors as C
+
+# Memory of long runs (batches of hundreds of requests in the same process).
+#   - per run: RSS at the start and at the end, peak RSS (sampled every MEMORY_SAMPLE_S while the run is
+#     active) and, only with MEMORY_TRACEMALLOC, the tracemalloc delta of the Python allocations
+#     (tracing slows down every allocation: it's started by the first tracked run and stopped when no run is left).
+#     With parallel runs the process is shared: the numbers include the runs in progress at the same time.
+#   - OCC shapes of the generated code often live in reference cycles (a function defined by the code
+#     keeps its namespace alive), so a collection runs after every request (MEMORY_GC_EVERY_RUN)
+#   - above MEMORY_CEILING_MB the execution context is recycled: caches cleared, freed heap given back
+#     to the system, CadQuery sandbox workers restarted
+# psutil is used when installed, otherwise /proc (Linux) or the peak RSS of the resource module.
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MB = 1024 * 1024
+
+_active = {}    # id(run_data) -> peak RSS (MB) of the runs in progress
+_active_lock = threading.Lock()
+_sampler = None
+_recycles = 0
+_floor_mb = 0.0     # RSS left by the last recycle: if it's over the ceiling, the next one waits for new growth
+_tracing = False    # tracemalloc started here (a tracing started by someone else is left alone)
+_release_lock = threading.Lock()
+
+# resident memory of this process in MB (0 if it can't be measured)
+def rss_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / MB
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024   # peak, kB on Linux
+    return 0.0
+
+def _sample_loop():
+    while True:
+        time.sleep(config.MEMORY_SAMPLE_S)
+        with _active_lock:
+            if not _active:
+                continue
+            rss = rss_mb()
+            for key in _active:
+                _active[key] = max(_active[key], rss)
+
+def _start_sampler():
+    global _sampler
+    with _active_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target = _sample_loop, name = "memory-sampler", daemon = True)
+            _sampler.start()
+
+# Wraps one request: RSS_Start_MB, RSS_End_MB, Peak_RSS_MB and Py_Alloc_Delta_KB in run_data
+@contextmanager
+def track_memory(run_data):
+    global _tracing
+    _start_sampler()
+    start_rss = rss_mb()
+    with _active_lock:
+        if config.MEMORY_TRACEMALLOC and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+            _tracing = True
+        start_alloc = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        _active[id(run_data)] = start_rss
+    try:
+        yield
+    finally:
+        if config.MEMORY_GC_EVERY_RUN:
+            gc.collect()    # shapes and namespaces of the generated code, before measuring
+        end_rss = rss_mb()
+        with _active_lock:
+            peak_rss = max(_active.pop(id(run_data), start_rss), end_rss)
+            if tracemalloc.is_tracing():
+                run_data["Py_Alloc_Delta_KB"] = round((tracemalloc.get_traced_memory()[0] - start_alloc) / 1024, 1)
+            # the last run in progress stops the tracing (the parallel runs share it)
+            if _tracing and not _active:
+                tracemalloc.stop()
+                _tracing = False
+        run_data["RSS_Start_MB"] = round(start_rss, 1)
+        run_data["RSS_End_MB"] = round(end_rss, 1)
+        run_data["Peak_RSS_MB"] = round(peak_rss, 1)
+        check_memory_ceiling()
+
+# gives the freed heap back to the system (glibc keeps it otherwise, RSS would never go down)
+def _trim_heap():
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+# Recycles the execution context: caches, heap, sandbox workers
+def release_memory(reason = ""):
+    global _recycles, _floor_mb
+    from geometrical_analysis import clear_geometry_cache
+    from cadquery_sandbox import recycle_cadquery_sandbox
+
+    before = rss_mb()
+    clear_geometry_cache()
+    gc.collect()
+    _trim_heap()
+    recycle_cadquery_sandbox()
+    _recycles += 1
+    _floor_mb = rss_mb()
+    print(f"{C.CYAN}Memory recycled{f' ({reason})' if reason else ''}: {before:.0f} MB -> {rss_mb():.0f} MB.{C.END}")
+
+def check_memory_ceiling():
+    if not config.MEMORY_CEILING_MB:
+        return
+    rss = rss_mb()
+    if rss > config.MEMORY_CEILING_MB and rss > _floor_mb * 1.1:
+        # parallel runs over the ceiling at the same time: only one recycles
+        if _release_lock.acquire(blocking = False):
+            try:
+                release_memory(f"{rss:.0f} MB over the {config.MEMORY_CEILING_MB} MB ceiling")
+            finally:
+                _release_lock.release()
+
+def print_memory_stats():
+    print(f"Memory: {rss_mb():.0f} MB resident, {_recycles} recycles over the {config.MEMORY_CEILING_MB} MB ceiling.")
@@ -0,0 +1,151 @@
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in of the OpenRouter (OpenAI compatible) chat completions endpoint.
+# It answers every model with canned scripts, with or without streaming, after a configurable latency.
+# An answer can also be an error ({"status": 429, "retry_after": 1}) to test the retries.
+# Usage:
+#   python mock_openrouter.py --port 8765 --latency 0.5
+#   set OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1 and run main.py as usual
+# or from python: server, base_url = start_mock_server()
+
+DEFAULT_SCRIPT = """import cadquery as cq
+
+length = 40
+width = 20
+height = 10
+
+result = cq.Workplane("XY").box(length, width, height)
+"""
+
+class MockOpenRouter:
+
+    def __init__(self, responses = None, latency = 0.0, token_delay = 0.0, chunk_size = 4):
+        self.responses = responses or [DEFAULT_SCRIPT] # answers used in rotation
+        self.latency = latency          # seconds before the first token
+        self.token_delay = token_delay  # seconds between two streamed chunks
+        self.chunk_size = chunk_size    # characters per streamed chunk (~1 token)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def next_response(self, body):
+        with self._lock:
+            answer = self.responses[self.requests % len(self.responses)]
+            self.requests += 1
+        # a response can also be a function of the request (e.g. good code only after a repair prompt)
+        if callable(answer):
+            answer = answer(body)
+        return answer
+
+def _make_handler(mock):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass    # silent server
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            content = mock.next_response(body)
+            model = body.get("model", "mock")
+            created = int(time.time())
+            time.sleep(mock.latency)
+
+            # simulated transport error: {"status": 429, "retry_after": 1}
+            if isinstance(content, dict):
+                self._error(content)
+                return
+
+            if body.get("stream"):
+                self._stream(content, model, created, body)
+            else:
+                self._complete(content, model, created)
+
+        def _error(self, error):
+            data = json.dumps({"error": {"message": error.get("message", "mock error"), "code": error["status"]}}).encode("utf-8")
+            self.send_response(error["status"])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if "retry_after" in error:
+                self.send_header("Retry-After", str(error["retry_after"]))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _complete(self, content, model, created):
+            answer = {
+                "id": f"mock-{created}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": _usage(content)
+            }
+            data = json.dumps(answer).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        # server-sent events, like the real endpoint
+        def _stream(self, content, model, created, body):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            def send(chunk):
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            base = {"id": f"mock-{created}", "object": "chat.completion.chunk", "created": created, "model": model}
+            try:
+                for start in range(0, len(content), mock.chunk_size):
+                    piece = content[start:start + mock.chunk_size]
+                    send({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                    if mock.token_delay:
+                        time.sleep(mock.token_delay)
+                send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                if body.get("stream_options", {}).get("include_usage"):
+                    send({**base, "choices": [], "usage": _usage(content)})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass    # the client cancelled the stream
+
+    return Handler
+
+# rough token count: the mock only needs plausible numbers
+def _usage(content):
+    completion_tokens = max(1, len(content) // 4)
+    return {"prompt_tokens": 0, "completion_tokens": completion_tokens, "total_tokens": completion_tokens}
+
+# starts the server in a background thread (port 0 = random free port)
+# Returns: (server, base_url to use as OPENROUTER_BASE_URL)
+def start_mock_server(mock = None, host = "127.0.0.1", port = 0):
+    mock = mock or MockOpenRouter()
+    server = ThreadingHTTPServer((host, port), _make_handler(mock))
+    server.daemon_threads = True
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="local stand-in of the OpenRouter API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    args = parser.parse_args()
+
+    mock = MockOpenRouter(latency=args.latency, token_delay=args.token_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), _make_handler(mock))
+    print(f"Mock OpenRouter listening on http://127.0.0.1:{args.port}/api/v1")
+    server.serve_forever()
@@ -0,0 +1,238 @@
+import re
+
+import config
+
+# Repair prompts of the self-correction loop.
+# The old prompt sent the whole task, the whole previous code and the raw error log (for FreeCAD a full
+# console dump), so every retry was bigger and slower than the first call. Here:
+#   - tokens are counted (tiktoken when installed, ~4 characters per token otherwise)
+#   - tracebacks are cut down to the frames of the generated code plus the last library frames
+#   - console dumps lose duplicated and empty lines, and only the tail is kept
+#   - the prompt has to fit in REPAIR_PROMPT_BUDGET tokens
+#   - when the error points to some lines of a long script, the code is sent with line numbers and the
+#     model answers with "@@ start-end" patches instead of rewriting everything (less completion tokens)
+
+# file name of the generated code in the tracebacks (compile(code, GENERATED_FILENAME, "exec"))
+GENERATED_FILENAME = "<generated>"
+
+_FRAME_RE = re.compile(r'^\s*File "(?P<file>[^"]+)", line (?P<line>\d+)')
+_HUNK_RE = re.compile(r"^@@ *(\d+) *- *(\d+) *(?:@@)?$")
+
+_encoder = None
+
+def count_tokens(text):
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:   # not installed, or the encoding can't be downloaded
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text, disallowed_special = ()))
+    return (len(text) + 3) // 4
+
+# frames of the generated script: exec'd CadQuery code or FreeCAD wrapper (same line numbers)
+def _is_generated(file_name):
+    return file_name == GENERATED_FILENAME or file_name.endswith("_wrapper.py")
+
+# last "Traceback ..." block of the log split in (frames, exception lines)
+# every frame is the list of its lines ("File ..." and the source line, when printed)
+def _parse_traceback(lines):
+    start = max(i for i, line in enumerate(lines) if line.startswith("Traceback (most recent call last)"))
+    frames = []
+    exception = []
+    for line in lines[start + 1:]:
+        if _FRAME_RE.match(line):
+            frames.append([line])
+        elif frames and not exception and line.startswith(" "):
+            frames[-1].append(line)
+        elif line.strip():
+            exception.append(line)
+    return frames, exception
+
+# the source line is missing from the tracebacks of exec'd code: it's taken from the script
+# library frames lose the "^^^^" markers and the install path ("site-packages/cadquery/cq.py")
+def _clean_frame(frame, code_lines):
+    match = _FRAME_RE.match(frame[0])
+    if _is_generated(match.group("file")):
+        number = int(match.group("line"))
+        if len(frame) == 1 and 1 <= number <= len(code_lines):
+            return frame + ["    " + code_lines[number - 1].strip()]
+        return frame
+    file_name = match.group("file").replace("\\", "/")
+    if "site-packages/" in file_name:
+        frame = [frame[0].replace(match.group("file"), file_name.split("site-packages/")[-1])] + frame[1:]
+    return [line for line in frame if line.strip().strip("^~")]
+
+def _trim_traceback(lines, code_lines, keep_last):
+    frames, exception = _parse_traceback(lines)
+    generated = [i for i, frame in enumerate(frames) if _is_generated(_FRAME_RE.match(frame[0]).group("file"))]
+    first = generated[0] if generated else 0   # the frames before the generated code are the runner (exec)
+
+    trimmed = ["Traceback (most recent call last):"]
+    omitted = 0
+    for index, frame in enumerate(frames[first:], start = first):
+        match = _FRAME_RE.match(frame[0])
+        if _is_generated(match.group("file")) or index >= len(frames) - keep_last:
+            if omitted:
+                trimmed.append(f"  ... {omitted} library frames omitted ...")
+                omitted = 0
+            trimmed.extend(_clean_frame(frame, code_lines))
+        else:
+            omitted += 1
+    if omitted:
+        trimmed.append(f"  ... {omitted} library frames omitted ...")
+    return trimmed + exception
+
+# console output without empty and repeated lines
+def _trim_console(lines):
+    trimmed = []
+    seen = set()
+    for line in lines:
+        line = line.rstrip()
+        if not line.strip() or line in seen:
+            continue
+        seen.add(line)
+        trimmed.append(line)
+    return trimmed
+
+# error log reduced to what the model needs, within max_tokens (the end of the log is the important part)
+def trim_error_log(error_log, previous_code = "", max_tokens = None):
+    max_tokens = max_tokens or config.REPAIR_ERROR_BUDGET
+    lines = error_log.splitlines()
+    code_lines = previous_code.splitlines()
+
+    if any(line.startswith("Traceback (most recent call last)") for line in lines):
+        # library frames are the first to go, the frames of the generated code stay
+        for keep_last in range(config.REPAIR_TRACEBACK_FRAMES, -1, -1):
+            trimmed = _trim_traceback(lines, code_lines, keep_last)
+            if count_tokens("\n".join(trimmed)) <= max_tokens:
+                break
+        lines = trimmed
+    else:
+        lines = _trim_console(lines)
+
+    kept = []
+    tokens = 0
+    for line in reversed(lines):
+        line_tokens = count_tokens(line) + 1
+        if kept and tokens + line_tokens > max_tokens:
+            kept.append("[... earlier output omitted ...]")
+            break
+        kept.append(line)
+        tokens += line_tokens
+    return "\n".join(reversed(kept))
+
+# line numbers of the generated script referenced by the error (traceback frames, SyntaxError)
+def error_lines(error_log):
+    numbers = []
+    for line in error_log.splitlines():
+        match = _FRAME_RE.match(line)
+        if match and _is_generated(match.group("file")):
+            numbers.append(int(match.group("line")))
+    return sorted(set(numbers))
+
+def number_lines(code, first = 1, last = None):
+    lines = code.splitlines()
+    last = min(last or len(lines), len(lines))
+    width = len(str(len(lines)))
+    return "\n".join(f"{number:>{width}} | {lines[number - 1]}" for number in range(first, last + 1))
+
+# numbered code around the error lines only (used when the whole script doesn't fit in the budget)
+def _code_windows(code, numbers):
+    context = config.REPAIR_CONTEXT_LINES
+    total = len(code.splitlines())
+    windows = []
+    for number in numbers:
+        first, last = max(1, number - context), min(total, number + context)
+        if windows and first <= windows[-1][1] + 1:
+            windows[-1][1] = max(windows[-1][1], last)
+        else:
+            windows.append([first, last])
+    parts = [number_lines(code, first, last) for first, last in windows]
+    return "\n   ...\n".join(parts)
+
+def _rewrite_prompt(user_prompt, error, code):
+    return f"""
+    ORIGINAL TASK: {user_prompt}
+
+    PREVIOUSLY GENERATED CODE:
+    ```python
+    {code}
+    ```
+    ERROR RETURNED: {error}
+
+    GOAL:
+    Rewrite the entire code to fix the error.
+    Don't provide explanations, just the correct Python code.
+    """
+
+def _patch_prompt(user_prompt, error, numbered_code, total_lines):
+    return f"""
+    ORIGINAL TASK: {user_prompt}
+
+    PREVIOUSLY GENERATED CODE ({total_lines} lines, with line numbers):
+    {numbered_code}
+
+    ERROR RETURNED: {error}
+
+    GOAL:
+    Fix the error changing as few lines as possible.
+    Answer ONLY with one or more patches in this format, without line numbers in the new code:
+    @@ <first line>-<last line>
+    <new code that replaces those lines, it can be longer or shorter>
+    If the whole code must change, answer with the complete corrected Python code instead.
+    Don't provide explanations.
+    """
+
+# Returns: (str: repair prompt, bool: True if the answer can be a "@@ start-end" patch)
+def build_repair_prompt(user_prompt, error_log, previous_code, budget = None):
+    budget = budget or config.REPAIR_PROMPT_BUDGET
+    error = trim_error_log(error_log, previous_code)
+    total_lines = len(previous_code.splitlines())
+    numbers = [n for n in error_lines(error_log) if n <= total_lines]
+
+    # short scripts, or no line to point at: full rewrite, as before
+    patch_mode = bool(numbers) and total_lines >= config.REPAIR_PATCH_MIN_LINES
+    if patch_mode:
+        code = number_lines(previous_code)
+        compose = lambda error, code: _patch_prompt(user_prompt, error, code, total_lines)
+        if count_tokens(compose(error, code)) > budget:
+            code = _code_windows(previous_code, numbers)
+    else:
+        code = previous_code
+        compose = lambda error, code: _rewrite_prompt(user_prompt, error, code)
+
+    prompt = compose(error, code)
+    overflow = count_tokens(prompt) - budget
+    if overflow > 0:
+        # the code can't be cut any further: the error log pays for it (keeping at least its last lines)
+        error_budget = max(config.REPAIR_ERROR_BUDGET // 4, count_tokens(error) - overflow)
+        prompt = compose(trim_error_log(error_log, previous_code, error_budget), code)
+    return prompt, patch_mode
+
+# Applies the "@@ start-end" patches of the answer to the previous code.
+# Returns: the patched code, or None if the answer is not a patch (complete code)
+def apply_patch(previous_code, answer):
+    lines = answer.strip().splitlines()
+    if not lines or not _HUNK_RE.match(lines[0].strip()):
+        return None
+
+    hunks = []
+    for line in lines:
+        match = _HUNK_RE.match(line.strip())
+        if match:
+            hunks.append((int(match.group(1)), int(match.group(2)), []))
+        else:
+            hunks[-1][2].append(line)
+
+    code_lines = previous_code.splitlines()
+    # applied from the bottom, so the line numbers of the other patches don't move
+    limit = len(code_lines)
+    for first, last, new_lines in sorted(hunks, key = lambda hunk: hunk[0], reverse = True):
+        if not 1 <= first <= last <= limit:
+            return None     # out of range or overlapping patches
+        code_lines[first - 1:last] = new_lines
+        limit = first - 1
+    return "\n".join(code_lines) + "\n"
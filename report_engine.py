@@ -0,0 +1,337 @@
+import os
+import csv
+import json
+import hashlib
+
+import config
+from config import RUNS_FILE, Colors as C
+
+# Analytics report over the run store (RUNS_FILE), per model and library:
+# success rate, attempts needed, latency percentiles, Status distribution, volume statistics,
+# first-attempt success (runs solved at the first attempt / runs, the same for every First_Attempt column)
+# and time to valid code with and without few-shot examples (retrieval_engine.py),
+# mean shape accuracy of the runs scored against a reference (scoring_engine.py).
+# The runs with an answer served by the LLM cache (Cache_Hits > 0) are counted (Cached_Runs) but left
+# out of the latencies: a cache hit takes milliseconds and would pull the percentiles down.
+#   - incremental: the aggregates and the byte offset already read are kept in REPORT_STATE_FILE,
+#     every report only reads the runs appended since the last one (the whole file if it was rewritten)
+#   - bounded memory: the new runs are read in chunks of REPORT_CHUNK_RUNS and aggregated with numpy,
+#     latencies go in fixed log-spaced histograms (percentiles within one bin, ~5%), not in lists
+#   - the output is a small csv (REPORT_SUMMARY_FILE, one row per model and library) instead of the
+#     formatted excel with every run (build_excel_report(), still available with 'main.py report --excel')
+# numpy is imported only when the report runs.
+
+LATENCY_FIELDS = ["Total_Time_s", "Gen_Time_s", "Exec_Time_s", "Time_To_Valid_s"]
+FIELDS = ["Timestamp", "Model", "Library", "Status", "Attempts", "Volume_mm3", "Prompt_Tokens", "Completion_Tokens", "Retrieval_Used", "Score_IoU", "Score_Chamfer_mm", "Cache_Hits"] + LATENCY_FIELDS
+LATENCY_BINS = 200
+LATENCY_MIN_S = 0.01
+LATENCY_MAX_S = 10000.0
+STATE_VERSION = 4
+
+def _bin_edges():
+    import numpy as np
+    return np.geomspace(LATENCY_MIN_S, LATENCY_MAX_S, LATENCY_BINS + 1)
+
+def _empty_group():
+    return {
+        "runs": 0,
+        "success": 0,
+        "cached": 0,        # runs with cache hits, not in the latencies
+        "status": {},
+        "attempts": [],     # histogram of the attempts of the successful runs (index = attempts)
+        "latency": {field: [0] * (LATENCY_BINS + 2) for field in LATENCY_FIELDS},    # + under/overflow bins
+        "volume": {"count": 0, "sum": 0.0, "sumsq": 0.0, "min": None, "max": None},
+        "tokens": 0,
+        "retrieval": {arm: {"runs": 0, "first_try": 0, "valid": 0, "time_to_valid": 0.0} for arm in ("rag", "plain")},
+        "score": {"count": 0, "iou": 0.0, "chamfer": 0.0},
+        "first": None,
+        "last": None
+    }
+
+def _empty_state(runs_file):
+    return {"version": STATE_VERSION, "runs_file": os.path.abspath(runs_file), "offset": 0, "head": "", "groups": {}}
+
+# hash of the first line: if it changes the store was rewritten and the report starts again
+def _head_of(runs_file):
+    with open(runs_file, "rb") as f:
+        return hashlib.sha1(f.readline()).hexdigest()
+
+def _load_state(runs_file, state_file):
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION and state.get("runs_file") == os.path.abspath(runs_file):
+                return state
+        except ValueError:
+            pass
+    return _empty_state(runs_file)
+
+def _save_state(state, state_file):
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+# new complete lines from offset, in chunks of records reduced to FIELDS (the call details are dropped at once)
+# a half written last line is left for the next report
+def _read_chunks(runs_file, offset, chunk_runs):
+    with open(runs_file, "rb") as f:
+        f.seek(offset)
+        chunk = []
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            line = line.strip()
+            if line:
+                try:
+                    record = json.loads(line)
+                    chunk.append({field: record.get(field) for field in FIELDS})
+                except (ValueError, AttributeError):
+                    pass    # broken line (crash while saving)
+            if len(chunk) >= chunk_runs:
+                yield chunk, offset
+                chunk = []
+        yield chunk, offset
+
+# one chunk of runs added to the aggregates of their groups (vectorized per column)
+def _aggregate(groups, records, edges):
+    import numpy as np
+    if not records:
+        return
+
+    keys = [f"{record['Model'] or ''}\t{record['Library'] or 'None'}" for record in records]
+    names, group_index = np.unique(np.array(keys), return_inverse = True)
+    n_groups = len(names)
+    statuses = np.array([str(record["Status"] or "") for record in records])
+    success = statuses == "SUCCESS"
+    attempts = np.array([int(_number(record.get("Attempts"))) for record in records])
+    volumes = np.array([_number(record.get("Volume_mm3")) for record in records])
+    tokens = np.array([_number(record.get("Prompt_Tokens")) + _number(record.get("Completion_Tokens")) for record in records])
+    timestamps = np.array([str(record["Timestamp"] or "") for record in records])
+    with_examples = np.array([_number(record.get("Retrieval_Used")) > 0 for record in records])
+    time_to_valid = np.array([_number(record.get("Time_To_Valid_s")) for record in records])
+    first_try = success & (attempts == 1)
+    iou = np.array([_number(record.get("Score_IoU")) if record.get("Score_IoU") is not None else -1 for record in records])
+    chamfer = np.array([_number(record.get("Score_Chamfer_mm")) for record in records])
+    scored = iou >= 0      # -1 = no reference
+    cached = np.array([_number(record.get("Cache_Hits")) > 0 for record in records])
+
+    runs = np.bincount(group_index, minlength = n_groups)
+    successes = np.bincount(group_index, weights = success, minlength = n_groups)
+    token_sums = np.bincount(group_index, weights = tokens, minlength = n_groups)
+
+    max_attempts = max(int(attempts.max()), 0) + 1
+    attempts_hist = np.zeros((n_groups, max_attempts), dtype = np.int64)
+    np.add.at(attempts_hist, (group_index[success], np.clip(attempts[success], 0, None)), 1)
+
+    status_names, status_index = np.unique(statuses, return_inverse = True)
+    status_counts = np.zeros((n_groups, len(status_names)), dtype = np.int64)
+    np.add.at(status_counts, (group_index, status_index), 1)
+
+    latency_hists = {}
+    for field in LATENCY_FIELDS:
+        values = np.array([_number(record.get(field)) for record in records])
+        measured = (values > 0) & ~cached     # 0 = not measured (e.g. Time_To_Valid_s of a failed run)
+        bins = np.searchsorted(edges, values[measured], side = "right")    # 0 = underflow, LATENCY_BINS + 1 = overflow
+        hist = np.zeros((n_groups, LATENCY_BINS + 2), dtype = np.int64)
+        np.add.at(hist, (group_index[measured], bins), 1)
+        latency_hists[field] = hist
+
+    measured_volume = success & (volumes > 0)
+    volume_count = np.bincount(group_index[measured_volume], minlength = n_groups)
+    volume_sum = np.bincount(group_index[measured_volume], weights = volumes[measured_volume], minlength = n_groups)
+    volume_sumsq = np.bincount(group_index[measured_volume], weights = volumes[measured_volume] ** 2, minlength = n_groups)
+
+    for index, name in enumerate(names):
+        group = groups.setdefault(str(name), _empty_group())
+        in_group = group_index == index
+        group["runs"] += int(runs[index])
+        group["success"] += int(successes[index])
+        group["cached"] += int((in_group & cached).sum())
+        group["tokens"] += int(token_sums[index])
+
+        for arm, in_arm in (("rag", in_group & with_examples), ("plain", in_group & ~with_examples)):
+            valid = in_arm & (time_to_valid > 0) & ~cached
+            retrieval = group["retrieval"][arm]
+            retrieval["runs"] += int(in_arm.sum())
+            retrieval["first_try"] += int((in_arm & first_try).sum())
+            retrieval["valid"] += int(valid.sum())
+            retrieval["time_to_valid"] += float(time_to_valid[valid].sum())
+
+        score = group["score"]
+        score["count"] += int((in_group & scored).sum())
+        score["iou"] += float(iou[in_group & scored].sum())
+        score["chamfer"] += float(chamfer[in_group & scored].sum())
+
+        hist = group["attempts"] + [0] * max(0, max_attempts - len(group["attempts"]))
+        for attempt, count in enumerate(attempts_hist[index]):
+            hist[attempt] += int(count)
+        group["attempts"] = hist
+
+        for status, count in zip(status_names, status_counts[index]):
+            if count:
+                group["status"][str(status)] = group["status"].get(str(status), 0) + int(count)
+
+        for field in LATENCY_FIELDS:
+            group["latency"][field] = [int(a + b) for a, b in zip(group["latency"][field], latency_hists[field][index])]
+
+        volume = group["volume"]
+        if volume_count[index]:
+            group_volumes = volumes[in_group & measured_volume]
+            volume["count"] += int(volume_count[index])
+            volume["sum"] += float(volume_sum[index])
+            volume["sumsq"] += float(volume_sumsq[index])
+            volume["min"] = float(group_volumes.min()) if volume["min"] is None else min(volume["min"], float(group_volumes.min()))
+            volume["max"] = float(group_volumes.max()) if volume["max"] is None else max(volume["max"], float(group_volumes.max()))
+
+        group_timestamps = sorted(str(t) for t in timestamps[in_group] if t)
+        if group_timestamps:
+            group["first"] = min(filter(None, [group["first"], group_timestamps[0]]))
+            group["last"] = max(filter(None, [group["last"], group_timestamps[-1]]))
+
+# percentile from a histogram: geometric center of the bin that contains it
+def _percentile(hist, q, edges):
+    import numpy as np
+    hist = np.asarray(hist)
+    total = hist.sum()
+    if not total:
+        return None
+    index = int(np.searchsorted(np.cumsum(hist), q / 100 * total, side = "left"))
+    if index == 0:
+        return LATENCY_MIN_S
+    if index > LATENCY_BINS:
+        return LATENCY_MAX_S
+    return float(np.sqrt(edges[index - 1] * edges[index]))
+
+# runs solved at the first attempt / runs, with (or without) few-shot examples
+def _rate(retrieval):
+    return round(retrieval["first_try"] / retrieval["runs"], 4) if retrieval["runs"] else None
+
+def _mean_time_to_valid(retrieval):
+    return round(retrieval["time_to_valid"] / retrieval["valid"], 2) if retrieval["valid"] else None
+
+def _summary_rows(groups, edges):
+    rows = []
+    for name, group in sorted(groups.items()):
+        model, library = name.split("\t")
+        attempts = group["attempts"]
+        solved = sum(attempts)
+        volume = group["volume"]
+        mean_volume = volume["sum"] / volume["count"] if volume["count"] else None
+        std_volume = None
+        if volume["count"]:
+            std_volume = max(volume["sumsq"] / volume["count"] - mean_volume ** 2, 0) ** 0.5
+        row = {
+            "Model": model,
+            "Library": library,
+            "Runs": group["runs"],
+            "Success_Rate": round(group["success"] / group["runs"], 4) if group["runs"] else 0,
+            "Cached_Runs": group["cached"],
+            "Mean_Attempts": round(sum(n * count for n, count in enumerate(attempts)) / solved, 3) if solved else None,
+            "First_Attempt_Per_Run": round(attempts[1] / group["runs"], 4) if group["runs"] and len(attempts) > 1 else 0,
+            "Attempts_Hist": " ".join(f"{n}:{count}" for n, count in enumerate(attempts) if count),
+            "Status": " ".join(f"{status}:{count}" for status, count in sorted(group["status"].items(), key = lambda item: -item[1])),
+        }
+        for field in LATENCY_FIELDS:
+            label = field[:-2]
+            for q in (50, 95, 99):
+                value = _percentile(group["latency"][field], q, edges)
+                row[f"{label}_p{q}_s"] = round(value, 2) if value is not None else None
+        row.update({
+            "Volume_Mean_mm3": round(mean_volume, 3) if mean_volume is not None else None,
+            "Volume_Std_mm3": round(std_volume, 3) if std_volume is not None else None,
+            "Volume_Min_mm3": volume["min"],
+            "Volume_Max_mm3": volume["max"],
+            "Tokens_per_Run": round(group["tokens"] / group["runs"]) if group["runs"] else 0,
+            "Runs_With_Examples": group["retrieval"]["rag"]["runs"],
+            "First_Attempt_Per_Run_With_Examples": _rate(group["retrieval"]["rag"]),
+            "First_Attempt_Per_Run_Without_Examples": _rate(group["retrieval"]["plain"]),
+            "Time_To_Valid_With_Examples_s": _mean_time_to_valid(group["retrieval"]["rag"]),
+            "Time_To_Valid_Without_Examples_s": _mean_time_to_valid(group["retrieval"]["plain"]),
+            "Scored_Runs": group["score"]["count"],
+            "Mean_IoU": round(group["score"]["iou"] / group["score"]["count"], 4) if group["score"]["count"] else None,
+            "Mean_Chamfer_mm": round(group["score"]["chamfer"] / group["score"]["count"], 4) if group["score"]["count"] else None,
+            "First_Run": group["first"],
+            "Last_Run": group["last"]
+        })
+        rows.append(row)
+    return rows
+
+def _write_summary(rows, summary_file):
+    tmp_file = f"{summary_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames = list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_file, summary_file)
+
+def print_summary(rows):
+    print(f"\n{C.BOLD}{'model':<28} {'library':<9} {'runs':>7} {'success':>8} {'attempts':>9} {'p50 s':>7} {'p95 s':>7}  status{C.END}")
+    for row in rows:
+        mean_attempts = row["Mean_Attempts"] if row["Mean_Attempts"] is not None else "-"
+        p50 = row["Total_Time_p50_s"] if row["Total_Time_p50_s"] is not None else "-"
+        p95 = row["Total_Time_p95_s"] if row["Total_Time_p95_s"] is not None else "-"
+        print(f"{row['Model']:<28} {row['Library']:<9} {row['Runs']:>7} {row['Success_Rate']:>8.1%} {mean_attempts:>9} {p50:>7} {p95:>7}  {row['Status']}")
+
+    # retrieval comparison per model (all libraries): first-attempt success with and without examples
+    models = {}
+    for row in rows:
+        arms = models.setdefault(row["Model"], {"rag": [0, 0], "plain": [0, 0]})
+        runs_with = row["Runs_With_Examples"]
+        for arm, runs, rate in (("rag", runs_with, row["First_Attempt_Per_Run_With_Examples"]), ("plain", row["Runs"] - runs_with, row["First_Attempt_Per_Run_Without_Examples"])):
+            arms[arm][0] += runs
+            arms[arm][1] += round((rate or 0) * runs)
+    if any(arms["rag"][0] for arms in models.values()):
+        print(f"\n{C.BOLD}{'model':<28} {'solved at the first attempt, with examples':>43} {'without':>16}{C.END}")
+        for model, arms in models.items():
+            cells = [f"{ok / runs:.1%} of {runs}" if runs else "-" for runs, ok in (arms["rag"], arms["plain"])]
+            print(f"{model:<28} {cells[0]:>28} {cells[1]:>16}")
+
+    # accuracy against the reference parts
+    scored_rows = [row for row in rows if row["Scored_Runs"]]
+    if scored_rows:
+        print(f"\n{C.BOLD}{'model':<28} {'library':<9} {'scored':>7} {'mean IoU':>9} {'Chamfer mm':>11}{C.END}")
+        for row in scored_rows:
+            print(f"{row['Model']:<28} {row['Library']:<9} {row['Scored_Runs']:>7} {row['Mean_IoU']:>9.3f} {row['Mean_Chamfer_mm']:>11.3f}")
+
+# Reads the runs appended since the last report, updates the aggregates and writes the summary.
+# rebuild=True ignores the saved state and reads the whole store again.
+# Returns: list of summary rows (one dict per model and library)
+def update_report(runs_file = RUNS_FILE, state_file = None, summary_file = None, rebuild = False, verbose = True):
+    state_file = state_file or config.REPORT_STATE_FILE
+    summary_file = summary_file or config.REPORT_SUMMARY_FILE
+    if not os.path.exists(runs_file):
+        print(f"{C.YELLOW}WARNING: no runs saved yet, report not created.{C.END}")
+        return []
+
+    state = _empty_state(runs_file) if rebuild else _load_state(runs_file, state_file)
+    head = _head_of(runs_file)
+    if state["head"] != head or state["offset"] > os.path.getsize(runs_file):
+        state = _empty_state(runs_file)     # the store was rewritten or truncated
+    state["head"] = head
+
+    edges = _bin_edges()
+    new_runs = 0
+    for records, offset in _read_chunks(runs_file, state["offset"], config.REPORT_CHUNK_RUNS):
+        _aggregate(state["groups"], records, edges)
+        new_runs += len(records)
+        state["offset"] = offset
+    _save_state(state, state_file)
+
+    rows = _summary_rows(state["groups"], edges)
+    if not rows:
+        print(f"{C.YELLOW}WARNING: no valid runs in {runs_file}, report not created.{C.END}")
+        return rows
+    _write_summary(rows, summary_file)
+    if verbose:
+        print_summary(rows)
+    print(f"Report updated with {new_runs} new runs: {summary_file}")
+    return rows
@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import threading
+
+import config
+from config import OUTPUT_DIR, Colors as C
+from repair_engine import count_tokens
+
+# Few-shot examples from the past successful runs.
+# Every successful script is added to a local similarity index (RETRIEVAL_FILE, one json line per example);
+# the first prompt of a request gets the RETRIEVAL_TOP_K closest working examples before the task.
+# Similarity: hashed TF-IDF (RETRIEVAL_DIM buckets, numpy, no external service) of the prompt
+# (words, word pairs, character 4-grams for plurals and Italian/English variants) plus the identifiers
+# of the code with a lower weight; cosine similarity, top-k with a minimum score.
+#   - RETRIEVAL_SCOPE "model": only the examples of the same model (the benchmark doesn't pass answers
+#     between models), "all": every model
+#   - the same prompt is never its own example (identical requests are the job of the LLM cache)
+#   - RETRIEVAL_HOLDOUT: share of the requests without examples, to compare the first-attempt success
+#     with and without retrieval in the same benchmark (report_engine.py)
+# numpy is imported with the index (first request).
+
+_WORD_RE = re.compile(r"[a-zà-ù]+")
+_IDENTIFIER_RE = re.compile(r"[A-Za-z]+")
+
+CODE_WEIGHT = 0.3
+NGRAM_WEIGHT = 0.5
+
+def _bucket(feature, dim):
+    return zlib.crc32(feature.encode("utf-8")) % dim
+
+def _features(prompt, code, dim):
+    counts = {}
+
+    def add(feature, weight):
+        bucket = _bucket(feature, dim)
+        counts[bucket] = counts.get(bucket, 0.0) + weight
+
+    words = _WORD_RE.findall(prompt.lower())
+    for index, word in enumerate(words):
+        add("w:" + word, 1.0)
+        if index:
+            add("b:" + words[index - 1] + " " + word, 1.0)
+        padded = f"#{word}#"
+        for start in range(len(padded) - 3):
+            add("g:" + padded[start:start + 4], NGRAM_WEIGHT)
+    for identifier in _IDENTIFIER_RE.findall(code):
+        add("c:" + identifier.lower(), CODE_WEIGHT)
+    return counts
+
+def _normalized_prompt(prompt):
+    return " ".join(prompt.lower().split())
+
+# the saved scripts start with the "# LLM used" / "# User prompt" header of save_file()
+def _strip_header(code):
+    lines = code.splitlines()
+    while lines and (lines[0].startswith("# LLM used:") or lines[0].startswith("# User prompt:") or not lines[0].strip()):
+        lines.pop(0)
+    return "\n".join(lines)
+
+class RetrievalIndex:
+
+    def __init__(self, index_path, dim):
+        import numpy as np
+        self.path = index_path
+        self.dim = dim
+        self.entries = []   # {"model", "prompt", "code", "library", "attempts"}
+        self.keys = set()   # hash of prompt + code, no duplicates
+        self.tf = np.zeros((64, dim), dtype = np.float32)     # rows grown by doubling
+        self.df = np.zeros(dim, dtype = np.float32)
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except (ValueError, KeyError):
+                        continue
+
+    @staticmethod
+    def _key(entry):
+        return hashlib.sha256((_normalized_prompt(entry["prompt"]) + "\x00" + entry["code"]).encode("utf-8")).hexdigest()
+
+    def _add(self, entry):
+        import numpy as np
+        key = self._key(entry)
+        if key in self.keys:
+            return False
+        row = len(self.entries)
+        if row == len(self.tf):
+            self.tf = np.concatenate([self.tf, np.zeros_like(self.tf)])
+        for bucket, count in _features(entry["prompt"], entry["code"], self.dim).items():
+            self.tf[row, bucket] = 1 + np.log(count) if count >= 1 else count    # sublinear tf
+        self.df += self.tf[row] > 0
+        self.entries.append(entry)
+        self.keys.add(key)
+        return True
+
+    def add(self, entry):
+        with self._lock:
+            if not self._add(entry):
+                return False
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return True
+
+    # Returns: list of (score, entry), best first
+    def search(self, prompt, top_k, model_name = None, min_score = 0.0):
+        import numpy as np
+        with self._lock:
+            count = len(self.entries)
+            if not count:
+                return []
+            tf = self.tf[:count]
+            idf = np.log((1 + count) / (1 + self.df)) + 1
+            query = np.zeros(self.dim, dtype = np.float32)
+            for bucket, value in _features(prompt, "", self.dim).items():
+                query[bucket] = 1 + np.log(value) if value >= 1 else value
+            query *= idf
+            weighted = tf * idf
+            norms = np.linalg.norm(weighted, axis = 1) * (np.linalg.norm(query) or 1)
+            scores = (weighted @ query) / np.where(norms > 0, norms, 1)
+
+            same_prompt = _normalized_prompt(prompt)
+            for row, entry in enumerate(self.entries):
+                if (model_name and entry["model"] != model_name) or _normalized_prompt(entry["prompt"]) == same_prompt:
+                    scores[row] = -1
+            best = np.argsort(-scores)[:top_k * 4]  # a few more: long examples can be skipped by the budget
+            return [(float(scores[row]), self.entries[row]) for row in best if scores[row] >= min_score]
+
+_index = None
+_index_lock = threading.Lock()
+
+# index loaded the first time it's needed (None when disabled)
+def get_retrieval_index():
+    global _index
+    if not config.RETRIEVAL_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = RetrievalIndex(config.RETRIEVAL_FILE, config.RETRIEVAL_DIM)
+    return _index
+
+# same answer for the same project: the holdout share of the requests runs without examples
+def _in_holdout(run_data):
+    if not config.RETRIEVAL_HOLDOUT:
+        return False
+    digest = hashlib.sha256(f"{run_data['Model']}/{run_data['Project_Name']}".encode("utf-8")).digest()
+    return digest[0] / 256 < config.RETRIEVAL_HOLDOUT
+
+# First prompt of a request, with the closest working examples in front of the task (when there are any).
+# Retrieval_Used and Retrieval_Score go in run_data.
+def retrieval_prompt(user_prompt, run_data):
+    index = get_retrieval_index()
+    if index is None or _in_holdout(run_data):
+        return user_prompt
+
+    model_name = run_data["Model"] if config.RETRIEVAL_SCOPE == "model" else None
+    examples = []
+    tokens = 0
+    for score, entry in index.search(user_prompt, config.RETRIEVAL_TOP_K, model_name, config.RETRIEVAL_MIN_SCORE):
+        example_tokens = count_tokens(entry["code"])
+        if tokens + example_tokens > config.RETRIEVAL_MAX_TOKENS:
+            continue
+        examples.append((score, entry))
+        tokens += example_tokens
+        if len(examples) == config.RETRIEVAL_TOP_K:
+            break
+    if not examples:
+        return user_prompt
+
+    run_data["Retrieval_Used"] = len(examples)
+    run_data["Retrieval_Score"] = round(examples[0][0], 3)
+    print(f"{len(examples)} similar working examples added to the prompt (best score {examples[0][0]:.2f}).")
+
+    blocks = [f"EXAMPLE {number} ({entry['library']}), request: {entry['prompt']}\n{entry['code']}" for number, (score, entry) in enumerate(examples, start = 1)]
+    return ("WORKING SCRIPTS FOR SIMILAR PARTS (reference only, adapt them to the task):\n\n"
+            + "\n\n".join(blocks)
+            + f"\n\nTASK: {user_prompt}")
+
+# called for every successful run: its script becomes an example for the next requests
+def add_example(run_data, user_prompt, code):
+    index = get_retrieval_index()
+    if index is None or run_data["Status"] != "SUCCESS":
+        return
+    index.add({
+        "model": run_data["Model"],
+        "prompt": user_prompt,
+        "code": code,
+        "library": run_data["Library"],
+        "attempts": run_data["Attempts"]
+    })
+
+# index built again from the run store and the saved scripts (history before the index existed)
+def rebuild_index():
+    from excel_engine import iter_runs
+    index = get_retrieval_index()
+    if index is None:
+        print(f"{C.YELLOW}WARNING: retrieval is disabled (config.RETRIEVAL_ENABLED).{C.END}")
+        return
+    added = 0
+    for record in iter_runs():
+        if record.get("Status") != "SUCCESS":
+            continue
+        project_name = record.get("Project_Name")
+        script_path = f"{OUTPUT_DIR}/{record.get('Model')}/{project_name}/{project_name}.py"
+        if not os.path.exists(script_path):
+            continue
+        with open(script_path, "r", encoding="utf-8") as f:
+            code = _strip_header(f.read())
+        added += index.add({
+            "model": record["Model"],
+            "prompt": record.get("Prompt", ""),
+            "code": code,
+            "library": record.get("Library", ""),
+            "attempts": record.get("Attempts", 0)
+        })
+    print(f"Retrieval index: {added} examples added, {len(index.entries)} in total ({index.path}).")
@@ -0,0 +1,269 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import concurrent.futures
+from email.utils import parsedate_to_datetime
+
+import config
+from config import Colors as C
+
+# Scheduler of the OpenRouter calls.
+# All the calls share one AsyncOpenAI client (one pooled HTTP connection pool) running on a
+# background event loop; the model threads submit requests and wait for the result.
+# For every request:
+#   - per-model and per-provider concurrency limits (semaphores)
+#   - per-provider token bucket (requests per second, with bursts)
+#   - transport failures (429, 5xx, timeouts, connection errors) are retried here with
+#     jittered exponential backoff, honoring Retry-After: they never use a code-repair attempt.
+# A 429 also pauses the whole provider, so the other requests don't hit the limit again.
+# A streamed call has short connect/read timeouts (transport errors, retried) and a budget for the whole
+# call (STREAM_MAX_SECONDS, STREAM_MAX_TOKENS): over the budget it's StreamBudgetExceeded, never retried.
+
+class StreamBudgetExceeded(Exception):
+
+    def __init__(self, message, stats):
+        super().__init__(message)
+        self.stats = stats
+
+class TransportError(Exception):
+    pass
+
+class RequestCancelled(Exception):
+    pass
+
+class TokenBucket:
+
+    def __init__(self, rate_per_s, burst):
+        self.rate = rate_per_s
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0   # set by a 429 with Retry-After
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def _provider(model_orcode):
+    return model_orcode.split("/", 1)[0]
+
+# seconds requested by the server, from "Retry-After: <seconds>" or "Retry-After: <http date>"
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _is_transport_error(error):
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 408 or error.status_code >= 500
+    return False
+
+class RequestScheduler:
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="api-scheduler", daemon=True)
+        self.thread.start()
+        self.client = None
+        self.model_limits = {}
+        self.provider_limits = {}
+        self.buckets = {}
+        self.transport_retries = 0
+
+    # everything below runs on the scheduler loop
+
+    def _get_client(self):
+        if self.client is None:
+            from openai import AsyncOpenAI
+            from dotenv import load_dotenv # to read .env files (API key)
+
+            # to load the key from the .env file
+            load_dotenv()
+            self.client = AsyncOpenAI(
+                base_url=config.OPENROUTER_BASE_URL, # it specify to call OpenRouter instead of ChatGPT
+                api_key=os.getenv("OPENROUTER_API_KEY"),
+                max_retries=0,                      # retries are handled by the scheduler
+                timeout=config.API_REQUEST_TIMEOUT_S,
+            )
+        return self.client
+
+    def _limits(self, model_orcode):
+        provider = _provider(model_orcode)
+        if model_orcode not in self.model_limits:
+            self.model_limits[model_orcode] = asyncio.Semaphore(config.API_MAX_CONCURRENCY_PER_MODEL)
+        if provider not in self.provider_limits:
+            self.provider_limits[provider] = asyncio.Semaphore(config.API_MAX_CONCURRENCY_PER_PROVIDER)
+            rate, burst = config.API_RATE_LIMITS.get(provider, config.API_RATE_LIMITS["default"])
+            self.buckets[provider] = TokenBucket(rate, burst)
+        return self.model_limits[model_orcode], self.provider_limits[provider], self.buckets[provider]
+
+    async def _request(self, model_orcode, messages, stream, run_data):
+        model_limit, provider_limit, bucket = self._limits(model_orcode)
+        retries = 0
+
+        while True:
+            async with model_limit, provider_limit:
+                await bucket.acquire()
+                try:
+                    if stream:
+                        return await self._stream(model_orcode, messages)
+                    return await self._complete(model_orcode, messages)
+
+                except StreamBudgetExceeded:
+                    raise
+
+                except Exception as e:
+                    if not _is_transport_error(e) or retries >= config.API_TRANSPORT_RETRIES:
+                        raise
+                    error = e
+
+            # backoff outside the semaphores, so the slot goes to another request
+            retries += 1
+            self.transport_retries += 1
+            if run_data is not None:
+                run_data["Transport_Retries"] += 1
+
+            delay = _retry_after(error)
+            if delay is None:
+                # full jitter: random delay between 0 and the exponential cap
+                cap = min(config.API_BACKOFF_MAX_S, config.API_BACKOFF_BASE_S * (2 ** retries))
+                delay = random.uniform(0, cap)
+            if getattr(error, "status_code", None) == 429:
+                bucket.pause(delay)
+
+            print(f"{C.YELLOW}WARNING: transport error on {model_orcode} ({type(error).__name__}), "
+                  f"retry {retries}/{config.API_TRANSPORT_RETRIES} in {round(delay, 2)}s.{C.END}")
+            await asyncio.sleep(delay)
+
+    async def _complete(self, model_orcode, messages):
+        completion = await self._get_client().chat.completions.create(
+            model = model_orcode,
+            messages = messages,
+        )
+        usage = completion.usage
+        return completion.choices[0].message.content, {
+            "prompt_tokens": usage.prompt_tokens if usage else None,
+            "completion_tokens": usage.completion_tokens if usage else None
+        }
+
+    # streaming call: the code is built while it arrives, so we can measure
+    # the time to first token and stop a runaway model before it stalls the loop
+    async def _stream(self, model_orcode, messages):
+        from openai import Timeout
+        start = time.time()
+        first_token_time = None
+        pieces = []
+        chunks = 0
+        usage = None
+        over_budget = False
+        stream = None
+
+        try:
+            # the whole call (connection included) within STREAM_MAX_SECONDS, also when the model sends nothing
+            async with asyncio.timeout(config.STREAM_MAX_SECONDS):
+                stream = await self._get_client().chat.completions.create(
+                    model = model_orcode,
+                    messages = messages,
+                    stream = True,
+                    stream_options = {"include_usage": True},   # token count in the last chunk
+                    # a dead connection or a silent server is a transport error (retried), not the budget
+                    timeout = Timeout(config.STREAM_READ_TIMEOUT_S, connect = config.STREAM_CONNECT_TIMEOUT_S),
+                )
+                async for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                    pieces.append(delta)
+                    chunks += 1 # one chunk is about one token
+
+                    if chunks > config.STREAM_MAX_TOKENS:
+                        over_budget = True
+                        break
+
+        except TimeoutError:
+            over_budget = True  # over STREAM_MAX_SECONDS
+
+        finally:
+            if stream is not None:
+                await stream.close()  # closes the connection, also when the stream is cancelled
+
+        end = time.time()
+        tokens = usage.completion_tokens if usage and usage.completion_tokens else chunks
+        stats = {
+            "ttft_s": round(first_token_time - start, 3) if first_token_time else None,
+            "tokens": tokens,
+            "tokens_per_s": round(tokens / (end - first_token_time), 1) if first_token_time and end > first_token_time else None,
+            "total_s": round(end - start, 3),
+            "prompt_tokens": usage.prompt_tokens if usage else None,
+            "completion_tokens": tokens
+        }
+        if over_budget:
+            raise StreamBudgetExceeded(
+                f"STREAM_CANCELLED: budget exceeded after {chunks} tokens and {round(end - start, 2)}s "
+                f"(limits: {config.STREAM_MAX_TOKENS} tokens, {config.STREAM_MAX_SECONDS}s).", stats)
+        return "".join(pieces), stats
+
+    # called from any thread: returns a concurrent.futures.Future (cancel() stops the request)
+    def submit(self, model_orcode, messages, stream = False, run_data = None):
+        return asyncio.run_coroutine_threadsafe(self._request(model_orcode, messages, stream, run_data), self.loop)
+
+    # called from any thread: waits for the answer
+    # cancel_event (threading.Event) stops the request while it's waiting or streaming
+    # Returns: (str: content, dict: call statistics)
+    def complete(self, model_orcode, messages, stream = False, run_data = None, cancel_event = None):
+        future = self.submit(model_orcode, messages, stream, run_data)
+        if cancel_event is None:
+            return future.result()
+        while True:
+            try:
+                return future.result(timeout = 0.05)
+            except concurrent.futures.TimeoutError:
+                if cancel_event.is_set():
+                    future.cancel()     # cancels the task on the loop: the stream is closed
+                    raise RequestCancelled("request cancelled")
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+    return _scheduler
@@ -0,0 +1,226 @@
+import csv
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import config
+from config import OUTPUT_DIR, Colors as C
+
+# Shape accuracy: a valid result compared with the reference STEP of its prompt ("reference" of the suite entry).
+#   - Score_IoU: volumetric intersection over union, both meshes voxelized on the same grid
+#     (one ray per column along z, inside = odd number of crossings below the voxel center)
+#   - Score_Chamfer_mm: symmetric Chamfer distance, mean of the nearest-neighbour distances between
+#     points sampled on the two surfaces (area weighted, fixed seed: same files -> same score)
+#   - Score_BBox_Err: largest relative error of the bounding box sizes (x, y, z)
+# SCORE_TOLERANCE is the accuracy/speed knob: tessellation tolerance, voxel size and point spacing (mm),
+# SCORE_MAX_VOXELS and SCORE_MAX_POINTS bound the cost of the big parts.
+# SCORE_ALIGN: both parts centered on their bounding box before the comparison (the position in the
+# prompt is rarely part of the request); rotations are not searched.
+# Meshes and surface samples are cached by file content, so the reference is tessellated once for all
+# the models. numpy, cadquery (STEP import) and scipy (nearest neighbours, when installed) are imported
+# with the first score.
+
+_cache = OrderedDict()  # (sha256, tolerance) -> mesh
+_cache_lock = threading.Lock()
+
+def _file_key(step_path, tolerance):
+    digest = hashlib.sha256()
+    with open(step_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return f"{digest.hexdigest()}:{tolerance}"
+
+# STEP file -> triangles (n, 3, 3) and surface samples, centered when SCORE_ALIGN
+def _load_mesh(step_path, tolerance):
+    import numpy as np
+    import cadquery as cq
+
+    shapes = [shape for shape in cq.importers.importStep(step_path).vals() if isinstance(shape, cq.Shape)]
+    if not shapes:
+        raise ValueError(f"no shape in {step_path}")
+    shape = shapes[0] if len(shapes) == 1 else cq.Compound.makeCompound(shapes)
+    vertices, triangles = shape.tessellate(tolerance, 0.5)
+    if not triangles:
+        raise ValueError(f"empty tessellation of {step_path}")
+
+    points = np.array([(v.x, v.y, v.z) for v in vertices], dtype = np.float64)
+    triangles = points[np.array(triangles, dtype = np.int64)]
+    low, high = points.min(axis = 0), points.max(axis = 0)
+    if config.SCORE_ALIGN:
+        triangles -= (low + high) / 2
+        low, high = (low - high) / 2, (high - low) / 2
+
+    # area weighted samples, about one every tolerance x tolerance (at most SCORE_MAX_POINTS)
+    areas = np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]), axis = 1) / 2
+    count = int(np.clip(areas.sum() / tolerance ** 2, 256, config.SCORE_MAX_POINTS))
+    rng = np.random.default_rng(0)
+    chosen = rng.choice(len(triangles), size = count, p = areas / areas.sum())
+    r1 = np.sqrt(rng.random(count))[:, None]
+    r2 = rng.random(count)[:, None]
+    a, b, c = triangles[chosen, 0], triangles[chosen, 1], triangles[chosen, 2]
+    samples = (1 - r1) * a + r1 * (1 - r2) * b + r1 * r2 * c
+
+    return {"triangles": triangles, "samples": samples, "low": low, "high": high}
+
+def get_mesh(step_path, tolerance):
+    key = _file_key(step_path, tolerance)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    mesh = _load_mesh(step_path, tolerance)
+    with _cache_lock:
+        _cache[key] = mesh
+        while len(_cache) > config.SCORE_CACHE_SIZE:
+            _cache.popitem(last = False)
+    return mesh
+
+# Occupancy of a closed mesh on the grid (nx, ny, nz) with origin low and cubic voxels of size step
+# Returns: bool array (nx * ny, nz)
+def _voxelize(triangles, low, step, shape):
+    import numpy as np
+    nx, ny, nz = shape
+
+    # triangles parallel to the rays (vertical faces) never cross them
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    triangles = triangles[np.abs(normals[:, 2]) > 1e-12]
+    normals = normals[np.abs(normals[:, 2]) > 1e-12]
+
+    # ray columns slightly off the grid: a ray through an edge shared by two triangles would count twice
+    jitter_x, jitter_y = 1.234567e-4 * step, 2.345678e-4 * step
+
+    # scanlines: (triangle, grid row) pairs for the rows inside the y range of each triangle
+    ys = triangles[:, :, 1]
+    row_low = np.maximum(np.ceil((ys.min(axis = 1) - low[1] - jitter_y) / step - 0.5), 0).astype(np.int64)
+    row_high = np.minimum(np.floor((ys.max(axis = 1) - low[1] - jitter_y) / step - 0.5), ny - 1).astype(np.int64)
+    rows = np.maximum(row_high - row_low + 1, 0)
+    tri = np.repeat(np.arange(len(triangles)), rows)
+    iy = row_low[tri] + np.arange(len(tri)) - np.repeat(np.cumsum(rows) - rows, rows)
+    py = low[1] + (iy + 0.5) * step + jitter_y
+
+    # x range of the scanline inside the triangle: crossings of its three edges
+    crossings = np.full((len(tri), 3), np.nan)
+    for edge, (first, second) in enumerate(((0, 1), (1, 2), (2, 0))):
+        p, q = triangles[tri, first], triangles[tri, second]
+        crosses = (p[:, 1] - py) * (q[:, 1] - py) <= 0
+        dy = np.where(q[:, 1] != p[:, 1], q[:, 1] - p[:, 1], 1)
+        crossings[:, edge] = np.where(crosses & (q[:, 1] != p[:, 1]), p[:, 0] + (py - p[:, 1]) * (q[:, 0] - p[:, 0]) / dy, np.nan)
+    spanned = ~np.all(np.isnan(crossings), axis = 1)
+    tri, iy, py, crossings = tri[spanned], iy[spanned], py[spanned], crossings[spanned]
+    col_low = np.maximum(np.ceil((np.nanmin(crossings, axis = 1) - low[0] - jitter_x) / step - 0.5), 0).astype(np.int64)
+    col_high = np.minimum(np.floor((np.nanmax(crossings, axis = 1) - low[0] - jitter_x) / step - 0.5), nx - 1).astype(np.int64)
+
+    # only the columns really crossed by the triangle, z from its plane
+    columns = np.maximum(col_high - col_low + 1, 0)
+    pair = np.repeat(np.arange(len(tri)), columns)
+    ix = col_low[pair] + np.arange(len(pair)) - np.repeat(np.cumsum(columns) - columns, columns)
+    iy, py, tri = iy[pair], py[pair], tri[pair]
+    px = low[0] + (ix + 0.5) * step + jitter_x
+    a, normal = triangles[tri, 0], normals[tri]
+    z = a[:, 2] - (normal[:, 0] * (px - a[:, 0]) + normal[:, 1] * (py - a[:, 1])) / normal[:, 2]
+
+    # crossings below every voxel center, odd = inside
+    level = np.searchsorted(low[2] + (np.arange(nz) + 0.5) * step, z, side = "right")
+    hits = np.bincount((ix * ny + iy) * (nz + 1) + level, minlength = nx * ny * (nz + 1)).reshape(nx * ny, nz + 1)
+    return (np.cumsum(hits, axis = 1)[:, :nz] % 2) == 1
+
+def _iou(mesh, reference, tolerance):
+    import numpy as np
+    low = np.minimum(mesh["low"], reference["low"])
+    high = np.maximum(mesh["high"], reference["high"])
+    step = max(tolerance, float((high - low).max()) / config.SCORE_MAX_VOXELS)
+    shape = tuple(int(n) for n in np.maximum(np.ceil((high - low) / step), 1))
+    occupied = _voxelize(mesh["triangles"], low, step, shape)
+    expected = _voxelize(reference["triangles"], low, step, shape)
+    union = np.count_nonzero(occupied | expected)
+    return float(np.count_nonzero(occupied & expected) / union) if union else 0.0
+
+# mean distance from every sample of mesh a to the closest sample of mesh b
+def _mean_nearest(mesh_a, mesh_b):
+    import numpy as np
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        cKDTree = None
+    a, b = mesh_a["samples"], mesh_b["samples"]
+    if cKDTree is not None:
+        # the tree is kept with the cached mesh: the reference one is built once
+        if "tree" not in mesh_b:
+            mesh_b["tree"] = cKDTree(b)
+        return float(mesh_b["tree"].query(a)[0].mean())
+    total = 0.0
+    b_sq = (b ** 2).sum(axis = 1)
+    for first in range(0, len(a), 1024):
+        block = a[first:first + 1024]
+        distances = (block ** 2).sum(axis = 1)[:, None] - 2 * block @ b.T + b_sq[None, :]
+        total += float(np.sqrt(np.maximum(distances.min(axis = 1), 0)).sum())
+    return total / len(a)
+
+def _chamfer(mesh, reference):
+    return (_mean_nearest(mesh, reference) + _mean_nearest(reference, mesh)) / 2
+
+def _bbox_error(mesh, reference):
+    import numpy as np
+    sizes = mesh["high"] - mesh["low"]
+    expected = reference["high"] - reference["low"]
+    return float((np.abs(sizes - expected) / np.maximum(expected, 1e-6)).max())
+
+# Returns: {"iou", "chamfer_mm", "bbox_err"}
+def score_step(step_path, reference_path, tolerance = None):
+    tolerance = tolerance or config.SCORE_TOLERANCE
+    mesh = get_mesh(step_path, tolerance)
+    reference = get_mesh(reference_path, tolerance)
+    return {
+        "iou": _iou(mesh, reference, tolerance),
+        "chamfer_mm": _chamfer(mesh, reference),
+        "bbox_err": _bbox_error(mesh, reference)
+    }
+
+# called when the run record is saved (its STEP file is complete): scores of the runs with a reference
+def score_run(run_data):
+    reference = run_data.get("Reference")
+    if not config.SCORE_ENABLED or not reference or run_data["Status"] != "SUCCESS":
+        return
+    step_file = f"{OUTPUT_DIR}/{run_data['Model']}/{run_data['Project_Name']}/{run_data['Project_Name']}.step"
+    start = time.perf_counter()
+    try:
+        scores = score_step(step_file, reference)
+    except Exception as e:
+        print(f"{C.YELLOW}WARNING: {run_data['Project_Name']} not scored against {reference}: {e}{C.END}")
+        return
+    run_data["Score_IoU"] = round(scores["iou"], 4)
+    run_data["Score_Chamfer_mm"] = round(scores["chamfer_mm"], 4)
+    run_data["Score_BBox_Err"] = round(scores["bbox_err"], 4)
+    run_data["Score_Time_s"] = round(time.perf_counter() - start, 3)
+    print(f"Accuracy of {run_data['Model']}/{run_data['Project_Name']}: IoU {scores['iou']:.3f}, "
+          f"Chamfer {scores['chamfer_mm']:.3f} mm, bbox error {scores['bbox_err']:.1%}")
+
+# main.py score: STEP files compared with one reference, optional csv
+def score_files(reference_path, step_paths, csv_path = None, tolerance = None):
+    rows = []
+    start = time.perf_counter()
+    for step_path in step_paths:
+        try:
+            scores = score_step(step_path, reference_path, tolerance)
+            rows.append({"step": step_path, "iou": round(scores["iou"], 4), "chamfer_mm": round(scores["chamfer_mm"], 4),
+                         "bbox_err": round(scores["bbox_err"], 4), "error": ""})
+        except Exception as e:
+            rows.append({"step": step_path, "iou": None, "chamfer_mm": None, "bbox_err": None, "error": str(e)})
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{C.BOLD}{'iou':>7} {'chamfer mm':>11} {'bbox err':>9}  step{C.END}")
+    for row in rows:
+        if row["error"]:
+            print(f"{C.RED}{'-':>7} {'-':>11} {'-':>9}  {row['step']}: {row['error']}{C.END}")
+        else:
+            print(f"{row['iou']:>7.3f} {row['chamfer_mm']:>11.3f} {row['bbox_err']:>9.1%}  {row['step']}")
+    print(f"{len(rows)} files scored in {elapsed:.1f}s ({len(rows) / max(elapsed, 1e-9) * 60:.0f} per minute).")
+
+    if csv_path and rows:
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames = list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Scores written in {csv_path}")
+    return rows
@@ -0,0 +1,155 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+from config import OUTPUT_DIR, Colors as C
+from trace_engine import span, add_stage_time
+from api_engine import update_call_averages
+
+# Speculative mode (SPECULATIVE_CANDIDATES > 1): every attempt asks the model for N candidates at the
+# same time (N concurrent calls through the scheduler, each with its own cache entry) and tests them
+# in parallel. The first candidate that passes wins and the attempt returns at once: the calls still
+# running are cancelled, the candidates not tested yet are skipped and the sandbox or FreeCAD workers
+# still testing a candidate are killed (and replaced by their pool). Only an in-process CadQuery test
+# (no sandbox) can't be interrupted: it finishes in its own thread and its result is ignored.
+# The repair prompt is used only when all the N candidates fail.
+# Every candidate works on its own copy of run_data; the counters (tokens, calls, retries) of all of
+# them are added to the run, the stage times and the status come from the winner (or from the failed
+# candidate used for the repair).
+
+# counters summed over all the candidates
+_COUNTERS = ["Cache_Hits", "Transport_Retries", "Prompt_Tokens", "Completion_Tokens", "Validator_Rejects"]
+
+# model -> cost and latency of the runs, for print_speculation_report()
+_model_stats = {}
+_model_stats_lock = threading.Lock()
+
+# copy of run_data for one candidate: same identity, empty lists and counters
+# FreeCAD writes its files in the project folder, so every other candidate gets its own folder
+def _scratch(run_data, index):
+    scratch = dict(run_data)
+    for key, value in run_data.items():
+        if isinstance(value, list):
+            scratch[key] = []
+        elif isinstance(value, dict):
+            scratch[key] = {}
+    for key in _COUNTERS:
+        scratch[key] = 0
+    scratch["Attempt_Times"] = [{"attempt": run_data["Attempts"]}]
+    if index > 0:
+        scratch["Project_Name"] = f"{run_data['Project_Name']}_c{index}"
+        os.makedirs(f"{OUTPUT_DIR}/{run_data['Model']}/{scratch['Project_Name']}", exist_ok = True)
+    return scratch
+
+def _merge(run_data, scratches, chosen):
+    for key in _COUNTERS:
+        run_data[key] += sum(scratch[key] for scratch in scratches)
+    for index, scratch in enumerate(scratches):
+        run_data["API_Calls"].extend(scratch["API_Calls"])
+        for tokens in scratch["Attempt_Tokens"]:
+            run_data["Attempt_Tokens"].append({**tokens, "candidate": index})
+    update_call_averages(run_data)
+    run_data["Worker_RSS_MB"] = max([run_data["Worker_RSS_MB"]] + [scratch["Worker_RSS_MB"] for scratch in scratches])
+
+    run_data["Cancelled_Candidates"] += sum(scratch["Status"] == "CANCELLED" for scratch in scratches)
+    if chosen is not None:
+        scratch = scratches[chosen]
+        for key in ("Status", "Error_Log", "Library", "Retrieval_Used", "Retrieval_Score"):
+            run_data[key] = scratch[key]
+        for stage, seconds in scratch["Attempt_Times"][0].items():
+            if stage != "attempt":
+                add_stage_time(run_data, stage, seconds)
+
+# Runs one speculative attempt.
+#   generate(scratch_run_data, candidate_index, cancel_event) -> code or None
+#   test(scratch_run_data, code, cancel_event) -> (success, error_log, part, engine)
+# Returns: (success, code, error_log, part, engine) of the winner, or of the failure to repair
+def run_candidates(run_data, candidates, generate, test):
+    cancel_event = threading.Event()
+    scratches = [_scratch(run_data, index) for index in range(candidates)]
+    run_data["Candidates"] = candidates
+
+    def candidate(index):
+        scratch = scratches[index]
+        code = generate(scratch, index, cancel_event)
+        if code and cancel_event.is_set():
+            scratch["Status"] = "CANCELLED"    # another candidate already passed, no test
+        if not code or cancel_event.is_set():
+            return index, code, False, "", None, None
+        success, error_log, part, engine = test(scratch, code, cancel_event)
+        return index, code, success, error_log, part, engine
+
+    results = []
+    winner = None
+    with span("candidates", run_data, candidates = candidates):
+        pool = ThreadPoolExecutor(max_workers = candidates, thread_name_prefix = f"{run_data['Model']}-candidate")
+        futures = [pool.submit(candidate, index) for index in range(candidates)]
+        try:
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"{C.RED}ERROR: a candidate crashed.\n{e}{C.END}")
+                    continue
+                results.append(result)
+                if result[2]:
+                    winner = result
+                    print(f"{C.GREEN}Candidate {result[0] + 1}/{candidates} passed the test, the others are cancelled.{C.END}")
+                    break
+        finally:
+            # no waiting for the losers: the event stops their calls and kills their workers
+            cancel_event.set()
+            pool.shutdown(wait = False, cancel_futures = True)
+
+        # the candidates still running when the winner was found count as cancelled
+        for index, future in enumerate(futures):
+            if not future.done() or future.cancelled():
+                scratches[index]["Status"] = "CANCELLED"
+
+    # no winner: the repair starts from a candidate that reached the engine, if any
+    chosen = winner
+    if chosen is None:
+        failures = sorted((result for result in results if result[1]), key = lambda result: (scratches[result[0]]["Validator_Rejects"], result[0]))
+        chosen = failures[0] if failures else None
+
+    _merge(run_data, scratches, chosen[0] if chosen else None)
+    if winner is not None:
+        run_data["Winner_Candidate"] = winner[0]
+
+    for scratch in scratches[1:]:
+        shutil.rmtree(f"{OUTPUT_DIR}/{run_data['Model']}/{scratch['Project_Name']}", ignore_errors = True)
+
+    if chosen is None:
+        return False, None, "", None, None
+    index, code, success, error_log, part, engine = chosen
+    return success, code, error_log, part, engine
+
+# called at the end of every request: cost (tokens, calls) and latency (time to a valid result) per model
+def record_run(run_data):
+    with _model_stats_lock:
+        stats = _model_stats.setdefault(run_data["Model"], {"runs": 0, "valid": 0, "calls": 0, "cancelled": 0, "tokens": 0, "latencies": []})
+        stats["runs"] += 1
+        stats["calls"] += len(run_data["Attempt_Tokens"])
+        stats["cancelled"] += run_data["Cancelled_Candidates"]
+        stats["tokens"] += run_data["Prompt_Tokens"] + run_data["Completion_Tokens"]
+        if run_data["Time_To_Valid_s"]:
+            stats["valid"] += 1
+            stats["latencies"].append(run_data["Time_To_Valid_s"])
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] if values else 0
+
+def print_speculation_report():
+    with _model_stats_lock:
+        model_stats = {model: dict(stats) for model, stats in _model_stats.items()}
+    if not model_stats:
+        return
+    print(f"\n{C.BOLD}Cost/latency per model ({config.SPECULATIVE_CANDIDATES} candidates per attempt):{C.END}")
+    print(f"  {'model':<28} {'valid':>7} {'calls/run':>10} {'cancelled':>10} {'tokens/run':>11} {'p50 s':>7} {'p95 s':>7}")
+    for model, stats in sorted(model_stats.items()):
+        runs = stats["runs"]
+        print(f"  {model:<28} {stats['valid']:>3}/{runs:<3} {stats['calls'] / runs:>10.1f} {stats['cancelled']:>10} "
+              f"{stats['tokens'] / runs:>11.0f} {_percentile(stats['latencies'], 50):>7.2f} {_percentile(stats['latencies'], 95):>7.2f}")
@@ -0,0 +1,324 @@
+import os
+import ast
+import csv
+import time
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+from config import Colors as C
+from code_validator import detect_engine
+
+# Parametric sweep: a validated script executed again over a grid of values, no LLM call.
+# The parameters are the numeric constants assigned at the top level of the script (MAIN_PROMPT asks for
+# explicit variables at the top): "width = 40", "hole_d = 6.5", "n = -3". The variables computed from them
+# ("height = width * 2") follow automatically. A name assigned more than once at the top level is ambiguous
+# and is not a parameter.
+# Every variant is the script with the new values written in place of the old ones (comments and layout
+# untouched), executed by a dedicated CadQuery sandbox (SWEEP_WORKERS processes) or by the FreeCAD pool.
+# Output: one STEP file per variant and a csv with the values and the geometry metrics of every variant.
+# Variants with the same geometry (fingerprint: same solid at the same position) are exported once,
+# the others get a hard link to that file. Every STEP file is written under a temporary name and renamed
+# (os.replace), so a write never goes through a link into the file of another variant; the output folder
+# must be new or empty (the files of an older sweep would be mixed with the new csv).
+
+SWEEP_FIELDS = ["variant", "status", "volume", "area", "faces", "edges", "solids",
+                "bbox_x", "bbox_y", "bbox_z", "valid", "fingerprint", "duplicate_of", "step", "time_s", "error"]
+
+def _number(node):
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _number(node.operand)
+        if value is not None:
+            return -value if isinstance(node.op, ast.USub) else value
+    return None
+
+# Returns: {name: {"value", "node"}} of the numeric top-level assignments, in script order
+def find_parameters(code):
+    tree = ast.parse(code)
+    parameters = {}
+    assigned = {}
+    for statement in tree.body:
+        if isinstance(statement, ast.Assign):
+            targets, value = statement.targets, statement.value
+        elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+            targets, value = [statement.target], statement.value
+        else:
+            continue
+        for target in targets:
+            if isinstance(target, ast.Name):
+                assigned[target.id] = assigned.get(target.id, 0) + 1
+        number = _number(value)
+        if number is not None and len(targets) == 1 and isinstance(targets[0], ast.Name):
+            parameters.setdefault(targets[0].id, {"value": number, "node": value})
+    return {name: parameter for name, parameter in parameters.items() if assigned[name] == 1}
+
+def _offset(line_starts, line, column):
+    return line_starts[line - 1] + column
+
+# script with the values of the variant written in place of the literal ones
+def apply_parameters(code, parameters, values):
+    # ast offsets are in utf-8 bytes
+    source = code.encode("utf-8")
+    line_starts = [0]
+    for line in source.splitlines(keepends = True):
+        line_starts.append(line_starts[-1] + len(line))
+
+    replacements = []
+    for name, value in values.items():
+        node = parameters[name]["node"]
+        start = _offset(line_starts, node.lineno, node.col_offset)
+        end = _offset(line_starts, node.end_lineno, node.end_col_offset)
+        replacements.append((start, end, repr(value).encode("utf-8")))
+    for start, end, text in sorted(replacements, reverse = True):
+        source = source[:start] + text + source[end:]
+    return source.decode("utf-8")
+
+def _parse_value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+# "name=1,2,3" (list) or "name=10:50:5" (start:stop:step, stop included)
+# Returns: (name, [values])
+def parse_grid_option(option):
+    if "=" not in option:
+        raise ValueError(f"parameter '{option}' is not name=values")
+    name, values = (part.strip() for part in option.split("=", 1))
+    if ":" in values:
+        start, stop, step = (_parse_value(part) for part in values.split(":"))
+        if step <= 0 or stop < start:
+            raise ValueError(f"range of '{name}' is empty")
+        count = int(round((stop - start) / step, 9)) + 1
+        grid = [start + index * step for index in range(count)]
+        if all(isinstance(value, int) for value in (start, stop, step)):
+            return name, grid
+        return name, [round(value, 9) for value in grid]
+    return name, [_parse_value(value) for value in values.split(",") if value.strip()]
+
+# the type of the literal in the script is kept: 40 -> 45, 40.0 -> 45.0
+def _typed(value, original):
+    if isinstance(original, float):
+        return float(value)
+    return int(value) if float(value).is_integer() else value
+
+class Sweep:
+
+    def __init__(self, script_path, grid, output_dir = None, workers = None):
+        with open(script_path, "r", encoding="utf-8") as f:
+            self.code = f.read()
+        self.script_path = script_path
+        self.base = os.path.splitext(os.path.basename(script_path))[0]
+        self.engine = detect_engine(self.code)
+        self.parameters = find_parameters(self.code)
+
+        unknown = [name for name in grid if name not in self.parameters]
+        if unknown:
+            raise ValueError(f"{', '.join(unknown)} not found among the parameters of the script ({', '.join(self.parameters) or 'none'})")
+        self.names = list(grid)
+        self.variants = [
+            {name: _typed(value, self.parameters[name]["value"]) for name, value in zip(self.names, combination)}
+            for combination in itertools.product(*(grid[name] for name in self.names))
+        ]
+        if len(self.variants) > config.SWEEP_MAX_VARIANTS:
+            raise ValueError(f"{len(self.variants)} variants, the limit is {config.SWEEP_MAX_VARIANTS} (config.SWEEP_MAX_VARIANTS)")
+
+        self.output_dir = output_dir or os.path.join(os.path.dirname(script_path), f"sweep_{time.strftime('%Y%m%d_%H%M%S')}")
+        if os.path.isdir(self.output_dir) and os.listdir(self.output_dir):
+            raise ValueError(f"the output folder {self.output_dir} is not empty, choose a new one")
+        if self.engine == "FreeCAD":
+            self.workers = workers or max(config.FREECAD_POOL_SIZE, 1)
+        else:
+            self.workers = workers or config.SWEEP_WORKERS
+
+        self.fingerprints = {}  # fingerprint -> STEP file of the first variant with that geometry
+        self._lock = threading.Lock()
+        self._csv_file = None
+        self._csv = None
+
+    def _step_path(self, index):
+        return os.path.join(self.output_dir, f"{self.base}_{index:04d}.step")
+
+    def _write_row(self, row):
+        with self._lock:
+            self._csv.writerow(row)
+            self._csv_file.flush()
+
+    # the file appears with its final name only when it's complete, and replaces (never rewrites) an old one
+    def _write_step(self, step_path, write):
+        tmp_path = f"{step_path}.{threading.get_ident()}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, step_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _write_step_bytes(self, step_path, step_bytes):
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                f.write(step_bytes)
+        self._write_step(step_path, write)
+
+    # identical geometry: the file of the earlier variant, linked (or copied)
+    def _link_step(self, source, step_path):
+        def write(tmp_path):
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                with open(source, "rb") as f_in, open(tmp_path, "wb") as f_out:
+                    f_out.write(f_in.read())
+        self._write_step(step_path, write)
+
+    def _row(self, index, values, stats, status, step_path, error, seconds):
+        row = {"variant": index, "status": status, **values, "time_s": round(seconds, 3), "error": error}
+        if stats:
+            bbox = stats["bbox"]
+            row.update({
+                "volume": round(stats["volume"], 3), "area": round(stats["area"], 3),
+                "faces": stats["faces"], "edges": stats["edges"], "solids": stats["solids"],
+                "bbox_x": round(bbox["xlen"], 3), "bbox_y": round(bbox["ylen"], 3), "bbox_z": round(bbox["zlen"], 3),
+                "valid": stats["valid"], "step": step_path
+            })
+        return row
+
+    def _run_cadquery(self, sandbox, index, values):
+        from fingerprint_engine import compute_fingerprint
+        start = time.perf_counter()
+        with self._lock:
+            known = frozenset(self.fingerprints)
+        code = apply_parameters(self.code, self.parameters, values)
+        outcome = sandbox.run(code, known)
+        if not outcome["ok"]:
+            error = outcome["error"].strip().splitlines()[-1] if outcome["error"].strip() else ""
+            return self._row(index, values, None, outcome["status"], "", error, time.perf_counter() - start)
+
+        step_path = self._step_path(index)
+        fingerprint = compute_fingerprint(outcome["geometry"])
+        duplicate_of = ""
+        with self._lock:
+            first_step = self.fingerprints.get(fingerprint)
+        if outcome["step_bytes"] is None and not (first_step and os.path.exists(first_step)):
+            # the file of the earlier variant is gone: this one is exported after all
+            outcome = sandbox.run(code)
+            if not outcome["ok"] or outcome["step_bytes"] is None:
+                return self._row(index, values, None, "EXPORT_ERROR", "", "STEP export failed.", time.perf_counter() - start)
+        if outcome["step_bytes"] is not None:
+            self._write_step_bytes(step_path, outcome["step_bytes"])
+            with self._lock:
+                self.fingerprints.setdefault(fingerprint, step_path)
+        else:
+            # the worker skipped the export: the geometry of an earlier variant
+            self._link_step(first_step, step_path)
+            duplicate_of = os.path.basename(first_step)
+
+        row = self._row(index, values, outcome["geometry"], "SUCCESS", step_path, "", time.perf_counter() - start)
+        row.update({"fingerprint": fingerprint, "duplicate_of": duplicate_of})
+        return row
+
+    def _run_freecad(self, index, values):
+        from freecad_engine import run_freecad_script, parse_metrics
+        from fingerprint_engine import compute_fingerprint
+        start = time.perf_counter()
+        script_path = os.path.join(self.output_dir, f"{self.base}_{index:04d}.py")
+        step_path = self._step_path(index)
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(apply_parameters(self.code, self.parameters, values))
+        try:
+            success, log = run_freecad_script(script_path, step_path)
+        finally:
+            for path in (script_path, script_path.replace(".py", "_wrapper.py")):
+                if os.path.exists(path):
+                    os.remove(path)
+        if not success:
+            error = log.strip().splitlines()[-1] if log.strip() else ""
+            return self._row(index, values, None, "EXEC_ERROR", "", error, time.perf_counter() - start)
+
+        stats = parse_metrics(log)
+        if stats is None:
+            from geometrical_analysis import analyze_step_file
+            stats = analyze_step_file(step_path)
+        status = "SUCCESS" if stats["volume"] > 0 else "EMPTY_GEOMETRY"
+        row = self._row(index, values, stats, status, step_path, "", time.perf_counter() - start)
+        row["fingerprint"] = compute_fingerprint(stats)
+        return row
+
+    # Returns: list of the csv rows, in variant order
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok = True)
+        csv_path = os.path.join(self.output_dir, "sweep.csv")
+        print(f"{C.CYAN}Sweep of {self.script_path} ({self.engine}): {len(self.variants)} variants of "
+              f"{', '.join(self.names)}, {self.workers} workers.{C.END}")
+
+        sandbox = None
+        if self.engine == "CadQuery":
+            # dedicated sandbox: as many workers as the sweep needs, not the size of the benchmark one
+            from cadquery_sandbox import CadQuerySandbox
+            sandbox = CadQuerySandbox(self.workers, config.SWEEP_WORKER_MAX_JOBS, config.CADQUERY_TIMEOUT_S,
+                                      config.CADQUERY_CPU_LIMIT_S, config.CADQUERY_MEMORY_LIMIT_MB)
+
+        rows = []
+        start = time.perf_counter()
+        done = 0
+        try:
+            with open(csv_path, "w", newline="", encoding="utf-8") as self._csv_file:
+                self._csv = csv.DictWriter(self._csv_file, fieldnames = SWEEP_FIELDS[:2] + self.names + SWEEP_FIELDS[2:])
+                self._csv.writeheader()
+                with ThreadPoolExecutor(max_workers = self.workers, thread_name_prefix = "sweep") as pool:
+                    futures = {}
+                    for index, values in enumerate(self.variants):
+                        if sandbox is not None:
+                            futures[pool.submit(self._run_cadquery, sandbox, index, values)] = (index, values)
+                        else:
+                            futures[pool.submit(self._run_freecad, index, values)] = (index, values)
+                    for future in as_completed(futures):
+                        index, values = futures[future]
+                        try:
+                            row = future.result()
+                        except Exception as e:
+                            row = self._row(index, values, None, "SYSTEM_ERROR", "", str(e), 0)
+                        self._write_row(row)
+                        rows.append(row)
+                        done += 1
+                        if done % max(len(self.variants) // 10, 1) == 0 or done == len(self.variants):
+                            print(f"  {done}/{len(self.variants)} variants ({time.perf_counter() - start:.1f}s)")
+        finally:
+            if sandbox is not None:
+                sandbox.close()
+
+        rows.sort(key = lambda row: row["variant"])
+        elapsed = time.perf_counter() - start
+        valid = sum(row["status"] == "SUCCESS" for row in rows)
+        duplicates = sum(bool(row.get("duplicate_of")) for row in rows)
+        color = C.GREEN if valid == len(rows) else C.YELLOW
+        print(f"{color}Sweep completed: {valid}/{len(rows)} valid variants, {duplicates} with the geometry of an earlier one, "
+              f"{elapsed:.1f}s ({len(rows) / max(elapsed, 1e-9):.1f} variants/s).{C.END}")
+        print(f"STEP files and metrics in {self.output_dir} (sweep.csv).")
+        return rows
+
+def print_parameters(script_path):
+    with open(script_path, "r", encoding="utf-8") as f:
+        code = f.read()
+    parameters = find_parameters(code)
+    if not parameters:
+        print(f"{C.YELLOW}WARNING: no numeric top-level assignment in {script_path}.{C.END}")
+        return
+    print(f"Parameters of {script_path} ({detect_engine(code)}):")
+    for name, parameter in parameters.items():
+        print(f"  {name} = {parameter['value']!r}")
+
+# main.py sweep: grid_options are the --param values ("name=1,2,3", "name=10:50:5")
+def run_sweep(script_path, grid_options, output_dir = None, workers = None):
+    if not grid_options:
+        print_parameters(script_path)
+        return []
+    try:
+        grid = dict(parse_grid_option(option) for option in grid_options)
+        sweep = Sweep(script_path, grid, output_dir, workers)
+    except (ValueError, SyntaxError) as e:
+        print(f"{C.RED}ERROR: {e}{C.END}")
+        return []
+    return sweep.run()
@@ -0,0 +1,46 @@
+import os
+import stat
+
+import pytest
+
+from artifact_store import ArtifactStore
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    # the way the engines write a file: temporary name, then os.replace
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(f"{path}.tmp", path)
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / "store.sqlite"), str(tmp_path / "blobs"))
+
+# two projects with the same script share one blob; replacing the file of one doesn't touch the other
+def test_deduplicated_projects_keep_their_content(store, tmp_path):
+    first = str(tmp_path / "model" / "part_v1" / "part_v1.py")
+    second = str(tmp_path / "model" / "part_v2" / "part_v2.py")
+    _write(first, "result = 1\n")
+    _write(second, "result = 1\n")
+    store.add_file("model", "part_v1", "script", first)
+    store.add_file("model", "part_v2", "script", second)
+    assert os.path.samefile(first, second)
+    assert store.deduplicated == 1
+    for path in (first, second):
+        assert not os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+    _write(second, "result = 2\n")
+    store.add_file("model", "part_v2", "script", second)
+    with open(first, encoding="utf-8") as f:
+        assert f.read() == "result = 1\n"
+    with open(second, encoding="utf-8") as f:
+        assert f.read() == "result = 2\n"
+
+# an edit in place of a stored file is refused (root ignores the permissions)
+@pytest.mark.skipif(not hasattr(os, "geteuid") or os.geteuid() == 0, reason = "root can write read-only files")
+def test_stored_file_is_read_only(store, tmp_path):
+    path = str(tmp_path / "model" / "part_v1" / "part_v1.py")
+    _write(path, "result = 1\n")
+    store.add_file("model", "part_v1", "script", path)
+    with pytest.raises(PermissionError):
+        open(path, "w").close()
@@ -0,0 +1,69 @@
+import sys
+import subprocess
+
+import pytest
+
+import config
+import freecad_pool
+from freecad_pool import get_freecad_pool
+
+# the pool with the stand-in worker: freecad_worker.py run by a plain python interpreter, no FreeCAD needed
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(config, "FREECAD_WORKER_COMMAND", [sys.executable])
+    monkeypatch.setattr(config, "FREECAD_POOL_SIZE", 1)
+    monkeypatch.setattr(freecad_pool, "_pool", None)
+    monkeypatch.setattr(freecad_pool, "_pool_failed", False)
+    pool = get_freecad_pool()
+    yield pool
+    pool.close()
+
+def _write_script(tmp_path, name, source):
+    script = tmp_path / name
+    script.write_text(source, encoding="utf-8")
+    return str(script)
+
+def test_run_script(pool, tmp_path):
+    returncode, log = pool.run_script(_write_script(tmp_path, "ok.py", "print('FREECAD_SUCCESS')\n"), 30)
+    assert returncode == 0
+    assert "FREECAD_SUCCESS" in log
+
+    returncode, log = pool.run_script(_write_script(tmp_path, "fail.py", "import sys\nsys.exit(1)\n"), 30)
+    assert returncode == 1
+
+# the worker process dies in the middle of the script: error result, the next script gets a new worker
+def test_worker_crash(pool, tmp_path):
+    returncode, log = pool.run_script(_write_script(tmp_path, "crash.py", "import os\nos._exit(3)\n"), 30)
+    assert returncode == 1
+    assert "crashed" in log
+    assert pool.recycled == 1
+
+    returncode, log = pool.run_script(_write_script(tmp_path, "ok.py", "print('FREECAD_SUCCESS')\n"), 30)
+    assert returncode == 0
+
+def test_timeout(pool, tmp_path):
+    with pytest.raises(subprocess.TimeoutExpired):
+        pool.run_script(_write_script(tmp_path, "slow.py", "import time\ntime.sleep(60)\n"), 1)
+    assert pool.recycled == 1
+
+    returncode, log = pool.run_script(_write_script(tmp_path, "ok.py", "print('FREECAD_SUCCESS')\n"), 30)
+    assert returncode == 0
+
+# the replacement of a crashed worker can't be started: the slot is not lost, the next script starts it again
+def test_failed_respawn_keeps_the_slot(pool, tmp_path, monkeypatch):
+    worker_class = freecad_pool.FreeCADWorker
+    def broken_worker(command):
+        raise OSError("no FreeCAD")
+    monkeypatch.setattr(freecad_pool, "FreeCADWorker", broken_worker)
+    returncode, log = pool.run_script(_write_script(tmp_path, "crash.py", "import os\nos._exit(3)\n"), 30)
+    assert returncode == 1
+    returncode, log = pool.run_script(_write_script(tmp_path, "ok.py", "print('FREECAD_SUCCESS')\n"), 30)
+    assert returncode == 1
+    assert "unable to start" in log
+    assert pool.idle.qsize() == 1
+
+    monkeypatch.setattr(freecad_pool, "FreeCADWorker", worker_class)
+    returncode, log = pool.run_script(_write_script(tmp_path, "ok.py", "print('FREECAD_SUCCESS')\n"), 30)
+    assert returncode == 0
+    assert pool.idle.qsize() == 1
@@ -0,0 +1,17 @@
+import cadquery as cq
+
+import geometrical_analysis
+from geometrical_analysis import analyze_geometry, shape_hash
+
+# the analysis tessellates the shape: the second analysis of the same workplane must be a cache hit
+def test_analysis_is_memoized():
+    geometrical_analysis.clear_geometry_cache()
+    part = cq.Workplane("XY").box(10, 10, 10).faces(">Z").hole(3)
+    first = analyze_geometry(part)
+    assert analyze_geometry(part) == first
+    assert len(geometrical_analysis._cache) == 1
+
+def test_shape_hash():
+    box = cq.Workplane("XY").box(1, 2, 3).val()
+    assert shape_hash(box) == shape_hash(cq.Workplane("XY").box(1, 2, 3).val())
+    assert shape_hash(box) != shape_hash(cq.Workplane("XY").box(1, 2, 4).val())
@@ -0,0 +1,81 @@
+import time
+import threading
+
+import pytest
+
+import config
+from mock_openrouter import MockOpenRouter, DEFAULT_SCRIPT, start_mock_server
+from scheduler_engine import RequestScheduler, StreamBudgetExceeded, RequestCancelled
+
+# the scheduler against the local mock of the OpenRouter endpoint (mock_openrouter.py), no network needed
+
+MODEL = "mock/model"
+MESSAGES = [{"role": "user", "content": "a box"}]
+
+@pytest.fixture
+def mock():
+    mock = MockOpenRouter()
+    server, base_url = start_mock_server(mock)
+    mock.base_url = base_url
+    yield mock
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def scheduler(mock, monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "mock-key")
+    monkeypatch.setattr(config, "OPENROUTER_BASE_URL", mock.base_url)
+    monkeypatch.setattr(config, "API_RATE_LIMITS", {"default": (1000.0, 1000)})
+    monkeypatch.setattr(config, "API_BACKOFF_BASE_S", 0.01)
+    scheduler = RequestScheduler()     # its own loop and client, not the shared one of get_scheduler()
+    yield scheduler
+    scheduler.loop.call_soon_threadsafe(scheduler.loop.stop)
+    scheduler.thread.join(5)
+
+def test_stream(scheduler, mock):
+    content, stats = scheduler.complete(MODEL, MESSAGES, stream = True)
+    assert content == DEFAULT_SCRIPT
+    assert stats["ttft_s"] is not None and stats["ttft_s"] >= 0
+    assert stats["completion_tokens"] > 0
+
+# over the token budget: StreamBudgetExceeded at once, the request is not sent again
+def test_stream_max_tokens(scheduler, mock, monkeypatch):
+    monkeypatch.setattr(config, "STREAM_MAX_TOKENS", 3)
+    run_data = {"Transport_Retries": 0}
+    with pytest.raises(StreamBudgetExceeded) as error:
+        scheduler.complete(MODEL, MESSAGES, stream = True, run_data = run_data)
+    assert error.value.stats["tokens"] == 4
+    assert mock.requests == 1
+    assert run_data["Transport_Retries"] == 0
+
+def test_stream_max_seconds(scheduler, mock, monkeypatch):
+    monkeypatch.setattr(config, "STREAM_MAX_SECONDS", 0.5)
+    mock.token_delay = 0.1     # ~ 40 s for the whole script
+    run_data = {"Transport_Retries": 0}
+    start = time.time()
+    with pytest.raises(StreamBudgetExceeded):
+        scheduler.complete(MODEL, MESSAGES, stream = True, run_data = run_data)
+    assert time.time() - start < 5
+    assert mock.requests == 1
+    assert run_data["Transport_Retries"] == 0
+
+# a 429 is a transport error: retried after Retry-After, counted in the run record
+def test_rate_limit_retry(scheduler, mock):
+    mock.responses = [{"status": 429, "retry_after": 0.2}, DEFAULT_SCRIPT]
+    run_data = {"Transport_Retries": 0}
+    start = time.time()
+    content, stats = scheduler.complete(MODEL, MESSAGES, stream = False, run_data = run_data)
+    assert content == DEFAULT_SCRIPT
+    assert time.time() - start >= 0.2
+    assert mock.requests == 2
+    assert run_data["Transport_Retries"] == 1
+    assert scheduler.transport_retries == 1
+
+def test_cancel(scheduler, mock):
+    mock.latency = 5
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+    start = time.time()
+    with pytest.raises(RequestCancelled):
+        scheduler.complete(MODEL, MESSAGES, stream = True, cancel_event = cancel_event)
+    assert time.time() - start < 2
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+import cadquery as cq
+
+from sweep_engine import Sweep, find_parameters, parse_grid_option
+
+SCRIPT = """import cadquery as cq
+
+size = 10
+offset = 0
+unused = 1
+
+result = cq.Workplane("XY").box(size, size, size).translate((offset, 0, 0))
+"""
+
+def _write_script(tmp_path):
+    script = tmp_path / "part.py"
+    script.write_text(SCRIPT, encoding="utf-8")
+    return str(script)
+
+def test_find_parameters():
+    assert {name: parameter["value"] for name, parameter in find_parameters(SCRIPT).items()} == {"size": 10, "offset": 0, "unused": 1}
+
+def test_parse_grid_option():
+    assert parse_grid_option("offset=0:20:10") == ("offset", [0, 10, 20])
+    assert parse_grid_option("size=1.5,2") == ("size", [1.5, 2])
+
+# the same solid at different positions is a different result: every variant gets its own STEP file
+def test_sweep_over_a_translation(tmp_path):
+    rows = Sweep(_write_script(tmp_path), {"offset": [0, 50, 100]}, str(tmp_path / "out"), workers = 1).run()
+
+    assert [row["status"] for row in rows] == ["SUCCESS"] * 3
+    assert len({row["fingerprint"] for row in rows}) == 3
+    assert not any(row["duplicate_of"] for row in rows)
+    for row in rows:
+        box = cq.importers.importStep(row["step"]).val().BoundingBox()
+        assert abs(box.xmin - (row["offset"] - 5)) < 1e-3
+
+# a parameter that doesn't change the geometry: exported once, the other variants are links to that file
+def test_sweep_links_identical_geometry(tmp_path):
+    rows = Sweep(_write_script(tmp_path), {"unused": [1, 2]}, str(tmp_path / "out"), workers = 1).run()
+
+    assert [row["status"] for row in rows] == ["SUCCESS"] * 2
+    assert rows[0]["fingerprint"] == rows[1]["fingerprint"]
+    assert rows[1]["duplicate_of"] == "part_0000.step"
+
+# a second sweep can't write into the files (and the hard links) of the first one
+def test_sweep_keeps_linked_files_apart(tmp_path):
+    output_dir = str(tmp_path / "out")
+    script = _write_script(tmp_path)
+    rows = Sweep(script, {"unused": [1, 2]}, output_dir, workers = 1).run()
+    first_step, linked_step = rows[0]["step"], rows[1]["step"]
+    assert os.path.samefile(first_step, linked_step)
+
+    with pytest.raises(ValueError):
+        Sweep(script, {"size": [10, 20]}, output_dir, workers = 1)
+
+    # a new file replaces the link, the variant it pointed to is untouched
+    Sweep(script, {"size": [20]}, str(tmp_path / "other"), workers = 1)._write_step_bytes(linked_step, b"new")
+    assert not os.path.samefile(first_step, linked_step)
+    box = cq.importers.importStep(first_step).val().BoundingBox()
+    assert abs(box.xlen - 10) < 1e-3
+    with open(linked_step, "rb") as f:
+        assert f.read() == b"new"
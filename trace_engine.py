@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+import config
+
+# Span based timing of the pipeline stages (generate, test_exec, analyze, export, ...).
+#   with span("generate", run_data):
+#       ...
+# - the duration is added to run_data["Stage_Times"] and to the current attempt in run_data["Attempt_Times"]
+# - if a trace file is requested (config.TRACE_ENABLED), every span also becomes a Chrome trace event,
+#   so the whole benchmark can be opened in chrome://tracing or ui.perfetto.dev
+# With tracing off and no run_data, span() returns a shared empty context: the cost is one function call.
+
+_NULL_SPAN = nullcontext()
+_events = []
+_events_lock = threading.Lock()
+_trace_start = time.perf_counter()
+
+class _Span:
+
+    __slots__ = ("name", "run_data", "args", "start")
+
+    def __init__(self, name, run_data, args):
+        self.name = name
+        self.run_data = run_data
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        duration = end - self.start
+
+        if self.run_data is not None:
+            add_stage_time(self.run_data, self.name, duration)
+
+        if config.TRACE_ENABLED:
+            args = dict(self.args)
+            if self.run_data is not None:
+                args.setdefault("model", self.run_data.get("Model"))
+                args.setdefault("project", self.run_data.get("Project_Name"))
+                args.setdefault("attempt", self.run_data.get("Attempts"))
+            if exc_type is not None:
+                args["error"] = exc_type.__name__
+            event = {
+                "name": self.name,
+                "cat": "qtc",
+                "ph": "X",                                          # complete event
+                "ts": round((self.start - _trace_start) * 1e6),     # microseconds
+                "dur": round(duration * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args
+            }
+            with _events_lock:
+                _events.append(event)
+        return False    # exceptions are never swallowed
+
+def span(name, run_data = None, **args):
+    if run_data is None and not config.TRACE_ENABLED:
+        return _NULL_SPAN
+    return _Span(name, run_data, args)
+
+# called by request_manager at the beginning of every attempt
+def start_attempt(run_data, attempt):
+    run_data["Attempts"] = attempt
+    run_data["Attempt_Times"].append({"attempt": attempt})
+
+def add_stage_time(run_data, name, duration):
+    stage_times = run_data["Stage_Times"]
+    stage_times[name] = round(stage_times.get(name, 0) + duration, 3)
+    if run_data["Attempt_Times"]:
+        attempt_times = run_data["Attempt_Times"][-1]
+        attempt_times[name] = round(attempt_times.get(name, 0) + duration, 3)
+
+# Chrome trace / Perfetto json file with every span recorded since the start (or the last write)
+def write_trace(trace_path = None):
+    if not config.TRACE_ENABLED:
+        return None
+    with _events_lock:
+        events = list(_events)
+        _events.clear()
+    if not events:
+        return None
+
+    if trace_path is None:
+        os.makedirs(config.TRACE_DIR, exist_ok = True)
+        trace_path = f"{config.TRACE_DIR}/trace_{time.strftime('%Y%m%d_%H%M%S')}.json"
+
+    # thread names, so every model/worker gets a readable lane
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    metadata = [
+        {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": names.get(tid, str(tid))}}
+        for tid in {event["tid"] for event in events}
+    ]
+
+    with open(trace_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+    print(f"Trace saved in {trace_path} (open it with ui.perfetto.dev)")
+    return trace_path
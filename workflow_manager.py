@@ -1,57 +1,71 @@
-import os, time
+import time
 
 from freecad_engine import freecad_workflow
 from cadquery_engine import cadquery_workflow
 from api_engine import generate_cad_code
+from code_validator import validate_code, detect_engine, count_rejected
+from trace_engine import span, start_attempt
+from speculative_engine import run_candidates, record_run
+from memory_engine import track_memory
+from artifact_store import create_project_folder, store_artifacts
+from retrieval_engine import add_example
+import config
 from config import OUTPUT_DIR, MAX_RETRIES, Colors as C
 
-# it selects which geometrical engine AI has choosen
-def detect_engine(code):
-    if "import FreeCAD" in code or "import Part" in code:
-        return "FreeCAD"
-    else:
-        return "CadQuery"
+# creating project output folder with object version check
+# the version is allocated by the artifact store index (artifact_store.py), no probing of v1, v2, ...
+def create_output_folder(output_dir, model_name, name_base):
+    return create_project_folder(output_dir, model_name, name_base)
 
 # Generation -> Fix Attempts -> Final Execution
 def request_manager(run_data, user_input, orcode):
     print("The workflow manager has taken charge of the request.")
-    start_gen = time.time()
 
+    with track_memory(run_data), span("request", run_data):
+        attempts_loop(run_data, user_input, orcode)
+
+    # API latency and CAD kernel time are reported separately
+    stage_times = run_data["Stage_Times"]
+    run_data["Gen_Time_s"] = round(stage_times.get("generate", 0), 2)
+    run_data["Exec_Time_s"] = round(stage_times.get("test_exec", 0) + stage_times.get("finalize", 0), 2)
+    run_data["Total_Time_s"] = round(stage_times.get("request", 0), 2)
+    record_run(run_data)
+
+def attempts_loop(run_data, user_input, orcode):
+    start = time.perf_counter()
     code = None
+    error_log = None
     last_error = None
 
     for attempt in range(1, MAX_RETRIES+1):
         print(f"\n{C.BOLD}API call: attempt {attempt}/{MAX_RETRIES}{C.END}")
+        start_attempt(run_data, attempt)
 
-        # if it's not the first attempt, we add the error and the previus code
-        # generate_cad_code() has to check if the code works
-        
-        if attempt > 1:
-            code = generate_cad_code(user_input, orcode, run_data, error_log, code)
+        if config.SPECULATIVE_CANDIDATES > 1:
+            # N candidates at the same time, the first one that passes the test wins (speculative_engine.py)
+            previous_code, previous_error = (code, error_log) if attempt > 1 and code else (None, None)
+            generate = lambda scratch, index, cancel_event: generate_cad_code(user_input, orcode, scratch, previous_error, previous_code,
+                                                                              candidate = index, cancel_event = cancel_event)
+            success, code, error_log, part, engine = run_candidates(run_data, config.SPECULATIVE_CANDIDATES, generate, test_code)
         else:
-            code = generate_cad_code(user_input, orcode, run_data) 
+            # if it's not the first attempt, we add the error and the previus code
+            # generate_cad_code() has to check if the code works
+            if attempt > 1 and code:
+                code = generate_cad_code(user_input, orcode, run_data, error_log, code)
+            else:
+                code = generate_cad_code(user_input, orcode, run_data)
+
+            success, error_log, part, engine = test_code(run_data, code) if code else (False, "", None, None)
 
         if not code:
             print(f"{C.YELLOW}WARNING: API returned empty code. Retrying...{C.END}")
             continue
 
-        engine = detect_engine(code)
-        print(f"Code generated, testing with {engine}.")
-
-        success = False
-        error_log = ""
-
-        if engine == "FreeCAD":
-            # ANCORA DA FARE!!!
-            success, error_log = freecad_workflow(run_data, code, testing = True)
-        else:
-            # ANCORA DA FARE!!!
-            success, error_log = cadquery_workflow(run_data, code, testing = True)
-
         if success:
-            run_data["Gen_Time_s"] = round(time.time() - start_gen, 2)
             print(f"{C.GREEN}SUCCESS: test passed, the code is valid.{C.END}")
-            save_file(run_data, code, engine, user_input)
+            run_data["Time_To_Valid_s"] = round(time.perf_counter() - start, 2)
+            with span("finalize", run_data, engine = engine):
+                save_file(run_data, code, engine, user_input, part)
             return
         else:
             print(f"{C.YELLOW}WARNING: test failed with error {error_log[:100]}{C.END}")
@@ -61,8 +75,43 @@ def request_manager(run_data, user_input, orcode):
                 run_data["Status"] = "FAILED_RETRIES"
                 run_data["Error_Log"] = last_error      
 
+# Validation + test execution of one generated code
+# cancel_event (speculative candidates): the sandbox or FreeCAD worker is killed when another candidate wins
+# Returns: (bool: success, str: error_log, part: CadQuery object built by the test or None, str: engine)
+def test_code(run_data, code, cancel_event = None):
+    success = False
+    error_log = ""
+    part = None # CadQuery object built during the test, reused by save_file()
+
+    # code that can't work is rejected before any execution, its error goes to the repair prompt
+    validation = None
+    if config.VALIDATOR_ENABLED:
+        with span("validate", run_data):
+            validation = validate_code(code)
+
+    if validation is not None and not validation["ok"]:
+        engine = validation["engine"] or detect_engine(code)
+        count_rejected(engine)
+        run_data["Validator_Rejects"] += 1
+        run_data["Status"] = validation["status"]
+        error_log = validation["error"]
+        run_data["Error_Log"] = error_log.splitlines()[-1]
+        print(f"Code rejected by the validator ({validation['status']}), {engine} execution skipped.")
+        return success, error_log, part, engine
+
+    engine = validation["engine"] if validation else detect_engine(code)
+    print(f"Code generated, testing with {engine}.")
+
+    with span("test_exec", run_data, engine = engine):
+        if engine == "FreeCAD":
+            success, error_log = freecad_workflow(run_data, code, testing = True, cancel_event = cancel_event)
+        else:
+            success, error_log, part = cadquery_workflow(run_data, code, testing = True, cancel_event = cancel_event)
+    return success, error_log, part, engine
+
 # it's called only if the code works correcly
-def save_file(run_data, code, engine, user_input):
+# part is the CadQuery object already validated by the test (no second execution)
+def save_file(run_data, code, engine, user_input, part = None):
     model_name = run_data["Model"]
     project_name = run_data["Project_Name"]
 
@@ -75,6 +124,11 @@ def save_file(run_data, code, engine, user_input):
     run_data["Code_Lines"] = len(code.splitlines()) # counting code lines
 
     if engine == "CadQuery":
-        cadquery_workflow(run_data, code, testing = False)
+        cadquery_workflow(run_data, code, testing = False, part = part)
     elif engine == "FreeCAD":
-        freecad_workflow(run_data, code, testing = False)
\ No newline at end of file
+        freecad_workflow(run_data, code, testing = False)
+
+    # after the engine: FreeCAD writes the script again, a stored file is never written in place
+    store_artifacts(run_data, {"script": script_path})
+    # a working script is a few-shot example for the next similar requests
+    add_example(run_data, user_input, code)
\ No newline at end of file